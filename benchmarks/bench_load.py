@@ -0,0 +1,315 @@
+"""
+负载基准测试
+启动本地模拟服务(五种线路格式),在设定的并发度下驱动 chat / chat_stream / simple_chat /
+MultiModelAPIClient / 多轮 Agent 流程,以JSON输出吞吐、p50/p95/p99延迟与首字延迟(TTFT),
+可与上一次的结果对比以发现性能回退.
+
+用法:
+    python benchmarks/bench_load.py --requests 200 --concurrency 1 16 64 --output result.json
+    python benchmarks/bench_load.py --providers openai claude --scenarios chat stream --baseline result.json
+    python benchmarks/bench_load.py --latency 0.05 --jitter 0.02 --error-rate 0.02 --rate-429 0.01
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, "shell", "pyshell"))
+
+from mock_server import MockProviderServer  # noqa: E402
+from llmapiconfig.llm_client import chat, chat_stream, shutdown, simple_chat  # noqa: E402
+from llmapiconfig.settings import LLMConfig, settings  # noqa: E402
+
+PROVIDERS = ["openai", "claude", "qwen", "zhipu", "gemini"]
+SCENARIOS = ["chat", "stream", "simple_chat", "api_client", "agent"]
+# 与提供商无关的场景只用第一个提供商跑一次
+PROVIDER_AGNOSTIC = {"agent"}
+
+
+def percentiles(samples: List[float]) -> Optional[Dict[str, float]]:
+    """返回毫秒为单位的 p50/p95/p99/均值"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "p50": round(pick(0.50), 3),
+        "p95": round(pick(0.95), 3),
+        "p99": round(pick(0.99), 3),
+        "mean": round(statistics.mean(ordered) * 1000, 3),
+    }
+
+
+class Sample:
+    __slots__ = ("latency", "ttft", "error")
+
+    def __init__(self, latency: float, ttft: Optional[float] = None, error: Optional[str] = None):
+        self.latency = latency
+        self.ttft = ttft
+        self.error = error
+
+
+async def run_async(total: int, concurrency: int, one: Callable[[int], Awaitable[Optional[float]]]) -> List[Sample]:
+    """以固定并发度执行 total 次 one(i);one 返回TTFT(非流式场景返回 None)"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(index: int) -> Sample:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ttft = await one(index)
+            except Exception as exc:  # noqa: BLE001
+                return Sample(time.perf_counter() - start, error=type(exc).__name__)
+            return Sample(time.perf_counter() - start, ttft)
+
+    return await asyncio.gather(*(worker(i) for i in range(total)))
+
+
+def messages_for(index: int) -> List[Dict[str, str]]:
+    # 每个请求内容不同,避免被响应缓存或请求合并吸收
+    return [
+        {"role": "system", "content": "你是一个测试助手"},
+        {"role": "user", "content": f"ping #{index}"},
+    ]
+
+
+async def scenario_chat(provider: str, total: int, concurrency: int) -> List[Sample]:
+    async def one(index: int) -> None:
+        await chat(messages_for(index), provider=provider)
+
+    return await run_async(total, concurrency, one)
+
+
+async def scenario_stream(provider: str, total: int, concurrency: int) -> List[Sample]:
+    async def one(index: int) -> Optional[float]:
+        start = time.perf_counter()
+        ttft = None
+        async for _delta in chat_stream(messages_for(index), provider=provider):
+            if ttft is None:
+                ttft = time.perf_counter() - start
+        return ttft
+
+    return await run_async(total, concurrency, one)
+
+
+async def scenario_simple_chat(provider: str, total: int, concurrency: int) -> List[Sample]:
+    async def one(index: int) -> None:
+        await simple_chat(f"ping #{index}", provider=provider)
+
+    return await run_async(total, concurrency, one)
+
+
+def scenario_api_client(provider: str, total: int, concurrency: int) -> List[Sample]:
+    """同步门面:concurrency 个线程各自阻塞调用 call_api"""
+    from api_client import MultiModelAPIClient
+
+    client = MultiModelAPIClient(provider)
+
+    def one(index: int) -> Sample:
+        start = time.perf_counter()
+        try:
+            client.call_api("你是一个测试助手", f"ping #{index}")
+        except Exception as exc:  # noqa: BLE001
+            return Sample(time.perf_counter() - start, error=type(exc).__name__)
+        return Sample(time.perf_counter() - start)
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(one, range(total)))
+
+
+AGENT_TOOL = "echo_tool"
+
+
+def agent_responder(provider: str, prompt: str) -> Optional[str]:
+    """模拟 Agent 各轮的回复:选工具 -> 参数检查 -> 生成命令;其他提示词返回 None"""
+    if "注册表" in prompt:
+        return json.dumps({"status": "need_params_check", "tool_name": AGENT_TOOL, "doc_path": f"cli-lib/docs/{AGENT_TOOL}.md"})
+    if "required: yes" in prompt and "必须参数" in prompt:
+        return json.dumps({"status": "params_complete"})
+    if "生成具体的执行命令" in prompt:
+        return json.dumps({"status": "execute_command", "command": "echo ok", "working_directory": "."})
+    return None
+
+
+def agent_workspace() -> str:
+    """创建供 Agent 流程读取的临时 prompt/ 与 cli-lib/ 目录"""
+    root = tempfile.mkdtemp(prefix="bench-agent-")
+    os.makedirs(os.path.join(root, "prompt"))
+    os.makedirs(os.path.join(root, "cli-lib", "docs"))
+    with open(os.path.join(root, "prompt", "agent.md"), "w", encoding="utf-8") as f:
+        f.write("你是CLI工具调度助手")
+    with open(os.path.join(root, "cli-lib", "agents.json"), "w", encoding="utf-8") as f:
+        json.dump({"bench": {"system_prompt_path": "prompt/agent.md"}}, f)
+    tools = {f"tool_{i}": {"description": f"测试工具{i}", "doc_path": f"cli-lib/docs/tool_{i}.md"} for i in range(30)}
+    tools[AGENT_TOOL] = {"description": "回显测试工具 echo", "doc_path": f"cli-lib/docs/{AGENT_TOOL}.md"}
+    with open(os.path.join(root, "cli-lib", "main.json"), "w", encoding="utf-8") as f:
+        json.dump(tools, f, ensure_ascii=False)
+    with open(os.path.join(root, "cli-lib", "docs", f"{AGENT_TOOL}.md"), "w", encoding="utf-8") as f:
+        f.write(f"# {AGENT_TOOL}\n\n### -text\n- description: 回显内容\n- required: yes\n")
+    return root
+
+
+async def scenario_agent(provider: str, total: int, concurrency: int) -> List[Sample]:
+    import agent_framework
+    from api_client import MultiModelAPIClient
+
+    agent_framework.project_root = agent_workspace()
+    agent_framework.api_client = MultiModelAPIClient(provider)
+
+    async def one(index: int) -> None:
+        result = json.loads(await agent_framework.async_call_agent_multi_turn("bench", f"回显 {index}"))
+        if result.get("status") != "success":
+            raise RuntimeError(result.get("error") or result.get("status"))
+
+    # Agent 流程会打印每轮提示词,测量时丢弃
+    with contextlib.redirect_stdout(io.StringIO()):
+        return await run_async(total, concurrency, one)
+
+
+async def run_scenario(name: str, provider: str, total: int, concurrency: int) -> List[Sample]:
+    if name == "api_client":
+        return await asyncio.get_running_loop().run_in_executor(None, scenario_api_client, provider, total, concurrency)
+    runner = {
+        "chat": scenario_chat,
+        "stream": scenario_stream,
+        "simple_chat": scenario_simple_chat,
+        "agent": scenario_agent,
+    }[name]
+    return await runner(provider, total, concurrency)
+
+
+def summarize(name: str, provider: str, concurrency: int, samples: List[Sample], elapsed: float) -> Dict[str, Any]:
+    ok = [sample for sample in samples if sample.error is None]
+    errors: Dict[str, int] = {}
+    for sample in samples:
+        if sample.error is not None:
+            errors[sample.error] = errors.get(sample.error, 0) + 1
+    return {
+        "scenario": name,
+        "provider": provider,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "succeeded": len(ok),
+        "errors": errors,
+        "elapsed": round(elapsed, 4),
+        "throughput": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": percentiles([sample.latency for sample in ok]),
+        "ttft_ms": percentiles([sample.ttft for sample in ok if sample.ttft is not None]),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str) -> List[Dict[str, Any]]:
+    """与基线结果逐项对比,返回相对基线的百分比变化(吞吐为负、延迟为正表示回退)"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {
+            (item["scenario"], item["provider"], item["concurrency"]): item for item in json.load(f)["results"]
+        }
+    deltas = []
+    for item in results:
+        base = baseline.get((item["scenario"], item["provider"], item["concurrency"]))
+        if base is None:
+            continue
+
+        def change(new: Optional[float], old: Optional[float]) -> Optional[float]:
+            return round((new - old) / old * 100, 1) if new is not None and old else None
+
+        deltas.append({
+            "scenario": item["scenario"],
+            "provider": item["provider"],
+            "concurrency": item["concurrency"],
+            "throughput_pct": change(item["throughput"], base["throughput"]),
+            "p50_pct": change((item["latency_ms"] or {}).get("p50"), (base["latency_ms"] or {}).get("p50")),
+            "p95_pct": change((item["latency_ms"] or {}).get("p95"), (base["latency_ms"] or {}).get("p95")),
+            "p99_pct": change((item["latency_ms"] or {}).get("p99"), (base["latency_ms"] or {}).get("p99")),
+            "ttft_p50_pct": change((item["ttft_ms"] or {}).get("p50"), (base["ttft_ms"] or {}).get("p50")),
+        })
+    return deltas
+
+
+async def main_async(args, server: MockProviderServer) -> List[Dict[str, Any]]:
+    results = []
+    for name in args.scenarios:
+        providers = args.providers[:1] if name in PROVIDER_AGNOSTIC else args.providers
+        for provider in providers:
+            for concurrency in args.concurrency:
+                await run_scenario(name, provider, min(concurrency, args.requests), concurrency)  # 预热连接
+                start = time.perf_counter()
+                samples = await run_scenario(name, provider, args.requests, concurrency)
+                summary = summarize(name, provider, concurrency, samples, time.perf_counter() - start)
+                results.append(summary)
+                latency = summary["latency_ms"] or {}
+                print(
+                    f"{name:<12} {provider:<7} c={concurrency:<4} {summary['throughput']:>9.1f} req/s  "
+                    f"p50 {latency.get('p50', 0):>8.2f}ms  p99 {latency.get('p99', 0):>8.2f}ms  "
+                    f"失败 {summary['requests'] - summary['succeeded']}",
+                    file=sys.stderr,
+                )
+    await shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="llmapiconfig 负载基准(本地模拟服务)")
+    parser.add_argument("--providers", nargs="+", default=PROVIDERS, choices=PROVIDERS)
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--requests", type=int, default=200, help="每个场景/提供商/并发度组合的请求数")
+    parser.add_argument("--latency", type=float, default=0.01, help="模拟服务首字节前的固定延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="附加的随机延迟上限(秒)")
+    parser.add_argument("--chunks", type=int, default=8, help="流式响应的数据块数")
+    parser.add_argument("--chunk-interval", type=float, default=0.002, help="数据块间隔(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的概率")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="返回429的概率")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="429响应的 Retry-After(秒)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果JSON写入的文件(默认输出到stdout)")
+    parser.add_argument("--baseline", help="用于对比的上一次结果JSON")
+    args = parser.parse_args()
+
+    server = MockProviderServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        chunks=args.chunks,
+        chunk_interval=args.chunk_interval,
+        error_rate=args.error_rate,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        responder=lambda provider, prompt: agent_responder(provider, prompt) or "ok" * args.chunks,
+        seed=args.seed,
+    )
+    with server:
+        for provider, base_url in server.provider_urls().items():
+            setattr(settings, provider, LLMConfig(api_key="bench", base_url=base_url, model="mock"))
+        results = asyncio.run(main_async(args, server))
+        report: Dict[str, Any] = {
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "server": server.stats(),
+            "results": results,
+        }
+    if args.baseline:
+        report["comparison"] = compare(results, args.baseline)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+单次调用开销基准测试
+测量客户端在网络之外花费的时间:创建 LLMClient、构造请求体、解析非流式响应/流式数据块/用量,
+并对比预先计算的请求头和URL(Endpoint 缓存)与每次调用重新构建的差别.
+最后对本地模拟服务(零延迟)发送真实请求,得到包含HTTP往返的单次调用耗时.
+
+"local" 是用 register_provider() 接入的兼容 OpenAI 接口的自定义提供商,与内置提供商走同一路径.
+
+用法: python benchmarks/bench_overhead.py [--iterations 20000] [--requests 200]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from mock_server import MockProviderServer, _Handler  # noqa: E402
+from llmapiconfig.llm_client import LLMClient, chat, shutdown  # noqa: E402
+from llmapiconfig.providers import get_adapter, register_provider  # noqa: E402
+from llmapiconfig.settings import LLMConfig, settings  # noqa: E402
+
+PROVIDERS = ["openai", "claude", "qwen", "zhipu", "gemini", "local"]
+
+# 一段典型的多轮对话
+MESSAGES = [
+    {"role": "system", "content": "你是一个Shell助手,回答简洁准确."},
+    {"role": "user", "content": "如何查看磁盘占用?"},
+    {"role": "assistant", "content": "使用 df -h 查看各分区,du -sh * 查看当前目录下各项的大小."},
+    {"role": "user", "content": "只看当前目录呢?"},
+]
+
+# 各格式的一个流式内容数据块
+CHUNKS = {
+    "openai": {"choices": [{"index": 0, "delta": {"content": "du"}}]},
+    "claude": {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "du"}},
+    "qwen": {"output": {"choices": [{"message": {"role": "assistant", "content": "du"}}]}},
+    "gemini": {"candidates": [{"content": {"role": "model", "parts": [{"text": "du"}]}}]},
+}
+
+
+def wire_format(provider: str) -> str:
+    """模拟服务中对应的响应格式(智谱与自定义提供商同 OpenAI)"""
+    return provider if provider in ("claude", "qwen", "gemini") else "openai"
+
+
+def per_call(func: Callable[[], object], iterations: int) -> float:
+    """返回单次调用的微秒数"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def configure(urls: Dict[str, str]) -> None:
+    for provider, base_url in urls.items():
+        setattr(settings, provider, LLMConfig(api_key="bench", base_url=base_url, model="mock"))
+    register_provider("local", LLMConfig(api_key="", base_url=urls["openai"], model="mock"))
+
+
+def measure_client(iterations: int) -> None:
+    print(f"客户端开销(微秒/次, {iterations} 次迭代)")
+    print(f"{'提供商':<8}{'创建客户端':>10}{'Endpoint缓存':>14}{'重建Endpoint':>14}{'构造请求':>10}"
+          f"{'解析响应':>10}{'解析数据块':>12}{'解析用量':>10}")
+    for provider in PROVIDERS:
+        config = settings.get_config(provider)
+        adapter = get_adapter(provider)
+        fmt = wire_format(provider)
+        response = _Handler._completion(fmt, {}, "du -sh .", (120, 8))
+        chunk = CHUNKS[fmt]
+        options = {"temperature": 0.2}
+        row = [
+            per_call(lambda: LLMClient(provider), iterations),
+            per_call(lambda: adapter.endpoint(config), iterations),
+            per_call(lambda: adapter.make_endpoint(config), iterations),
+            per_call(lambda: adapter.build_request(config, MESSAGES, False, options), iterations),
+            per_call(lambda: adapter.extract_text(response), iterations),
+            per_call(lambda: adapter.extract_delta(chunk), iterations),
+            per_call(lambda: adapter.extract_usage(response), iterations),
+        ]
+        print(f"{provider:<10}" + "".join(f"{value:>12.2f}" for value in row))
+
+
+async def measure_requests(requests: int) -> None:
+    print(f"\n本地模拟服务单次调用(毫秒, {requests} 次,关闭缓存与请求合并)")
+    for provider in PROVIDERS:
+        latencies: List[float] = []
+        await chat(MESSAGES, provider=provider, use_cache=False, coalesce=False)  # 预热连接
+        for _ in range(requests):
+            start = time.perf_counter()
+            await chat(MESSAGES, provider=provider, use_cache=False, coalesce=False)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+        print(f"{provider:<10}p50 {p50:7.3f}  p95 {p95:7.3f}")
+    await shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单次调用的客户端开销基准")
+    parser.add_argument("--iterations", type=int, default=20000, help="每项微基准的迭代次数")
+    parser.add_argument("--requests", type=int, default=200, help="每个提供商的模拟请求数,0表示跳过")
+    args = parser.parse_args()
+
+    with MockProviderServer(latency=0.0) as server:
+        configure(server.provider_urls())
+        measure_client(args.iterations)
+        if args.requests > 0:
+            asyncio.run(measure_requests(args.requests))
+
+
+if __name__ == "__main__":
+    main()
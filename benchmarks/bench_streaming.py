@@ -0,0 +1,83 @@
+"""
+流式输出基准测试
+对比非流式调用的完整响应时间与 chat_stream() 的首字延迟(TTFT),并测量SSE解析吞吐
+
+用法: python benchmarks/bench_streaming.py [--runs 20] [--chunks 40] [--interval 0.01]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from mock_server import MockProviderServer  # noqa: E402
+from llmapiconfig.llm_client import chat, chat_stream, shutdown  # noqa: E402
+from llmapiconfig.settings import LLMConfig, settings  # noqa: E402
+from llmapiconfig.streaming import SSEParser  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+async def measure(runs: int):
+    full, ttft, last = [], [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await chat(MESSAGES, provider="openai")
+        full.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        first = None
+        async for _delta in chat_stream(MESSAGES, provider="openai"):
+            if first is None:
+                first = time.perf_counter() - start
+        ttft.append(first)
+        last.append(time.perf_counter() - start)
+    await shutdown()
+    return full, ttft, last
+
+
+def bench_parser(events: int = 20000, split: int = 7) -> float:
+    """把SSE流切成 split 字节的小块喂给解析器,返回每秒解析的事件数"""
+    payload = json.dumps({"choices": [{"index": 0, "delta": {"content": "你好,世界"}}]}).encode("utf-8")
+    stream = b"".join(b"data: " + payload + b"\n\n" for _ in range(events))
+    parser = SSEParser()
+    count = 0
+    start = time.perf_counter()
+    for offset in range(0, len(stream), split):
+        count += len(parser.feed(stream[offset:offset + split]))
+    elapsed = time.perf_counter() - start
+    assert count == events
+    return events / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--interval", type=float, default=0.01, help="数据块之间的生成间隔(秒)")
+    parser.add_argument("--latency", type=float, default=0.05, help="首字节前的固定延迟(秒)")
+    args = parser.parse_args()
+
+    with MockProviderServer(latency=args.latency, chunks=args.chunks, chunk_interval=args.interval) as server:
+        settings.openai = LLMConfig(api_key="bench", base_url=f"{server.base_url}/v1", model="mock")
+        full, ttft, last = asyncio.run(measure(args.runs))
+
+    def fmt(values):
+        return f"p50 {statistics.median(values) * 1000:8.1f}ms  max {max(values) * 1000:8.1f}ms"
+
+    print(f"运行次数: {args.runs}, 数据块: {args.chunks} x {args.interval * 1000:.0f}ms, 首字节延迟: {args.latency * 1000:.0f}ms")
+    print(f"非流式 完整响应   {fmt(full)}")
+    print(f"流式   首字(TTFT) {fmt(ttft)}")
+    print(f"流式   最后一字   {fmt(last)}")
+    print(f"SSE解析吞吐(7字节切块): {bench_parser():,.0f} 事件/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+同步调用路径基准测试
+对比每次 asyncio.run(chat(...)) 与后台事件循环上的 MultiModelAPIClient 的单次调用开销
+
+用法: python benchmarks/bench_sync_client.py [--calls 200] [--concurrency 8]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, "shell", "pyshell"))
+
+from mock_server import MockProviderServer  # noqa: E402
+from llmapiconfig.llm_client import LLMClient, chat  # noqa: E402
+from llmapiconfig.settings import LLMConfig, settings  # noqa: E402
+from api_client import MultiModelAPIClient  # noqa: E402
+
+MESSAGES = [
+    {"role": "system", "content": "你是一个测试助手"},
+    {"role": "user", "content": "ping"},
+]
+
+
+async def _fresh_client_chat():
+    """旧实现: 每次调用新建并关闭 AsyncClient"""
+    import httpx
+
+    async with httpx.AsyncClient() as http_client:
+        client = LLMClient("openai", client=http_client)
+        return await client.chat_completion(MESSAGES)
+
+
+def bench_asyncio_run(calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        asyncio.run(_fresh_client_chat())
+    return time.perf_counter() - start
+
+
+def bench_asyncio_run_pooled(calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        asyncio.run(chat(MESSAGES, provider="openai"))
+    return time.perf_counter() - start
+
+
+def bench_facade_serial(client: MultiModelAPIClient, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        client.call_api(MESSAGES[0]["content"], MESSAGES[1]["content"])
+    return time.perf_counter() - start
+
+
+def bench_facade_concurrent(client: MultiModelAPIClient, calls: int, concurrency: int) -> float:
+    start = time.perf_counter()
+    remaining = calls
+    while remaining > 0:
+        batch = min(concurrency, remaining)
+        futures = [client.submit_api(MESSAGES[0]["content"], MESSAGES[1]["content"]) for _ in range(batch)]
+        for future in futures:
+            future.result()
+        remaining -= batch
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟服务的固定延迟(秒)")
+    args = parser.parse_args()
+
+    with MockProviderServer(latency=args.latency) as server:
+        settings.openai = LLMConfig(api_key="bench", base_url=f"{server.base_url}/v1", model="mock")
+        client = MultiModelAPIClient("openai")
+        client.call_api("warmup", "warmup")
+
+        results = [
+            ("asyncio.run + 新建AsyncClient (旧)", bench_asyncio_run(args.calls)),
+            ("asyncio.run + 共享连接池", bench_asyncio_run_pooled(args.calls)),
+            ("后台事件循环 串行", bench_facade_serial(client, args.calls)),
+            (f"后台事件循环 并发x{args.concurrency}", bench_facade_concurrent(client, args.calls, args.concurrency)),
+        ]
+
+        print(f"调用次数: {args.calls}, 模拟延迟: {args.latency * 1000:.1f}ms")
+        for name, elapsed in results:
+            print(f"{name:<32} 总耗时 {elapsed:8.3f}s  单次 {elapsed / args.calls * 1000:8.3f}ms")
+        print(f"服务端累计TCP连接数: {server.connections}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+工具检索索引基准测试
+测量 ToolIndex 的召回率(目标工具是否出现在前k个候选中)、第一轮提示词缩减比例、
+全量构建/增量更新耗时与单次检索耗时.基线是把完整 main.json 放进提示词(召回率恒为100%).
+
+默认使用合成注册表,分别报告三组查询的召回率:
+- 同词:查询与工具描述用同一套词,召回率由构造保证,只作为上限参考;
+- 改写:动词和对象换成描述中没有的说法(同义词、英文缩写、格式名),用于衡量真实召回率;
+- 人工标注:一小组按日常说法手写的指令.
+也可以用真实数据:
+    python benchmarks/bench_tool_index.py --registry cli-lib/main.json --queries queries.jsonl
+queries.jsonl 每行 {"instruction": "...", "tool": "期望选中的工具名"}
+
+召回率之后是端到端选择:在本地模拟服务上运行完整的多轮 Agent 流程(第一轮、必要时的完整注册表
+重试、读文档、生成并执行命令),模拟模型总能在提示词中认出目标工具.对比发送完整注册表、
+top-k 摘录 + no_tool 重试,以及 top-k 摘录但模型只能在候选中选择(没有 no_tool 时的行为)
+三种方式的选对率、第一轮平均轮数和第一轮平均提示词字符数.--e2e-k 0 跳过这一部分.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+sys.path.insert(0, os.path.join(project_root, "shell", "pyshell"))
+
+from mock_server import MockProviderServer  # noqa: E402
+from llmapiconfig.settings import LLMConfig, settings  # noqa: E402
+from tool_index import ToolIndex, registry_entries  # noqa: E402
+
+VERBS = [
+    ("压缩", "compress"), ("解压", "extract"), ("转换", "convert"), ("上传", "upload"),
+    ("下载", "download"), ("备份", "backup"), ("同步", "sync"), ("清理", "clean"),
+    ("校验", "verify"), ("合并", "merge"), ("拆分", "split"), ("统计", "count"),
+]
+OBJECTS = [
+    ("图片", "image"), ("视频", "video"), ("日志", "log"), ("数据库", "database"),
+    ("配置文件", "config"), ("模型", "model"), ("数据集", "dataset"), ("文档", "document"),
+    ("音频", "audio"), ("表格", "sheet"), ("镜像", "container"), ("证书", "cert"),
+]
+TEMPLATES = [
+    "请帮我{verb}一下这批{obj}",
+    "把昨天的{obj}{verb}掉,参数:-name job{n} --datapath 【{obj}目录】",
+    "我需要{verb}{obj},输出放到 out{n}",
+    "{obj}太多了,先{verb}再说",
+]
+
+# 描述中不出现的说法(改写查询用),按 VERBS / OBJECTS 的顺序
+VERB_PARAPHRASES = [
+    ["打包", "zip", "缩小体积"],
+    ["解包", "unzip", "展开归档"],
+    ["换个格式", "transcode", "转成别的格式"],
+    ["传到服务器", "推送到云端", "push 到远端"],
+    ["拉取到本地", "fetch", "取回"],
+    ["留个副本", "做快照", "存档一份"],
+    ["保持一致", "镜像到另一台机器", "rsync"],
+    ["删掉没用的", "腾空间", "purge"],
+    ["检查完整性", "核对哈希", "checksum"],
+    ["拼到一起", "汇总成一个", "concat"],
+    ["切成几块", "分割", "分片"],
+    ["数一数", "算一下总量", "汇总数量"],
+]
+OBJECT_PARAPHRASES = [
+    ["照片", "jpg", "截图"],
+    ["录像", "mp4", "影片"],
+    ["运行记录", "报错输出", "trace"],
+    ["db", "mysql 库", "表数据"],
+    ["设置项", "yaml", "ini"],
+    ["权重", "checkpoint", "ckpt"],
+    ["训练样本", "语料", "标注数据"],
+    ["word 稿", "pdf", "说明书"],
+    ["录音", "mp3", "声音文件"],
+    ["excel", "csv", "电子表"],
+    ["docker 包", "容器包", "oci"],
+    ["ssl", "tls 密钥对", "https 凭据"],
+]
+PARAPHRASE_TEMPLATES = [
+    "帮我把{obj}{verb}",
+    "{obj}需要{verb},谢谢",
+    "麻烦{verb}一下 {obj},参数 -name job{n}",
+    "手头有一堆{obj},想{verb}",
+]
+
+# 按日常说法手写的指令及其期望的工具
+HAND_LABELLED = [
+    {"instruction": "把这个文件夹里的照片打成zip发给我", "tool": "image_compress"},
+    {"instruction": "服务器磁盘快满了,清一下三个月前的运行记录", "tool": "log_clean"},
+    {"instruction": "mysql 每晚做一次快照", "tool": "database_backup"},
+    {"instruction": "checkpoint 下载下来放到 models 目录", "tool": "model_download"},
+    {"instruction": "看看这份 csv 一共有多少行", "tool": "sheet_count"},
+    {"instruction": "mp4 太大了,转成 720p 的", "tool": "video_convert"},
+    {"instruction": "两台机器上的 yaml 保持一致", "tool": "config_sync"},
+    {"instruction": "核对一下下载的语料有没有损坏", "tool": "dataset_verify"},
+    {"instruction": "把几段录音拼成一段", "tool": "audio_merge"},
+    {"instruction": "说明书 pdf 按章节切开", "tool": "document_split"},
+    {"instruction": "ssl 证书快过期了,先检查一下", "tool": "cert_verify"},
+    {"instruction": "把 docker 镜像推到私有仓库", "tool": "container_upload"},
+]
+
+
+def synthetic_registry(seed: int = 0):
+    """生成 动词 x 对象 的工具网格,每个工具与同行/同列工具共享一半关键词"""
+    rng = random.Random(seed)
+    registry = {}
+    queries = []
+    for verb, verb_en in VERBS:
+        for obj, obj_en in OBJECTS:
+            name = f"{obj_en}_{verb_en}"
+            registry[name] = {
+                "description": f"{verb}{obj}的命令行工具 ({verb_en} {obj_en} files)",
+                "doc_path": f"cli-lib/docs/{name}.md",
+            }
+            template = rng.choice(TEMPLATES)
+            queries.append({"instruction": template.format(verb=verb, obj=obj, n=rng.randint(1, 99)), "tool": name})
+    return registry, queries
+
+
+def paraphrased_queries(seed: int = 0):
+    """用描述中没有的说法为每个合成工具生成查询"""
+    rng = random.Random(seed)
+    queries = []
+    for (_, verb_en), verbs in zip(VERBS, VERB_PARAPHRASES):
+        for (_, obj_en), objs in zip(OBJECTS, OBJECT_PARAPHRASES):
+            template = rng.choice(PARAPHRASE_TEMPLATES)
+            instruction = template.format(verb=rng.choice(verbs), obj=rng.choice(objs), n=rng.randint(1, 99))
+            queries.append({"instruction": instruction, "tool": f"{obj_en}_{verb_en}"})
+    return queries
+
+
+def load_queries(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ToolIndex 召回率与开销基准")
+    parser.add_argument("--registry", help="main.json 路径(默认使用合成注册表)")
+    parser.add_argument("--queries", help="查询集 jsonl 路径(与 --registry 一起使用)")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5, 8])
+    parser.add_argument("--e2e-k", type=int, nargs="+", default=[3, 8], help="端到端选择测试的k,0表示跳过")
+    args = parser.parse_args()
+
+    if args.registry:
+        with open(args.registry, "r", encoding="utf-8") as f:
+            registry = json.load(f)
+        if not args.queries:
+            parser.error("--registry 需要同时提供 --queries")
+        query_sets = [("真实查询", load_queries(args.queries))]
+    else:
+        registry, queries = synthetic_registry()
+        query_sets = [("同词(上限参考)", queries), ("改写", paraphrased_queries()), ("人工标注", HAND_LABELLED)]
+
+    start = time.perf_counter()
+    index = ToolIndex().update(registry)
+    build = time.perf_counter() - start
+
+    # 修改一个工具后的增量更新
+    entries = dict(registry_entries(registry))
+    changed_name = next(iter(entries))
+    edited = json.loads(json.dumps(registry))
+    target = edited.get("tools", edited) if isinstance(edited, dict) else edited
+    if isinstance(target, dict):
+        target[changed_name] = {"description": "已修改的工具描述", "doc_path": "cli-lib/docs/changed.md"}
+    start = time.perf_counter()
+    ToolIndex().update(registry)  # 对照:重新全量构建
+    rebuild = time.perf_counter() - start
+    start = time.perf_counter()
+    index.update(edited)
+    incremental = time.perf_counter() - start
+    index.update(registry)
+
+    full_size = len(json.dumps(registry, ensure_ascii=False, indent=2))
+    print(f"工具数: {len(index)}")
+    print(f"全量构建: {build * 1000:.2f}ms  重新构建: {rebuild * 1000:.2f}ms  增量更新(改1个): {incremental * 1000:.2f}ms")
+    print(f"基线(完整main.json): 召回率 100.0%  注册表 {full_size} 字符")
+    for name, query_set in query_sets:
+        report(name, index, query_set, args.k, full_size)
+
+    e2e_ks = [k for k in args.e2e_k if k > 0]
+    if e2e_ks:
+        end_to_end(registry, query_sets, e2e_ks)
+
+
+def report(name, index, queries, ks, full_size):
+    """打印一组查询的检索耗时与各k下的召回率、注册表大小"""
+    max_k = max(ks)
+    latencies = []
+    ranks = []
+    for query in queries:
+        start = time.perf_counter()
+        hits = index.search(query["instruction"], max_k)
+        latencies.append(time.perf_counter() - start)
+        names = [hit for hit, _ in hits]
+        ranks.append(names.index(query["tool"]) + 1 if query["tool"] in names else None)
+
+    print(f"\n[{name}] 查询数: {len(queries)}  单次检索: 平均 {statistics.mean(latencies) * 1000:.3f}ms  "
+          f"最大 {max(latencies) * 1000:.3f}ms")
+    for k in ks:
+        recall = sum(1 for rank in ranks if rank is not None and rank <= k) / len(ranks)
+        sizes = [
+            len(json.dumps(index.subset([hit for hit, _ in index.search(q["instruction"], k)]), ensure_ascii=False, indent=2))
+            for q in queries
+        ]
+        print(f"top-{k}: 召回率 {recall * 100:5.1f}%  注册表平均 {statistics.mean(sizes):.0f} 字符 ({statistics.mean(sizes) / full_size * 100:.1f}%)")
+
+
+
+class SelectionModel:
+    """模拟服务的 responder:扮演一个总能在提示词中认出目标工具的模型
+
+    第一轮:目标工具出现在提示词的注册表中时选中它;否则回复 no_tool,
+    forced 时改为选注册表中的第一个候选(模型没有 no_tool 可选时的行为).
+    生成命令的一轮回复 echo 工具名,用执行结果判断最终选中的工具.
+    """
+
+    def __init__(self, registry):
+        self.doc_paths = {name: entry.get("doc_path", "") for name, entry in registry_entries(registry)}
+        self.expected = {}
+        self.forced = False
+        self.rounds = defaultdict(list)  # 指令 -> 第一轮各次请求的提示词字符数
+
+    def __call__(self, provider, prompt):
+        instruction = prompt.rsplit("用户指令:", 1)[-1].strip()
+        if "生成具体的执行命令" in prompt:
+            tool = re.search(r"以下是 (\S+) 工具的详细文档", prompt).group(1)
+            return json.dumps({"status": "execute_command", "command": f"echo {tool}", "working_directory": "."})
+        self.rounds[instruction].append(len(prompt))
+        target = self.expected[instruction]
+        registry_text = prompt.split("```json", 1)[-1].split("```", 1)[0]
+        if f'"{target}"' in registry_text:
+            return self.select(target)
+        if self.forced:
+            first = re.search(r'"([^"]+)"\s*:\s*\{', registry_text)
+            if first:
+                return self.select(first.group(1))
+        return json.dumps({"status": "no_tool"})
+
+    def select(self, tool):
+        return json.dumps({"status": "request_doc", "tool_name": tool, "doc_path": self.doc_paths.get(tool, "")})
+
+
+def selection_workspace(registry) -> str:
+    """创建供 Agent 流程读取的临时目录:注册表本身,以及每个工具一份最简文档"""
+    root = tempfile.mkdtemp(prefix="bench-tool-index-")
+    os.makedirs(os.path.join(root, "prompt"))
+    os.makedirs(os.path.join(root, "cli-lib"))
+    with open(os.path.join(root, "prompt", "agent.md"), "w", encoding="utf-8") as f:
+        f.write("你是CLI工具调度助手")
+    with open(os.path.join(root, "cli-lib", "agents.json"), "w", encoding="utf-8") as f:
+        json.dump({"bench": {"system_prompt_path": "prompt/agent.md"}}, f)
+    with open(os.path.join(root, "cli-lib", "main.json"), "w", encoding="utf-8") as f:
+        json.dump(registry, f, ensure_ascii=False, indent=2)
+    for name, entry in registry_entries(registry):
+        doc_path = os.path.join(root, entry.get("doc_path") or f"cli-lib/docs/{name}.md")
+        os.makedirs(os.path.dirname(doc_path), exist_ok=True)
+        with open(doc_path, "w", encoding="utf-8") as f:
+            f.write(f"# {name}\n\n### -name\n- description: 任务名\n")
+    return root
+
+
+async def run_selection(agent_framework, model, queries, top_k, forced):
+    """运行一组查询,返回 (选对率, 第一轮平均轮数, 第一轮平均提示词字符数)"""
+    agent_framework.TOOL_TOP_K = top_k
+    model.forced = forced
+    model.expected = {query["instruction"]: query["tool"] for query in queries}
+    model.rounds.clear()
+    correct = 0
+    for query in queries:
+        result = json.loads(await agent_framework.async_call_agent_multi_turn("bench", query["instruction"]))
+        if result.get("status") == "success" and result["log"].startswith(f"命令执行成功: echo {query['tool']}\n"):
+            correct += 1
+    rounds = [model.rounds[query["instruction"]] for query in queries]
+    return (
+        correct / len(queries),
+        statistics.mean(len(sizes) for sizes in rounds),
+        statistics.mean(sum(sizes) for sizes in rounds),
+    )
+
+
+def end_to_end(registry, query_sets, ks):
+    """在模拟服务上跑完整 Agent 流程,对比三种第一轮方式的选择结果"""
+    import agent_framework
+    from api_client import MultiModelAPIClient
+
+    model = SelectionModel(registry)
+    settings.cache.enabled = False
+    with MockProviderServer(latency=0.0, responder=model) as server:
+        settings.openai = LLMConfig(api_key="bench", base_url=server.provider_urls()["openai"], model="mock")
+        agent_framework.project_root = selection_workspace(registry)
+        agent_framework.api_client = MultiModelAPIClient("openai")
+        modes = [("完整注册表", 0, False)]
+        for k in ks:
+            modes.append((f"top-{k} + no_tool 重试", k, False))
+            modes.append((f"top-{k} 只能选候选", k, True))
+        for name, queries in query_sets:
+            print(f"\n[端到端选择 - {name}] 查询数: {len(queries)}")
+            for label, top_k, forced in modes:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    accuracy, rounds, chars = agent_framework.get_api_client().run(
+                        run_selection(agent_framework, model, queries, top_k, forced)
+                    )
+                print(f"{label:<20}选对率 {accuracy * 100:5.1f}%  第一轮平均 {rounds:.2f} 次  提示词平均 {chars:.0f} 字符")
+
+
+if __name__ == "__main__":
+    main()
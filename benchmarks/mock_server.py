@@ -0,0 +1,401 @@
+"""
+本地模拟大模型服务
+用于在不消耗真实API额度的情况下测量 llmapiconfig 的开销
+
+支持 OpenAI/智谱、Claude、通义千问、Gemini 的请求与响应格式(含流式),
+按请求路径和请求体自动识别;可配置固定延迟、随机抖动、错误率与429比例.
+"""
+
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# responder(提供商, 全部提示词文本) -> 回复文本
+Responder = Callable[[str, str], str]
+
+
+def detect_provider(path: str, body: Dict[str, Any]) -> str:
+    """根据请求路径和请求体判断线路格式(OpenAI与智谱格式相同,统一按 openai 处理)"""
+    if path.startswith("/v1/messages") or path.endswith("/v1/messages"):
+        return "claude"
+    if ":generateContent" in path or ":streamGenerateContent" in path:
+        return "gemini"
+    if "input" in body and "parameters" in body:
+        return "qwen"
+    return "openai"
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return ""
+
+
+def _prompt_text(provider: str, body: Dict[str, Any]) -> str:
+    """请求中全部提示词文本(系统提示词在前),用于 responder 和估算用量"""
+    if provider == "gemini":
+        parts = list(body.get("systemInstruction", {}).get("parts", []))
+        for item in body.get("contents", []):
+            parts.extend(item.get("parts", []))
+        return "\n".join(part.get("text", "") for part in parts)
+    texts = [_text(body.get("system", ""))] if provider == "claude" else []
+    messages = body.get("input", {}).get("messages", []) if provider == "qwen" else body.get("messages", [])
+    texts.extend(_text(message.get("content", "")) for message in messages)
+    return "\n".join(text for text in texts if text)
+
+
+def _continue_prefill(body: Dict[str, Any], text: str) -> str:
+    """Claude 预填充:最后一条 assistant 消息是回复的开头,只返回其后的部分"""
+    messages = body.get("messages") or []
+    if messages and messages[-1].get("role") == "assistant":
+        prefix = _text(messages[-1].get("content", ""))
+        if text.startswith(prefix):
+            return text[len(prefix):]
+    return text
+
+
+def _is_stream(provider: str, path: str, headers, body: Dict[str, Any]) -> bool:
+    if provider == "gemini":
+        return ":streamGenerateContent" in path
+    if provider == "qwen":
+        return bool(body.get("parameters", {}).get("stream")) or headers.get("X-DashScope-SSE") == "enable"
+    return bool(body.get("stream"))
+
+
+def _split(text: str, parts: int) -> List[str]:
+    """把回复切成 parts 段作为流式增量"""
+    parts = max(1, parts)
+    size = max(1, -(-len(text) // parts))
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_Server"
+
+    def setup(self):
+        super().setup()
+        # 头部和正文分两次写出,关闭Nagle避免与延迟ACK叠加出40ms的假延迟
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        parsed = urlparse(self.path)
+        provider = detect_provider(parsed.path, body)
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+            server.by_provider[provider] = server.by_provider.get(provider, 0) + 1
+            roll = server.random.random()
+            jitter = server.random.uniform(0, server.jitter) if server.jitter else 0.0
+        if server.latency or jitter:
+            time.sleep(server.latency + jitter)
+
+        if roll < server.rate_429:
+            self._count("throttled")
+            self._send_json(
+                {"error": {"message": "mock rate limit", "type": "rate_limit_error"}},
+                status=429,
+                headers={"Retry-After": str(server.retry_after)},
+            )
+            return
+        if roll < server.rate_429 + server.error_rate:
+            self._count("errors")
+            self._send_json({"error": {"message": "mock server error", "type": "server_error"}}, status=500)
+            return
+
+        prompt = _prompt_text(provider, body)
+        text = server.responder(provider, prompt) if server.responder else "ok" * server.chunks
+        if provider == "claude":
+            text = _continue_prefill(body, text)
+        usage = (len(prompt) // 3 + 1, len(text) // 3 + 1)
+        if _is_stream(provider, parsed.path, self.headers, body):
+            sse = provider != "gemini" or parse_qs(parsed.query).get("alt") == ["sse"]
+            self._send_stream(provider, _split(text, server.chunks), usage, sse)
+            return
+        # 非流式响应需要等完整内容生成完毕
+        if server.chunk_interval:
+            time.sleep(server.chunk_interval * server.chunks)
+        self._send_json(self._completion(provider, body, text, usage))
+
+    def _count(self, name: str) -> None:
+        with self.server.stats_lock:
+            setattr(self.server, name, getattr(self.server, name) + 1)
+
+    @staticmethod
+    def _completion(provider: str, body: Dict[str, Any], text: str, usage) -> Dict[str, Any]:
+        prompt_tokens, completion_tokens = usage
+        if provider == "claude":
+            return {
+                "id": "msg_mock",
+                "type": "message",
+                "role": "assistant",
+                "model": body.get("model", "mock"),
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "usage": {"input_tokens": prompt_tokens, "output_tokens": completion_tokens},
+            }
+        if provider == "qwen":
+            return {
+                "request_id": "mock",
+                "output": {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": text}}]},
+                "usage": {
+                    "input_tokens": prompt_tokens,
+                    "output_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        if provider == "gemini":
+            return {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+                "usageMetadata": {
+                    "promptTokenCount": prompt_tokens,
+                    "candidatesTokenCount": completion_tokens,
+                    "totalTokenCount": prompt_tokens + completion_tokens,
+                },
+            }
+        return {
+            "id": "mock",
+            "object": "chat.completion",
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _stream_events(self, provider: str, pieces: List[str], usage) -> List[Tuple[bytes, bool]]:
+        """按提供商格式生成SSE事件,返回 (事件, 是否为内容增量);内容增量之间按 chunk_interval 间隔发送"""
+        prompt_tokens, completion_tokens = usage
+
+        def event(data: Dict[str, Any], name: Optional[str] = None, content: bool = True) -> Tuple[bytes, bool]:
+            prefix = b"event: %s\n" % name.encode("ascii") if name else b""
+            return prefix + b"data: " + json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n\n", content
+
+        if provider == "claude":
+            return (
+                [
+                    event({"type": "message_start", "message": {"id": "msg_mock", "role": "assistant", "content": [],
+                                                                "usage": {"input_tokens": prompt_tokens, "output_tokens": 0}}}, "message_start", False),
+                    event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+                          "content_block_start", False),
+                ]
+                + [
+                    event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}}, "content_block_delta")
+                    for piece in pieces
+                ]
+                + [
+                    event({"type": "content_block_stop", "index": 0}, "content_block_stop", False),
+                    event({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                           "usage": {"output_tokens": completion_tokens}}, "message_delta", False),
+                    event({"type": "message_stop"}, "message_stop", False),
+                ]
+            )
+        if provider == "qwen":
+            events = [
+                event({"output": {"choices": [{"message": {"role": "assistant", "content": piece}, "finish_reason": "null"}]}}, "result")
+                for piece in pieces
+            ]
+            events.append(event({
+                "output": {"choices": [{"message": {"role": "assistant", "content": ""}, "finish_reason": "stop"}]},
+                "usage": {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            }, "result", False))
+            return events
+        if provider == "gemini":
+            return [event(self._completion("gemini", {}, piece, usage)) for piece in pieces]
+        events = [
+            event({"id": "mock", "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": piece}}]})
+            for piece in pieces
+        ]
+        # 末尾的用量块:智谱默认返回,OpenAI 在 stream_options.include_usage 时返回
+        events.append(event({"id": "mock", "object": "chat.completion.chunk", "choices": [],
+                             "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                       "total_tokens": prompt_tokens + completion_tokens}}, content=False))
+        events.append((b"data: [DONE]\n\n", False))
+        return events
+
+    def _send_stream(self, provider: str, pieces: List[str], usage, sse: bool):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if sse:
+            sent = 0
+            for data, is_content in self._stream_events(provider, pieces, usage):
+                if is_content:
+                    if sent and self.server.chunk_interval:
+                        time.sleep(self.server.chunk_interval)
+                    sent += 1
+                self._write_chunk(data)
+        else:
+            # Gemini 默认以JSON数组的形式逐个输出元素
+            for index, piece in enumerate(pieces):
+                if index and self.server.chunk_interval:
+                    time.sleep(self.server.chunk_interval)
+                item = json.dumps(self._completion("gemini", {}, piece, usage), ensure_ascii=False).encode("utf-8")
+                self._write_chunk((b"[" if index == 0 else b",\r\n") + item)
+            self._write_chunk(b"]")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_json(self, payload, status: int = 200, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, latency: float, chunks: int, chunk_interval: float, jitter: float,
+                 error_rate: float, rate_429: float, retry_after: float, responder: Optional[Responder], seed: Optional[int]):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.chunks = chunks
+        self.chunk_interval = chunk_interval
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.responder = responder
+        self.random = random.Random(seed)
+        self.stats_lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.by_provider: Dict[str, int] = {}
+
+
+class MockProviderServer:
+    """在后台线程运行的模拟服务,同时支持五种提供商的线路格式"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        chunks: int = 1,
+        chunk_interval: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: float = 0.0,
+        responder: Optional[Responder] = None,
+        seed: Optional[int] = None,
+    ):
+        """latency 为首字节前的固定延迟,另加 [0, jitter) 的随机抖动;
+        流式响应输出 chunks 个数据块,间隔 chunk_interval 秒;
+        每个请求以 rate_429 的概率返回429(带 Retry-After: retry_after),以 error_rate 的概率返回500;
+        responder 可按提示词生成回复文本,默认回复 "ok" * chunks
+        """
+        self._server = _Server(
+            (host, port), latency, chunks, chunk_interval, jitter, error_rate, rate_429, retry_after, responder, seed
+        )
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def provider_urls(self) -> Dict[str, str]:
+        """各提供商应配置的 base_url(与 llm_client 中的路径拼接方式对应)"""
+        return {
+            "openai": f"{self.base_url}/v1",
+            "zhipu": f"{self.base_url}/api/paas/v4",
+            "qwen": f"{self.base_url}/api/v1/services/aigc/text-generation",
+            "claude": self.base_url,
+            "gemini": f"{self.base_url}/v1beta",
+        }
+
+    @property
+    def connections(self) -> int:
+        return self._server.connections
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    def stats(self) -> Dict[str, Any]:
+        server = self._server
+        with server.stats_lock:
+            return {
+                "connections": server.connections,
+                "requests": server.requests,
+                "errors": server.errors,
+                "throttled": server.throttled,
+                "by_provider": dict(server.by_provider),
+            }
+
+    def start(self) -> "MockProviderServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本地模拟大模型服务")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的固定延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="附加的随机延迟上限(秒)")
+    parser.add_argument("--chunks", type=int, default=1, help="流式响应的数据块数")
+    parser.add_argument("--chunk-interval", type=float, default=0.0, help="数据块间隔(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的概率")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="返回429的概率")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="429响应的 Retry-After(秒)")
+    args = parser.parse_args()
+    server = MockProviderServer(
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        chunks=args.chunks,
+        chunk_interval=args.chunk_interval,
+        error_rate=args.error_rate,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+    )
+    print(f"模拟服务已启动: {server.base_url}")
+    for name, url in server.provider_urls().items():
+        print(f"  {name:<7} base_url = {url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
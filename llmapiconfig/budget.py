@@ -0,0 +1,273 @@
+"""
+上下文预算
+发送前估算提示词大小,把工具文档、注册表、命令输出等可压缩的部分裁剪到模型的上下文窗口以内,
+并报告裁剪了什么.不超出预算的提示词原样通过.
+
+    sections = [
+        Section("system", system_prompt, fixed=True),
+        Section("registry", registry_json, mode="json"),
+        Section("instruction", instruction, fixed=True),
+    ]
+    texts, report = fit(sections, prompt_limit(provider), provider)
+    if report:
+        print(report.describe())
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Sequence, Tuple
+
+from . import metrics
+from .router import router, should_route
+from .settings import settings
+from .tokens import estimate_tokens
+
+# 估算误差的余量:提示词最多使用可用空间的这一比例
+SAFETY_MARGIN = 0.9
+
+# 任何提供商每个字符都不超过这么多token(含校准系数上限);总字符数乘以它仍在预算内时无需估算
+_MAX_TOKENS_PER_CHAR = 2.5
+
+OMITTED = "\n...[已省略 {} 字符]...\n"
+
+
+@dataclass
+class Section:
+    """提示词中的一段
+
+    fixed 的段(系统提示词、用户指令)不会被裁剪;其余按 mode 裁剪:
+    head 保留开头(文档),tail 保留结尾(日志),both 保留首尾(命令输出),
+    json 从末尾整条丢弃 JSON 数组/对象的条目(注册表),无法解析时按 head 处理.
+    """
+    name: str
+    text: str
+    fixed: bool = False
+    mode: str = "head"
+
+
+@dataclass
+class Trimmed:
+    """被裁剪的一段"""
+    name: str
+    tokens: int
+    kept_tokens: int
+    detail: str = ""
+
+    @property
+    def dropped_tokens(self) -> int:
+        return self.tokens - self.kept_tokens
+
+
+@dataclass
+class BudgetReport:
+    """fit() 的结果;没有裁剪任何内容时为假值"""
+    limit: int
+    tokens: int  # 裁剪后的估算token数
+    trimmed: List[Trimmed] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.trimmed)
+
+    @property
+    def over(self) -> bool:
+        """裁剪后仍超出预算(不可裁剪的部分本身就太大)"""
+        return 0 < self.limit < self.tokens
+
+    def describe(self) -> str:
+        parts = []
+        for item in self.trimmed:
+            detail = f", {item.detail}" if item.detail else ""
+            parts.append(f"{item.name} {item.tokens}->{item.kept_tokens}{detail}")
+        text = f"提示词超出预算({self.limit} tokens),已裁剪: " + "; ".join(parts)
+        if self.over:
+            text += f";裁剪后仍约 {self.tokens} tokens"
+        return text
+
+
+def prompt_limit(provider: Optional[str] = None, max_tokens: Optional[int] = None) -> int:
+    """提示词可用的token数:上下文窗口减去输出预留(默认为配置的 max_tokens),再留出估算误差余量
+
+    走路由时取各候选提供商中最小的值;都没有配置上下文窗口时返回0,表示不限制.
+    """
+    providers = router.available_providers() if should_route(provider) else [provider or settings.default_provider]
+    limits = []
+    for name in providers:
+        try:
+            config = settings.get_config(name)
+        except ValueError:
+            continue
+        if config.context_window > 0:
+            reserve = config.max_tokens if max_tokens is None else max_tokens
+            limits.append(max(1, int((config.context_window - reserve) * SAFETY_MARGIN)))
+    return min(limits) if limits else 0
+
+
+def estimate_provider(provider: Optional[str]) -> Optional[str]:
+    """估算时使用的提供商;走路由时实际提供商未知,返回 None 使用保守系数"""
+    return None if should_route(provider) else provider or settings.default_provider
+
+
+def truncate(text: str, max_tokens: int, provider: Optional[str] = None, mode: str = "head") -> str:
+    """把文本裁剪到约 max_tokens 以内"""
+    tokens = estimate_tokens(text, provider)
+    if tokens <= max_tokens:
+        return text
+    return _truncate(text, tokens, max_tokens, provider, mode)[0]
+
+
+def chunk(text: str, max_tokens: int, provider: Optional[str] = None) -> List[str]:
+    """按行把文本切成每块约 max_tokens 以内的若干块(单行过长时按字符切)"""
+    if estimate_tokens(text, provider) <= max_tokens:
+        return [text]
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = estimate_tokens(line, provider)
+        if line_tokens > max_tokens:
+            # 过长的行单独切开
+            if current:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            step = max(1, len(line) * max_tokens // line_tokens)
+            chunks.extend(line[start:start + step] for start in range(0, len(line), step))
+            continue
+        if current and current_tokens + line_tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def fit(
+    sections: Sequence[Section],
+    limit: int,
+    provider: Optional[str] = None,
+) -> Tuple[List[str], BudgetReport]:
+    """把各段裁剪到总计不超过 limit,返回 (各段文本, 报告)
+
+    不可裁剪的段先占用预算,剩余部分在可裁剪的段之间平分:小于均分额度的段保持原样,
+    省下的额度再分给较大的段.limit<=0 表示不限制.
+    """
+    texts = [section.text for section in sections]
+    if limit <= 0 or sum(len(text) for text in texts) * _MAX_TOKENS_PER_CHAR <= limit:
+        return texts, BudgetReport(limit, 0)
+
+    counts = [estimate_tokens(text, provider) for text in texts]
+    total = sum(counts)
+    if total <= limit:
+        return texts, BudgetReport(limit, total)
+
+    available = limit - sum(count for section, count in zip(sections, counts) if section.fixed)
+    shrinkable = sorted(
+        (index for index, section in enumerate(sections) if not section.fixed),
+        key=lambda index: counts[index],
+    )
+    allowance = {}
+    for position, index in enumerate(shrinkable):
+        share = max(0, available) // (len(shrinkable) - position)
+        allowance[index] = min(counts[index], share)
+        available -= allowance[index]
+
+    report = BudgetReport(limit, 0)
+    for index, section in enumerate(sections):
+        if section.fixed or allowance[index] >= counts[index]:
+            continue
+        texts[index], detail = _truncate(section.text, counts[index], allowance[index], provider, section.mode)
+        kept = estimate_tokens(texts[index], provider)
+        trimmed = Trimmed(section.name, counts[index], kept, detail)
+        report.trimmed.append(trimmed)
+        counts[index] = kept
+        metrics.inc("llm_budget_trimmed_total", section=section.name)
+        metrics.observe("llm_budget_dropped_tokens", trimmed.dropped_tokens, section=section.name)
+    report.tokens = sum(counts)
+    return texts, report
+
+
+def _truncate(text: str, tokens: int, max_tokens: int, provider: Optional[str], mode: str) -> Tuple[str, str]:
+    """裁剪已知超出预算的文本,返回 (裁剪结果, 说明)"""
+    if mode == "json":
+        result = _truncate_json(text, max_tokens, provider)
+        if result is not None:
+            return result
+        mode = "head"
+    # 按字符比例估计保留长度,估算仍超出时再收缩
+    keep = int(len(text) * max_tokens / tokens)
+    for _ in range(5):
+        result = _cut(text, keep, mode)
+        if estimate_tokens(result, provider) <= max_tokens or keep <= 0:
+            break
+        keep = int(keep * 0.9)
+    return result, f"省略约 {max(0, len(text) - len(result))} 字符"
+
+
+def _cut(text: str, keep: int, mode: str) -> str:
+    """保留约 keep 个字符,在行边界处截断并标注省略的字符数"""
+    keep = max(0, keep - len(OMITTED) - 8)
+    if mode == "both":
+        head = _head(text, keep // 2)
+        tail = _tail(text, keep - len(head))
+        return head + OMITTED.format(len(text) - len(head) - len(tail)) + tail
+    if mode == "tail":
+        tail = _tail(text, keep)
+        return OMITTED.format(len(text) - len(tail)).lstrip("\n") + tail
+    head = _head(text, keep)
+    return head + OMITTED.format(len(text) - len(head)).rstrip("\n")
+
+
+def _head(text: str, keep: int) -> str:
+    cut = text.rfind("\n", 0, keep)
+    # 附近没有换行时直接按字符截断
+    return text[: cut + 1] if cut >= keep * 0.8 else text[:keep]
+
+
+def _tail(text: str, keep: int) -> str:
+    if keep <= 0:
+        return ""
+    start = len(text) - keep
+    cut = text.find("\n", start)
+    return text[cut + 1:] if 0 <= cut <= start + keep * 0.2 else text[start:]
+
+
+def _truncate_json(text: str, max_tokens: int, provider: Optional[str]) -> Optional[Tuple[str, str]]:
+    """从末尾整条丢弃 JSON 条目
+
+    {"tools": [...]} 这类包装对象裁剪其中的列表(只有一个键时也可以是对象),
+    其他对象按键逐条丢弃.保持原文是否缩进.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    wrapper, key = None, None
+    if isinstance(data, dict):
+        lists = [k for k, v in data.items() if isinstance(v, list)]
+        if not lists and len(data) == 1 and isinstance(next(iter(data.values())), dict):
+            lists = list(data)
+        if lists:
+            wrapper = data
+            key = max(lists, key=lambda k: len(data[k]))
+            data = data[key]
+    if not isinstance(data, (list, dict)) or not data:
+        return None
+    items: List[Any] = list(data.items()) if isinstance(data, dict) else list(data)
+    indent = 2 if "\n" in text.strip() else None
+
+    def render(count: int) -> str:
+        part = dict(items[:count]) if isinstance(data, dict) else items[:count]
+        if wrapper is not None:
+            part = {**wrapper, key: part}
+        return json.dumps(part, ensure_ascii=False, indent=indent)
+
+    # 二分查找能放下的最多条目数
+    low, high = 0, len(items)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(render(middle), provider) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return render(low), f"保留 {low}/{len(items)} 个条目"
@@ -0,0 +1,238 @@
+"""
+响应缓存
+以请求内容的规范化哈希为键,内存LRU + 可选SQLite持久化两级缓存
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .settings import settings, CacheConfig
+
+
+def make_cache_key(
+    provider: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: float,
+    max_tokens: int,
+    **extra
+) -> str:
+    """计算请求的规范化哈希
+
+    键名排序、去除空白后序列化,保证语义相同的请求得到相同的键.
+    extra 用于纳入其它会影响输出的参数.
+    """
+    payload = {
+        "provider": provider,
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    if extra:
+        payload["extra"] = extra
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class MemoryTier:
+    """内存LRU层,存储序列化后的响应文本,命中时重新解析以避免调用方互相修改"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at and expires_at < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str, expires_at: float) -> int:
+        """写入条目,返回因容量淘汰的条目数"""
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        evicted = 0
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteTier:
+    """SQLite持久化层,按最近访问时间淘汰"""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed_at)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        """返回 (响应文本, 过期时间)"""
+        row = self._conn.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at and expires_at < now:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._count -= 1
+            return None
+        self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return value, expires_at
+
+    def set(self, key: str, value: str, expires_at: float, now: float) -> int:
+        cursor = self._conn.execute(
+            "INSERT OR IGNORE INTO responses (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, value, expires_at, now),
+        )
+        if cursor.rowcount:
+            self._count += 1
+        else:
+            self._conn.execute(
+                "UPDATE responses SET value = ?, expires_at = ?, accessed_at = ? WHERE key = ?",
+                (value, expires_at, now, key),
+            )
+        overflow = self._count - self.max_entries
+        if overflow <= 0:
+            return 0
+        # 先清理过期条目,仍超出则按最近访问时间淘汰
+        self._conn.execute("DELETE FROM responses WHERE expires_at > 0 AND expires_at < ?", (now,))
+        self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+            self._count -= overflow
+        return max(overflow, 0)
+
+    def clear(self) -> None:
+        self._conn.execute("DELETE FROM responses")
+        self._count = 0
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class ResponseCache:
+    """两级响应缓存
+
+    默认只缓存 temperature <= 0 的请求(采样结果本身不可复现),
+    可通过 cache_sampling 放开.
+    """
+
+    def __init__(self, config: Optional[CacheConfig] = None):
+        self.config = config or settings.cache
+        self.memory = MemoryTier(self.config.max_entries)
+        self.disk = SQLiteTier(self.config.path, self.config.max_disk_entries) if self.config.path else None
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "sets": 0,
+            "evictions": 0,
+        }
+
+    def should_cache(self, temperature: float) -> bool:
+        """按温度判断请求是否走缓存,不走缓存时计入 bypassed"""
+        if temperature > 0 and not self.config.cache_sampling:
+            with self._lock:
+                self._stats["bypassed"] += 1
+            return False
+        return True
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            value = self.memory.get(key, now)
+            if value is not None:
+                self._stats["memory_hits"] += 1
+                return json.loads(value)
+            if self.disk is not None:
+                entry = self.disk.get(key, now)
+                if entry is not None:
+                    value, expires_at = entry
+                    self._stats["disk_hits"] += 1
+                    # 回填内存层
+                    self._stats["evictions"] += self.memory.set(key, value, expires_at)
+                    return json.loads(value)
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, response: Dict[str, Any]) -> None:
+        value = json.dumps(response, ensure_ascii=False, separators=(",", ":"))
+        now = time.time()
+        expires_at = self._expires_at(now)
+        with self._lock:
+            self._stats["sets"] += 1
+            self._stats["evictions"] += self.memory.set(key, value, expires_at)
+            if self.disk is not None:
+                self._stats["evictions"] += self.disk.set(key, value, expires_at, now)
+
+    def _expires_at(self, now: float) -> float:
+        return now + self.config.ttl if self.config.ttl > 0 else 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            self.memory.clear()
+            if self.disk is not None:
+                self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self.memory)
+            stats["disk_entries"] = len(self.disk) if self.disk is not None else 0
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+
+_response_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """返回全局响应缓存;未启用(LLM_CACHE_ENABLED)时返回 None"""
+    global _response_cache
+    if not settings.cache.enabled:
+        return None
+    with _cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(settings.cache)
+        return _response_cache
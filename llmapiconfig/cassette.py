@@ -0,0 +1,256 @@
+"""
+录制/回放
+在 httpx 传输层录制请求与响应(包括流式分块及其时间),之后原样回放,
+用于剥离提供商延迟、单独测量框架自身的开销.调用方代码无需任何改动.
+
+LLM_CASSETTE_MODE=record 时请求照常发往提供商并追加写入磁带文件;
+LLM_CASSETTE_MODE=replay 时完全不访问网络,按请求内容查找录制的响应.
+"""
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+
+from .settings import settings, CassetteConfig
+
+MODES = ("off", "record", "replay")
+TIMINGS = ("none", "recorded", "synthetic")
+
+# 参与匹配时忽略的查询参数(Gemini 把密钥放在URL里)
+_SECRET_PARAMS = {"key", "api_key"}
+
+
+class CassetteMiss(LookupError):
+    """回放模式下磁带中没有对应的录制"""
+
+
+def request_key(method: str, url: str, body: bytes) -> str:
+    """请求指纹:方法 + 去掉密钥的URL + 规范化的JSON请求体,不含请求头(密钥)"""
+    parts = urlsplit(url)
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query) if k not in _SECRET_PARAMS))
+    url = urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    except ValueError:
+        pass
+    digest = hashlib.sha256()
+    for part in (method.upper().encode("ascii"), url.encode("utf-8"), body):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _encode(data: bytes) -> Dict[str, str]:
+    try:
+        return {"t": data.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"b": base64.b64encode(data).decode("ascii")}
+
+
+def _decode(item: Dict[str, str]) -> bytes:
+    if "t" in item:
+        return item["t"].encode("utf-8")
+    return base64.b64decode(item["b"])
+
+
+class Cassette:
+    """磁带文件:每行一条 JSON 记录,路径以 .gz 结尾时使用 gzip 压缩
+
+    同一请求录制了多次时按顺序轮流回放.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursor: Dict[str, int] = defaultdict(int)
+        self.stats = {"recorded": 0, "replayed": 0, "misses": 0}
+        if os.path.exists(path):
+            self._load()
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self) -> None:
+        with self._open("r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(entries) for entries in self._entries.values())
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._entries[entry["key"]].append(entry)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with self._open("a") as f:
+                f.write(line)
+            self.stats["recorded"] += 1
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats["misses"] += 1
+                return None
+            index = self._cursor[key] % len(entries)
+            self._cursor[key] += 1
+            self.stats["replayed"] += 1
+            return entries[index]
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """透传上游响应体,同时记下每个分块及其相对请求开始的时间"""
+
+    def __init__(self, inner: httpx.AsyncByteStream, start: float, on_complete):
+        self._inner = inner
+        self._start = start
+        self._on_complete = on_complete
+        self._chunks: List[Tuple[float, bytes]] = []
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._inner:
+            self._chunks.append((time.monotonic() - self._start, chunk))
+            yield chunk
+        # 只保存完整读完的响应,提前中断的流不录制
+        self._on_complete(self._chunks)
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: List[Tuple[float, bytes]]):
+        self._chunks = chunks
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        start = time.monotonic()
+        for offset, chunk in self._chunks:
+            wait = offset - (time.monotonic() - start)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield chunk
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """包装真实传输层的录制/回放传输层"""
+
+    def __init__(self, cassette: Cassette, mode: str, inner: Optional[httpx.AsyncBaseTransport] = None,
+                 config: Optional[CassetteConfig] = None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"不支持的磁带模式: {mode}")
+        if mode == "record" and inner is None:
+            raise ValueError("录制模式需要上游传输层")
+        self.cassette = cassette
+        self.mode = mode
+        self.inner = inner
+        self.config = config or settings.cassette
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        key = request_key(request.method, str(request.url), body)
+        if self.mode == "replay":
+            return await self._replay(request, key)
+        return await self._record(request, key)
+
+    async def _record(self, request: httpx.Request, key: str) -> httpx.Response:
+        start = time.monotonic()
+        response = await self.inner.handle_async_request(request)
+        ttfb = time.monotonic() - start
+        headers = [(name.decode("latin-1"), value.decode("latin-1")) for name, value in response.headers.raw]
+
+        def save(chunks: List[Tuple[float, bytes]]) -> None:
+            self.cassette.append({
+                "key": key,
+                "method": request.method,
+                "url": _redact(str(request.url)),
+                "status": response.status_code,
+                "headers": headers,
+                "ttfb": round(ttfb, 6),
+                "chunks": [[round(offset, 6), _encode(chunk)] for offset, chunk in chunks],
+            })
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, start, save),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    async def _replay(self, request: httpx.Request, key: str) -> httpx.Response:
+        entry = self.cassette.lookup(key)
+        if entry is None:
+            raise CassetteMiss(f"磁带 {self.cassette.path} 中没有该请求的录制: {request.method} {_redact(str(request.url))}")
+        chunks = [(offset, _decode(item)) for offset, item in entry["chunks"]]
+        timing = self.config.timing
+        if timing == "recorded":
+            await asyncio.sleep(entry["ttfb"])
+            chunks = [(max(0.0, offset - entry["ttfb"]), chunk) for offset, chunk in chunks]
+        elif timing == "synthetic":
+            await asyncio.sleep(self.config.synthetic_ttfb)
+            interval = self.config.synthetic_chunk_interval
+            chunks = [(index * interval, chunk) for index, (_, chunk) in enumerate(chunks)]
+        else:
+            chunks = [(0.0, chunk) for _, chunk in chunks]
+        return httpx.Response(
+            status_code=entry["status"],
+            headers=entry["headers"],
+            stream=_ReplayStream(chunks),
+            request=request,
+        )
+
+    async def aclose(self) -> None:
+        if self.inner is not None:
+            await self.inner.aclose()
+
+
+def _redact(url: str) -> str:
+    parts = urlsplit(url)
+    query = urlencode([(k, "***" if k in _SECRET_PARAMS else v) for k, v in parse_qsl(parts.query)])
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+
+
+_cassettes: Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path: str) -> Cassette:
+    """同一路径的磁带在进程内共享(跨事件循环)"""
+    path = os.path.abspath(path)
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = _cassettes[path] = Cassette(path)
+        return cassette
+
+
+def wrap_transport(inner: httpx.AsyncBaseTransport, config: Optional[CassetteConfig] = None) -> httpx.AsyncBaseTransport:
+    """按配置给传输层套上录制/回放;mode=off 时原样返回"""
+    config = config or settings.cassette
+    if config.mode not in MODES:
+        raise ValueError(f"LLM_CASSETTE_MODE 只能是 {', '.join(MODES)}: {config.mode}")
+    if config.timing not in TIMINGS:
+        raise ValueError(f"LLM_CASSETTE_TIMING 只能是 {', '.join(TIMINGS)}: {config.timing}")
+    if config.mode == "off":
+        return inner
+    if not config.path:
+        raise ValueError("启用录制/回放时必须设置 LLM_CASSETTE_PATH")
+    return CassetteTransport(get_cassette(config.path), config.mode, inner, config)
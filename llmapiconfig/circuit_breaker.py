@@ -0,0 +1,130 @@
+"""
+熔断器
+按 (提供商, base_url) 统计连续故障,提供商不可用时快速失败而不是等满超时
+"""
+
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from .resilience import is_retryable
+from .settings import settings, BreakerConfig
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态,请求未发出"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} 熔断中,{retry_in:.1f}秒后再试探")
+        self.name = name
+        self.retry_in = retry_in
+
+
+def counts_as_failure(exc: BaseException) -> bool:
+    """只有说明服务端不健康的错误才计入熔断:超时、连接错误和5xx等,429与其他4xx不计入"""
+    if isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429:
+        return False
+    return is_retryable(exc)
+
+
+class CircuitBreaker:
+    """三态熔断器
+
+    - closed: 正常放行,连续失败达到 failure_threshold 后打开
+    - open: 直接抛出 CircuitOpenError,经过 recovery_timeout 后进入半开
+    - half_open: 最多放行 half_open_max_calls 个试探请求,成功则关闭,失败则重新打开
+    """
+
+    def __init__(self, name: str, config: Optional[BreakerConfig] = None):
+        self.name = name
+        self.config = config or settings.breaker
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self._lock = threading.Lock()
+        self.stats = {"rejected": 0, "opened": 0}
+
+    def _refresh(self, now: float) -> None:
+        if self.state == OPEN and now - self.opened_at >= self.config.recovery_timeout:
+            self.state = HALF_OPEN
+            self.probes = 0
+
+    def allows_request(self) -> bool:
+        """只读检查:当前是否会放行请求(供路由判断,不占用试探名额)"""
+        if not self.config.enabled:
+            return True
+        with self._lock:
+            self._refresh(time.monotonic())
+            if self.state == OPEN:
+                return False
+            return self.state == CLOSED or self.probes < self.config.half_open_max_calls
+
+    def before_call(self) -> None:
+        """请求发出前调用,熔断时抛出 CircuitOpenError"""
+        if not self.config.enabled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refresh(now)
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and self.probes < self.config.half_open_max_calls:
+                self.probes += 1
+                return
+            self.stats["rejected"] += 1
+            retry_in = max(0.0, self.opened_at + self.config.recovery_timeout - now)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self.probes = 0
+
+    def record_failure(self, exc: BaseException) -> None:
+        if not counts_as_failure(exc):
+            # 非健康类错误:半开试探名额归还,状态不变
+            with self._lock:
+                if self.state == HALF_OPEN and self.probes:
+                    self.probes -= 1
+            return
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.config.failure_threshold:
+                if self.state != OPEN:
+                    self.stats["opened"] += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh(time.monotonic())
+            return {"state": self.state, "failures": self.failures, **self.stats}
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str, base_url: str) -> CircuitBreaker:
+    """获取 (提供商, base_url) 对应的熔断器"""
+    key = (provider, base_url)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(f"{provider}({base_url})")
+        return breaker
+
+
+def breaker_stats() -> Dict[str, Dict[str, Any]]:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
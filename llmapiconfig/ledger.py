@@ -0,0 +1,332 @@
+"""
+用量账本
+每次调用追加一条记录(提供商、模型、token 用量、耗时、首字延迟、标签),
+批量写入本地 JSON Lines 文件或 SQLite,并提供按提供商/标签聚合的查询,
+用于找出最耗时、最耗 token 的 Agent 轮次.
+
+命令行查看汇总:
+    python -m llmapiconfig.ledger ledger.db --group-by agent round
+"""
+
+import argparse
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from .settings import settings, LedgerConfig
+
+_tags: "contextvars.ContextVar[Dict[str, str]]" = contextvars.ContextVar("llm_ledger_tags", default={})
+
+
+@contextlib.contextmanager
+def ledger_tags(**tags: Any) -> Iterator[Dict[str, str]]:
+    """在作用域内给之后的调用打标签,与外层标签合并
+
+    ``with ledger_tags(agent="bench", round="select_tool"): ...``
+    """
+    merged = {**_tags.get(), **{k: str(v) for k, v in tags.items() if v is not None}}
+    token = _tags.set(merged)
+    try:
+        yield merged
+    finally:
+        _tags.reset(token)
+
+
+def current_tags() -> Dict[str, str]:
+    return _tags.get()
+
+
+@dataclass
+class LedgerEntry:
+    """一次逻辑调用(包含其重试)的记录"""
+    ts: float
+    provider: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    latency: float = 0.0
+    ttfb: Optional[float] = None
+    stream: bool = False
+    cache_hit: bool = False  # 由本地响应缓存返回,没有实际请求
+    status: str = "ok"
+    tags: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+_COLUMNS = [f for f in LedgerEntry.__dataclass_fields__ if f != "tags"]
+
+
+class JSONLinesBackend:
+    """每行一条 JSON 记录,只追加"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, entries: List[LedgerEntry]) -> None:
+        lines = "".join(json.dumps(asdict(e), ensure_ascii=False, separators=(",", ":")) + "\n" for e in entries)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def read(self, since: Optional[float] = None) -> Iterator[LedgerEntry]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = LedgerEntry(**json.loads(line))
+                if since is None or entry.ts >= since:
+                    yield entry
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteBackend:
+    """SQLite 表 ledger,标签以 JSON 存储"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ledger ("
+                "ts REAL, provider TEXT, model TEXT, prompt_tokens INTEGER, completion_tokens INTEGER, "
+                "cached_tokens INTEGER, latency REAL, ttfb REAL, stream INTEGER, cache_hit INTEGER, "
+                "status TEXT, tags TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ledger_ts ON ledger (ts)")
+
+    def write(self, entries: List[LedgerEntry]) -> None:
+        rows = [
+            tuple(getattr(e, c) for c in _COLUMNS) + (json.dumps(e.tags, ensure_ascii=False),)
+            for e in entries
+        ]
+        placeholders = ",".join("?" * (len(_COLUMNS) + 1))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO ledger ({','.join(_COLUMNS)},tags) VALUES ({placeholders})", rows
+            )
+
+    def read(self, since: Optional[float] = None) -> Iterator[LedgerEntry]:
+        query = f"SELECT {','.join(_COLUMNS)},tags FROM ledger"
+        params: Sequence[Any] = ()
+        if since is not None:
+            query += " WHERE ts >= ?"
+            params = (since,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY ts", params).fetchall()
+        for row in rows:
+            values = dict(zip(_COLUMNS, row))
+            values["stream"] = bool(values["stream"])
+            values["cache_hit"] = bool(values["cache_hit"])
+            yield LedgerEntry(tags=json.loads(row[-1] or "{}"), **values)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _open_backend(path: str):
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        return SQLiteBackend(path)
+    return JSONLinesBackend(path)
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Ledger:
+    """只追加的用量账本
+
+    record() 只把记录放入内存缓冲区;缓冲区达到 batch_size 或每隔 flush_interval 秒
+    由后台线程批量写入,不在请求路径上做磁盘IO.
+    """
+
+    def __init__(self, path: str, batch_size: int = 100, flush_interval: float = 2.0):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._backend = _open_backend(path)
+        self._buffer: List[LedgerEntry] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="llm-ledger", daemon=True)
+        self._writer.start()
+
+    def record(self, entry: LedgerEntry) -> None:
+        with self._lock:
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """把缓冲区中的记录写入文件"""
+        with self._write_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if batch:
+                self._backend.write(batch)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join(timeout=5)
+        self.flush()
+        self._backend.close()
+
+    def entries(self, since: Optional[float] = None) -> List[LedgerEntry]:
+        """读取全部记录(含尚未写入的缓冲区);since 为 Unix 时间戳"""
+        self.flush()
+        return list(self._backend.read(since))
+
+    def summary(
+        self,
+        group_by: Sequence[str] = ("provider",),
+        since: Optional[float] = None,
+        sort_by: str = "latency_total",
+    ) -> List[Dict[str, Any]]:
+        """按字段或标签分组汇总,默认按总耗时降序
+
+        group_by 中的名称先匹配记录字段(provider、model、stream、status...),
+        否则按标签(agent、round...)取值.本地缓存命中只计入 cache_hits,不计 token 与耗时.
+        """
+        groups: Dict[tuple, Dict[str, Any]] = {}
+        latencies: Dict[tuple, List[float]] = {}
+        for entry in self.entries(since):
+            key = tuple(_group_value(entry, name) for name in group_by)
+            row = groups.get(key)
+            if row is None:
+                row = groups[key] = {
+                    **dict(zip(group_by, key)),
+                    "calls": 0, "errors": 0, "cache_hits": 0,
+                    "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "total_tokens": 0,
+                    "latency_total": 0.0, "_ttfb": [],
+                }
+                latencies[key] = []
+            row["calls"] += 1
+            if entry.status != "ok":
+                row["errors"] += 1
+            if entry.cache_hit:
+                row["cache_hits"] += 1
+                continue
+            row["prompt_tokens"] += entry.prompt_tokens
+            row["completion_tokens"] += entry.completion_tokens
+            row["cached_tokens"] += entry.cached_tokens
+            row["total_tokens"] += entry.total_tokens
+            row["latency_total"] += entry.latency
+            latencies[key].append(entry.latency)
+            if entry.ttfb is not None:
+                row["_ttfb"].append(entry.ttfb)
+        rows = []
+        for key, row in groups.items():
+            samples = latencies[key]
+            ttfb = row.pop("_ttfb")
+            row["latency_avg"] = row["latency_total"] / len(samples) if samples else None
+            row["latency_p50"] = _percentile(samples, 0.5)
+            row["latency_p95"] = _percentile(samples, 0.95)
+            row["ttfb_avg"] = sum(ttfb) / len(ttfb) if ttfb else None
+            rows.append(row)
+        rows.sort(key=lambda r: r.get(sort_by) or 0, reverse=True)
+        return rows
+
+
+def _group_value(entry: LedgerEntry, name: str) -> Any:
+    if name in LedgerEntry.__dataclass_fields__ and name != "tags":
+        return getattr(entry, name)
+    return entry.tags.get(name, "")
+
+
+_ledger: Optional[Ledger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger(config: Optional[LedgerConfig] = None) -> Optional[Ledger]:
+    """全局账本;未设置 LLM_LEDGER_PATH 时返回 None"""
+    global _ledger
+    if _ledger is not None:
+        return _ledger
+    config = config or settings.ledger
+    if not config.path:
+        return None
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = Ledger(config.path, config.batch_size, config.flush_interval)
+            atexit.register(_ledger.close)
+        return _ledger
+
+
+def set_ledger(ledger: Optional[Ledger]) -> None:
+    """替换全局账本(传入 None 关闭记录)"""
+    global _ledger
+    with _ledger_lock:
+        _ledger = ledger
+
+
+def _format_row(row: Dict[str, Any], group_by: Sequence[str]) -> str:
+    def fmt(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value:.3f}"
+    keys = " / ".join(str(row[name]) or "-" for name in group_by)
+    return (
+        f"{keys:<40} {row['calls']:>6} {row['errors']:>6} {row['cache_hits']:>6} "
+        f"{row['prompt_tokens']:>10} {row['completion_tokens']:>10} "
+        f"{fmt(row['latency_total']):>10} {fmt(row['latency_avg']):>8} {fmt(row['latency_p95']):>8} {fmt(row['ttfb_avg']):>8}"
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="汇总用量账本")
+    parser.add_argument("path", help="账本文件(.jsonl 或 .db)")
+    parser.add_argument("--group-by", nargs="+", default=["provider"], help="分组字段或标签,如 provider agent round")
+    parser.add_argument("--since", type=float, default=None, help="只统计最近多少秒的记录")
+    parser.add_argument("--sort-by", default="latency_total",
+                        choices=["latency_total", "latency_avg", "latency_p95", "total_tokens", "prompt_tokens", "calls"])
+    parser.add_argument("--json", action="store_true", help="以JSON输出")
+    args = parser.parse_args(argv)
+
+    ledger = Ledger(args.path)
+    since = time.time() - args.since if args.since else None
+    rows = ledger.summary(args.group_by, since, args.sort_by)
+    ledger.close()
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    header = " / ".join(args.group_by)
+    print(f"{header:<40} {'calls':>6} {'errors':>6} {'cached':>6} {'prompt':>10} {'completion':>10} "
+          f"{'total_s':>10} {'avg_s':>8} {'p95_s':>8} {'ttfb_s':>8}")
+    for row in rows:
+        print(_format_row(row, args.group_by))
+
+
+if __name__ == "__main__":
+    main()
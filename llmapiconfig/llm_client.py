@@ -4,263 +4,423 @@
 """
 
 import asyncio
+import contextvars
 import json
-from typing import List, Dict, Any, Optional, AsyncGenerator
+import time
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, AsyncGenerator, Iterable, Tuple, Union
 import httpx
 from .settings import settings, LLMConfig
+from . import metrics
+from .cache import ResponseCache, get_response_cache, make_cache_key
+from .circuit_breaker import get_breaker
+from .ledger import Ledger, LedgerEntry, current_tags, get_ledger
+from .rate_limit import (
+    PRIORITY_DEFAULT,
+    get_scheduler,
+    parse_retry_after,
+)
+from .resilience import DeadlineExceeded, attempt_timeout, current_deadline, get_resilience
+from .router import router, should_route
+from .prompt_cache import has_hints, strip_hints
+from .providers import extract_text, get_adapter
+from .singleflight import singleflight
+from .streaming import SSEParser, JSONArrayParser
+from .tokens import calibrate, estimate_messages
+from .transport import get_client, shutdown
+from .usage import StreamUsage, Usage
+
+# 当前请求的限流参数 (预估token, 优先级),供每次重试/对冲尝试重新申请预算
+_admission: "contextvars.ContextVar[Optional[Tuple[int, int]]]" = contextvars.ContextVar(
+    "llm_admission", default=None
+)
 
 
 class LLMClient:
-    """大模型客户端基类"""
+    """大模型客户端基类
+    
+    默认使用 transport 模块中按提供商共享的连接池;
+    传入 client 时使用调用方自己的 AsyncClient,生命周期也由调用方负责.
+    请求格式与响应解析由 providers 中提供商对应的适配器负责.
+    """
     
-    def __init__(self, provider: str = None):
+    def __init__(
+        self, 
+        provider: str = None, 
+        client: Optional[httpx.AsyncClient] = None,
+        cache: Optional[ResponseCache] = None
+    ):
         self.provider = provider or settings.default_provider
         self.config = settings.get_config(self.provider)
-        self.client = httpx.AsyncClient(timeout=self.config.timeout)
+        self.adapter = get_adapter(self.provider)
+        self.endpoint = self.adapter.endpoint(self.config)
+        self._client = client
+        self.cache = cache if cache is not None else get_response_cache()
+        self.scheduler = get_scheduler(self.provider, self.config)
+        self.resilience = get_resilience(self.provider)
+        self.breaker = get_breaker(self.provider, self.config.base_url)
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is not None:
+            return self._client
+        return get_client(self.provider, self.config)
     
     async def __aenter__(self):
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.client.aclose()
+        # 共享连接由 transport.shutdown() 统一关闭,这里不做处理
+        pass
     
     async def chat_completion(
         self, 
         messages: List[Dict[str, str]], 
         stream: bool = False,
+        use_cache: bool = True,
+        coalesce: Optional[bool] = None,
+        priority: int = PRIORITY_DEFAULT,
         **kwargs
     ) -> Dict[str, Any]:
-        """聊天补全接口"""
-        if self.provider == "openai":
-            return await self._openai_chat(messages, stream, **kwargs)
-        elif self.provider == "claude":
-            return await self._claude_chat(messages, stream, **kwargs)
-        elif self.provider == "qwen":
-            return await self._qwen_chat(messages, stream, **kwargs)
-        elif self.provider == "zhipu":
-            return await self._zhipu_chat(messages, stream, **kwargs)
-        elif self.provider == "gemini":
-            return await self._gemini_chat(messages, stream, **kwargs)
-        else:
-            raise ValueError(f"不支持的提供商: {self.provider}")
-    
-    async def _openai_chat(
-        self, 
-        messages: List[Dict[str, str]], 
-        stream: bool = False,
-        **kwargs
-    ) -> Dict[str, Any]:
-        """OpenAI API调用"""
-        headers = {
-            "Authorization": f"Bearer {self.config.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": self.config.model,
-            "messages": messages,
-            "max_tokens": kwargs.get("max_tokens", self.config.max_tokens),
-            "temperature": kwargs.get("temperature", self.config.temperature),
-            "stream": stream
-        }
+        """聊天补全接口
         
-        url = f"{self.config.base_url}/chat/completions"
+        非流式请求依次经过:
+        1. 响应缓存(启用时);use_cache=False 可跳过单次请求的缓存
+        2. 请求合并:同一事件循环内同时在途的相同请求只发送一次;
+           coalesce 默认取 settings.coalesce_requests
+        3. 客户端限流:配置了 RPM/TPM 预算时按 priority 排队(数值越小越优先)
         
+        json_mode=True 请求提供商的原生 JSON 输出(OpenAI/智谱/通义千问的 response_format、
+        Gemini 的 responseMimeType、Claude 的 "{" 预填充),回复文本可用 structured.extract_json 解析.
+        """
         if stream:
-            return await self._stream_request(url, headers, data)
-        else:
-            response = await self.client.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            return response.json()
-    
-    async def _claude_chat(
-        self, 
-        messages: List[Dict[str, str]], 
-        stream: bool = False,
-        **kwargs
-    ) -> Dict[str, Any]:
-        """Claude API调用"""
-        headers = {
-            "x-api-key": self.config.api_key,
-            "Content-Type": "application/json",
-            "anthropic-version": "2023-06-01"
-        }
-        
-        # Claude API格式转换
-        system_message = ""
-        claude_messages = []
+            return await self._dispatch(messages, stream, priority, **kwargs)
         
-        for msg in messages:
-            if msg["role"] == "system":
-                system_message = msg["content"]
-            else:
-                claude_messages.append(msg)
+        temperature = kwargs.get("temperature", self.config.temperature)
+        use_cache = use_cache and self.cache is not None and self.cache.should_cache(temperature)
+        if coalesce is None:
+            coalesce = settings.coalesce_requests
+        if not use_cache and not coalesce:
+            return await self._dispatch(messages, stream, priority, **kwargs)
         
-        data = {
-            "model": self.config.model,
-            "max_tokens": kwargs.get("max_tokens", self.config.max_tokens),
-            "temperature": kwargs.get("temperature", self.config.temperature),
-            "messages": claude_messages,
-            "stream": stream
-        }
+        extra = {k: v for k, v in kwargs.items() if k not in ("temperature", "max_tokens")}
+        key = make_cache_key(
+            self.provider,
+            self.config.model,
+            messages,
+            temperature,
+            kwargs.get("max_tokens", self.config.max_tokens),
+            **extra
+        )
+        if use_cache:
+            cached = self.cache.get(key)
+            metrics.inc("llm_cache_requests_total", provider=self.provider, result="miss" if cached is None else "hit")
+            if cached is not None:
+                ledger = get_ledger()
+                if ledger is not None:
+                    self._account(ledger, time.monotonic(), self.adapter.extract_usage(cached), cache_hit=True)
+                return cached
         
-        if system_message:
-            data["system"] = system_message
+        async def fetch() -> Dict[str, Any]:
+            response = await self._dispatch(messages, stream, priority, **kwargs)
+            if use_cache:
+                self.cache.set(key, response)
+            return response
         
-        url = f"{self.config.base_url}/v1/messages"
-        
-        if stream:
-            return await self._stream_request(url, headers, data)
-        else:
-            response = await self.client.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            return response.json()
+        if coalesce:
+            return await singleflight.do(f"{self.config.base_url}:{key}", fetch)
+        return await fetch()
     
-    async def _qwen_chat(
+    async def _dispatch(
         self, 
         messages: List[Dict[str, str]], 
         stream: bool = False,
+        priority: int = PRIORITY_DEFAULT,
         **kwargs
     ) -> Dict[str, Any]:
-        """通义千问API调用"""
-        headers = {
-            "Authorization": f"Bearer {self.config.api_key}",
-            "Content-Type": "application/json"
-        }
+        """构造提供商格式的请求并发送
         
-        data = {
-            "model": self.config.model,
-            "input": {
-                "messages": messages
-            },
-            "parameters": {
-                "max_tokens": kwargs.get("max_tokens", self.config.max_tokens),
-                "temperature": kwargs.get("temperature", self.config.temperature),
-                "stream": stream
-            }
-        }
+        发送前在本地估算提示词token数(用于限流),非流式响应返回后用真实用量校准估算系数.
+        """
+        prompt_tokens = estimate_messages(messages, self.provider)
+        admission = None
+        if self.scheduler.enabled:
+            admission = (prompt_tokens + kwargs.get("max_tokens", self.config.max_tokens), priority)
+        if not settings.prompt_cache and has_hints(messages):
+            messages = strip_hints(messages)
+        data = self.adapter.build_request(self.config, messages, stream, kwargs)
+        token = _admission.set(admission)
+        try:
+            if stream:
+                return self._stream_request(self.endpoint.stream_url, self.endpoint.stream_headers, data)
+            result = await self._post_json(self.endpoint.url, self.endpoint.headers, data)
+        finally:
+            _admission.reset(token)
+        result = self.adapter.finish(result, kwargs)
+        calibrate(self.provider, prompt_tokens, self.adapter.extract_usage(result).prompt_tokens)
+        return result
+    
+    async def _admit(self, admission: Optional[Tuple[int, int]]) -> None:
+        """每次尝试(包括重试和对冲副本)前向限流器申请预算,排队时间同样受截止时间约束"""
+        if admission is None:
+            return
+        with metrics.span("llm.queue", provider=self.provider, tokens=admission[0]):
+            deadline = current_deadline()
+            if deadline is None:
+                await self.scheduler.acquire(*admission)
+                return
+            try:
+                await asyncio.wait_for(self.scheduler.acquire(*admission), max(0.0, deadline.remaining()))
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("等待限流预算时超过截止时间") from None
+    
+    async def _post_json(self, url: str, headers: Dict, data: Dict) -> Dict[str, Any]:
+        """发送非流式请求并解析JSON响应,瞬时故障按重试策略重试"""
+        admission = _admission.get()
         
-        url = f"{self.config.base_url}/chat/completions"
+        async def attempt() -> Dict[str, Any]:
+            # 熔断时直接拒绝,不占用限流预算
+            self.breaker.before_call()
+            try:
+                await self._admit(admission)
+                timeout = attempt_timeout(self.config.timeout)
+            except BaseException as exc:
+                # 排队超时、截止时间已过或取消不计入熔断,只归还半开试探名额
+                self.breaker.record_failure(exc)
+                raise
+            with metrics.span("llm.attempt", provider=self.provider):
+                try:
+                    response = await self.client.post(
+                        url, headers=headers, json=data, timeout=timeout, extensions=metrics.http_extensions()
+                    )
+                    self._check_response(response)
+                except BaseException as exc:
+                    self.breaker.record_failure(exc)
+                    raise
+                self.breaker.record_success()
+                with metrics.span("llm.parse"):
+                    result = response.json()
+                if metrics.enabled():
+                    self._record_response(response)
+                return result
         
-        if stream:
-            return await self._stream_request(url, headers, data)
-        else:
-            response = await self.client.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            return response.json()
+        ledger = get_ledger()
+        start = time.monotonic()
+        with metrics.span("llm.request", provider=self.provider, model=self.config.model, stream=False):
+            try:
+                result = await self.resilience.call(attempt)
+            except Exception:
+                if ledger is not None:
+                    self._account(ledger, start, Usage(), status="error")
+                raise
+        if ledger is not None or metrics.enabled():
+            usage = self.adapter.extract_usage(result)
+            self._record_usage(usage)
+            if ledger is not None:
+                self._account(ledger, start, usage)
+        return result
     
-    async def _zhipu_chat(
-        self, 
-        messages: List[Dict[str, str]], 
+    def _record_response(self, response: httpx.Response) -> None:
+        """记录请求/响应字节数指标"""
+        metrics.observe("llm_request_bytes", len(response.request.content), provider=self.provider)
+        metrics.observe("llm_response_bytes", response.num_bytes_downloaded, provider=self.provider)
+        metrics.observe("llm_response_seconds", response.elapsed.total_seconds(), provider=self.provider)
+    
+    def _record_usage(self, usage: Usage) -> None:
+        if usage.prompt_tokens:
+            metrics.inc("llm_tokens_total", usage.prompt_tokens, provider=self.provider, kind="prompt")
+        if usage.completion_tokens:
+            metrics.inc("llm_tokens_total", usage.completion_tokens, provider=self.provider, kind="completion")
+        if usage.cached_tokens:
+            metrics.inc("llm_tokens_total", usage.cached_tokens, provider=self.provider, kind="cached")
+    
+    def _account(
+        self,
+        ledger: Ledger,
+        start: float,
+        usage: Usage,
         stream: bool = False,
-        **kwargs
-    ) -> Dict[str, Any]:
-        """智谱AI API调用"""
-        headers = {
-            "Authorization": f"Bearer {self.config.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": self.config.model,
-            "messages": messages,
-            "max_tokens": kwargs.get("max_tokens", self.config.max_tokens),
-            "temperature": kwargs.get("temperature", self.config.temperature),
-            "stream": stream
-        }
-        
-        url = f"{self.config.base_url}/chat/completions"
+        ttfb: Optional[float] = None,
+        status: str = "ok",
+        cache_hit: bool = False
+    ) -> None:
+        """向用量账本追加一条记录(只写入内存缓冲区)"""
+        ledger.record(LedgerEntry(
+            ts=time.time(),
+            provider=self.provider,
+            model=self.config.model,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            cached_tokens=usage.cached_tokens,
+            latency=0.0 if cache_hit else time.monotonic() - start,
+            ttfb=ttfb,
+            stream=stream,
+            cache_hit=cache_hit,
+            status=status,
+            tags=current_tags(),
+        ))
+    
+    def _check_response(self, response: httpx.Response) -> None:
+        """检查响应状态;429时通知限流器暂停发放令牌"""
+        if response.status_code == 429:
+            self.scheduler.penalize(parse_retry_after(response.headers.get("retry-after")))
+        response.raise_for_status()
+    
+    def _stream_request(self, url: str, headers: Dict, data: Dict) -> AsyncGenerator[Dict[str, Any], None]:
+        """流式请求处理,返回逐个产出数据块的异步生成器"""
+        return self._stream_events(url, headers, data, _admission.get())
+    
+    async def _stream_events(
+        self, 
+        url: str, 
+        headers: Dict, 
+        data: Dict, 
+        admission: Optional[Tuple[int, int]]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """按响应的 Content-Type 选择解析器: text/event-stream 走 SSE,
+        否则按流式 JSON 数组处理(Gemini 默认格式).
         
-        if stream:
-            return await self._stream_request(url, headers, data)
-        else:
-            response = await self.client.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            return response.json()
+        只在收到第一个数据块之前重试,之后的错误直接抛出,避免重复输出.
+        """
+        self.resilience.budget.deposit()
+        attempt = 0
+        ledger = get_ledger()
+        stream_usage = StreamUsage(self.adapter.extract_usage) if ledger is not None or metrics.enabled() else None
+        start = time.monotonic()
+        ttfb: Optional[float] = None
+        status = "ok"
+        # 生成器可能在不同上下文中恢复,span 不设为当前 span,手动结束
+        request_span = metrics.start_span("llm.request", provider=self.provider, model=self.config.model, stream=True)
+        try:
+            while True:
+                started = False
+                # None: 尚未经过熔断器;False: 已放行但未拿到正常响应头;True: 已记录成功
+                healthy: Optional[bool] = None
+                attempt_span = metrics.start_span("llm.attempt", parent=request_span, provider=self.provider)
+                try:
+                    # 熔断时直接拒绝,不占用限流预算
+                    self.breaker.before_call()
+                    healthy = False
+                    await self._admit(admission)
+                    timeout = attempt_timeout(self.config.timeout)
+                    async with self.client.stream(
+                        "POST", url, headers=headers, json=data, timeout=timeout,
+                        extensions=metrics.http_extensions(attempt_span)
+                    ) as response:
+                        self._check_response(response)
+                        self.breaker.record_success()
+                        healthy = True
+                        async for item in _iter_stream_items(response):
+                            if not started:
+                                started = True
+                                ttfb = time.monotonic() - start
+                                attempt_span.event("first_chunk")
+                                metrics.observe("llm_ttfb_seconds", attempt_span.duration, provider=self.provider)
+                            if stream_usage is not None:
+                                stream_usage.feed(item)
+                            yield item
+                    if metrics.enabled():
+                        self._record_response(response)
+                    attempt_span.end()
+                    return
+                except BaseException as exc:
+                    if not isinstance(exc, GeneratorExit):
+                        attempt_span.record_exception(exc)
+                    attempt_span.end()
+                    if healthy is False:
+                        self.breaker.record_failure(exc)
+                    if not isinstance(exc, Exception):
+                        raise
+                    delay = None if started else self.resilience.retry_delay(attempt, exc)
+                    if delay is None:
+                        raise
+                await asyncio.sleep(delay)
+                attempt += 1
+        except Exception as exc:
+            status = "error"
+            request_span.record_exception(exc)
+            raise
+        except BaseException:
+            # 调用方提前结束迭代或任务被取消
+            status = "cancelled"
+            raise
+        finally:
+            request_span.end()
+            if stream_usage is not None:
+                self._record_usage(stream_usage.usage)
+                if ledger is not None:
+                    self._account(ledger, start, stream_usage.usage, stream=True, ttfb=ttfb, status=status)
     
-    async def _gemini_chat(
+    async def chat_stream(
         self, 
         messages: List[Dict[str, str]], 
-        stream: bool = False,
         **kwargs
-    ) -> Dict[str, Any]:
-        """Gemini API调用"""
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # Gemini API格式转换
-        gemini_contents = []
-        system_instruction = ""
-        
-        for msg in messages:
-            if msg["role"] == "system":
-                system_instruction = msg["content"]
-            elif msg["role"] == "user":
-                gemini_contents.append({
-                    "role": "user",
-                    "parts": [{"text": msg["content"]}]
-                })
-            elif msg["role"] == "assistant":
-                gemini_contents.append({
-                    "role": "model",
-                    "parts": [{"text": msg["content"]}]
-                })
-        
-        data = {
-            "contents": gemini_contents,
-            "generationConfig": {
-                "maxOutputTokens": kwargs.get("max_tokens", self.config.max_tokens),
-                "temperature": kwargs.get("temperature", self.config.temperature),
-            }
-        }
-        
-        if system_instruction:
-            data["systemInstruction"] = {
-                "parts": [{"text": system_instruction}]
-            }
-        
-        # 构建URL
-        method = "streamGenerateContent" if stream else "generateContent"
-        url = f"{self.config.base_url}/models/{self.config.model}:{method}?key={self.config.api_key}"
+    ) -> AsyncGenerator[str, None]:
+        """流式聊天接口,逐段产出增量文本"""
+        stream = await self.chat_completion(messages, stream=True, **kwargs)
+        extract_delta = self.adapter.extract_delta
+        async for chunk in stream:
+            delta = extract_delta(chunk)
+            if delta:
+                yield delta
+
+
+def _decode_sse_events(events) -> List[Dict[str, Any]]:
+    """把 SSE 事件解码为 JSON 对象,跳过 [DONE] 和非 JSON 数据"""
+    items = []
+    for _event, data in events:
+        if data == b"[DONE]":
+            continue
+        try:
+            items.append(json.loads(data))
+        except json.JSONDecodeError:
+            continue
+    return items
+
+
+async def _iter_stream_items(response: httpx.Response) -> AsyncGenerator[Dict[str, Any], None]:
+    """按响应的 Content-Type 选择解析器,逐个产出 JSON 数据块"""
+    if "text/event-stream" in response.headers.get("content-type", ""):
+        parser = SSEParser()
+        async for chunk in response.aiter_bytes():
+            for item in _decode_sse_events(parser.feed(chunk)):
+                yield item
+        for item in _decode_sse_events(parser.flush()):
+            yield item
+    else:
+        parser = JSONArrayParser()
+        async for chunk in response.aiter_bytes():
+            for raw in parser.feed(chunk):
+                yield json.loads(raw)
+
+
+# 便捷函数
+async def chat_with_provider(
+    messages: List[Dict[str, str]], 
+    provider: str = None,
+    stream: bool = False,
+    **kwargs
+) -> Tuple[str, Dict[str, Any]]:
+    """聊天并返回 (实际使用的提供商, 响应)
+    
+    provider="auto" 或未指定且启用了路由时,由 router 选择提供商并在失败时切换.
+    """
+    if should_route(provider):
+        async def call(candidate: str) -> Dict[str, Any]:
+            start = time.monotonic()
+            async with LLMClient(candidate) as client:
+                response = await client.chat_completion(messages, stream, **kwargs)
+            if stream:
+                # 流式调用到这里只拿到生成器,成败和耗时要等流读完才知道
+                return router.track_stream(candidate, response, start)
+            return response
         
-        if stream:
-            return await self._gemini_stream_request(url, headers, data)
-        else:
-            response = await self.client.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            return response.json()
+        return await router.call(call, measure=not stream)
     
-    async def _gemini_stream_request(self, url: str, headers: Dict, data: Dict) -> AsyncGenerator:
-        """Gemini流式请求处理"""
-        async with self.client.stream("POST", url, headers=headers, json=data) as response:
-            response.raise_for_status()
-            async for line in response.aiter_lines():
-                if line.strip():
-                    try:
-                        # Gemini流式响应格式处理
-                        if line.startswith("data: "):
-                            chunk_data = line[6:]
-                        else:
-                            chunk_data = line
-                        yield json.loads(chunk_data)
-                    except json.JSONDecodeError:
-                        continue
-        """流式请求处理"""
-        async with self.client.stream("POST", url, headers=headers, json=data) as response:
-            response.raise_for_status()
-            async for line in response.aiter_lines():
-                if line.startswith("data: "):
-                    chunk_data = line[6:]
-                    if chunk_data.strip() == "[DONE]":
-                        break
-                    try:
-                        yield json.loads(chunk_data)
-                    except json.JSONDecodeError:
-                        continue
+    async with LLMClient(provider) as client:
+        return client.provider, await client.chat_completion(messages, stream, **kwargs)
 
 
-# 便捷函数
 async def chat(
     messages: List[Dict[str, str]], 
     provider: str = None,
@@ -268,8 +428,48 @@ async def chat(
     **kwargs
 ) -> Dict[str, Any]:
     """便捷的聊天函数"""
-    async with LLMClient(provider) as client:
-        return await client.chat_completion(messages, stream, **kwargs)
+    _, response = await chat_with_provider(messages, provider, stream, **kwargs)
+    return response
+
+
+async def chat_stream(
+    messages: List[Dict[str, str]], 
+    provider: str = None,
+    **kwargs
+) -> AsyncGenerator[str, None]:
+    """便捷的流式聊天函数,逐段产出增量文本
+    
+    走路由时只在产出第一段文本之前切换提供商.
+    """
+    if not should_route(provider):
+        async with LLMClient(provider) as client:
+            async for delta in client.chat_stream(messages, **kwargs):
+                yield delta
+        return
+    
+    last_error: Optional[Exception] = None
+    for candidate in router.candidates()[: settings.router.max_failover + 1]:
+        started = False
+        start = time.monotonic()
+        try:
+            async with LLMClient(candidate) as client:
+                async for delta in client.chat_stream(messages, **kwargs):
+                    if not started:
+                        router.record_success(candidate, time.monotonic() - start)
+                        started = True
+                    yield delta
+            return
+        except DeadlineExceeded:
+            router.record_failure(candidate)
+            raise
+        except Exception as exc:  # noqa: BLE001
+            if started:
+                raise
+            router.record_failure(candidate)
+            last_error = exc
+    if last_error is None:
+        raise ValueError("没有可用的提供商,请检查API密钥配置")
+    raise last_error
 
 
 async def simple_chat(
@@ -279,19 +479,132 @@ async def simple_chat(
 ) -> str:
     """简单的聊天函数,返回文本内容"""
     messages = [{"role": "user", "content": prompt}]
-    response = await chat(messages, provider, **kwargs)
+    actual_provider, response = await chat_with_provider(messages, provider, **kwargs)
+    return extract_text(actual_provider, response)
+
+
+# 批量并发调用
+@dataclass
+class ChatRequest:
+    """批量调用中的单个请求"""
+    messages: List[Dict[str, str]]
+    provider: Optional[str] = None
+    options: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class ChatResult:
+    """批量调用中单个请求的结果,失败时 error 不为空"""
+    index: int
+    request: ChatRequest
+    response: Any = None
+    error: Optional[Exception] = None
+    elapsed: float = 0.0
+    served_by: Optional[str] = None
     
-    # 确定实际使用的提供商
-    actual_provider = provider or settings.default_provider
+    @property
+    def ok(self) -> bool:
+        return self.error is None
     
-    # 根据不同提供商解析响应
-    if actual_provider in ["openai", "zhipu"]:
-        return response["choices"][0]["message"]["content"]
-    elif actual_provider == "claude":
-        return response["content"][0]["text"]
-    elif actual_provider == "qwen":
-        return response["output"]["choices"][0]["message"]["content"]
-    elif actual_provider == "gemini":
-        return response["candidates"][0]["content"]["parts"][0]["text"]
-    else:
-        raise ValueError(f"不支持的提供商: {actual_provider}")
\ No newline at end of file
+    @property
+    def provider(self) -> str:
+        """实际处理请求的提供商(走路由时可能与请求中指定的不同)"""
+        return self.served_by or self.request.provider or settings.default_provider
+
+
+async def _run_batch_item(
+    index: int,
+    request: ChatRequest,
+    semaphore: asyncio.Semaphore,
+    text: bool,
+    kwargs: Dict[str, Any]
+) -> ChatResult:
+    result = ChatResult(index=index, request=request)
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            result.served_by, response = await chat_with_provider(
+                request.messages, request.provider, **{**kwargs, **request.options}
+            )
+            result.response = extract_text(result.served_by, response) if text else response
+        except Exception as exc:  # noqa: BLE001
+            # 单个请求失败不影响其他请求
+            result.error = exc
+        result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _batch_tasks(
+    requests: Iterable[Union[ChatRequest, List[Dict[str, str]]]],
+    concurrency: int,
+    text: bool,
+    kwargs: Dict[str, Any]
+) -> List["asyncio.Task[ChatResult]"]:
+    if concurrency < 1:
+        raise ValueError("concurrency 必须大于0")
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = []
+    for index, request in enumerate(requests):
+        if not isinstance(request, ChatRequest):
+            request = ChatRequest(messages=request)
+        tasks.append(asyncio.ensure_future(_run_batch_item(index, request, semaphore, text, kwargs)))
+    return tasks
+
+
+async def _gather_batch(tasks: List["asyncio.Task[ChatResult]"]) -> List[ChatResult]:
+    try:
+        return list(await asyncio.gather(*tasks))
+    finally:
+        # 调用方被取消时不留下后台任务
+        for task in tasks:
+            task.cancel()
+
+
+async def chat_many(
+    requests: Iterable[Union[ChatRequest, List[Dict[str, str]]]],
+    concurrency: int = 8,
+    **kwargs
+) -> List[ChatResult]:
+    """并发执行多个聊天请求,按输入顺序返回结果
+    
+    requests 中的元素可以是 ChatRequest,也可以直接是消息列表(使用默认提供商).
+    最多同时进行 concurrency 个请求;单个请求的异常记录在对应 ChatResult.error 中.
+    """
+    return await _gather_batch(_batch_tasks(requests, concurrency, False, kwargs))
+
+
+async def iter_chat_many(
+    requests: Iterable[Union[ChatRequest, List[Dict[str, str]]]],
+    concurrency: int = 8,
+    text: bool = False,
+    **kwargs
+) -> AsyncGenerator[ChatResult, None]:
+    """与 chat_many 相同,但按完成顺序逐个产出结果;text=True 时 response 为文本"""
+    tasks = _batch_tasks(requests, concurrency, text, kwargs)
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def simple_chat_many(
+    prompts: Union[str, Iterable[str]],
+    providers: Optional[Iterable[Optional[str]]] = None,
+    concurrency: int = 8,
+    **kwargs
+) -> List[ChatResult]:
+    """把每个提示词发送给每个提供商,并发执行,返回文本结果
+    
+    结果按 (提示词, 提供商) 的顺序排列;providers 为空时使用默认提供商.
+    """
+    if isinstance(prompts, str):
+        prompts = [prompts]
+    provider_list = list(providers) if providers is not None else [None]
+    requests = [
+        ChatRequest(messages=[{"role": "user", "content": prompt}], provider=provider)
+        for prompt in prompts
+        for provider in provider_list
+    ]
+    return await _gather_batch(_batch_tasks(requests, concurrency, True, kwargs))
@@ -0,0 +1,98 @@
+"""
+后台事件循环
+在独立线程上运行一个长期存在的事件循环,供同步代码提交协程
+"""
+
+import asyncio
+import atexit
+import concurrent.futures
+import threading
+from typing import Any, Awaitable, Optional
+
+from .transport import shutdown
+
+
+class BackgroundLoop:
+    """运行在守护线程上的事件循环
+
+    同步调用方通过 submit() 拿到 concurrent.futures.Future,
+    可以并发提交多个请求;所有请求共享同一个循环,因此也共享连接池.
+    """
+
+    def __init__(self, name: str = "llm-background-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        self.start()
+        return self._loop
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """启动后台线程(重复调用无副作用)"""
+        with self._lock:
+            if self.is_running():
+                return
+            ready = threading.Event()
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run_forever, args=(ready,), name=self.name, daemon=True
+            )
+            self._thread.start()
+            ready.wait()
+
+    def _run_forever(self, ready: threading.Event) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(ready.set)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def submit(self, coro: Awaitable[Any]) -> "concurrent.futures.Future[Any]":
+        """提交协程,立即返回 Future"""
+        if self._thread is threading.current_thread():
+            raise RuntimeError("不能在后台事件循环线程内同步等待自身提交的任务")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """提交协程并阻塞等待结果"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """关闭共享连接并停止后台线程"""
+        with self._lock:
+            if not self.is_running():
+                return
+            loop, thread = self._loop, self._thread
+            try:
+                asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout)
+            except Exception:  # noqa: BLE001
+                pass
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+            self._thread = None
+
+
+_background_loop: Optional[BackgroundLoop] = None
+_background_lock = threading.Lock()
+
+
+def get_background_loop() -> BackgroundLoop:
+    """返回进程级共享的后台事件循环(单例),进程退出时自动停止"""
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            _background_loop = BackgroundLoop()
+            atexit.register(_background_loop.stop)
+        return _background_loop
@@ -0,0 +1,617 @@
+"""
+埋点与指标
+记录请求各阶段的耗时 span 以及计数器/直方图(延迟、字节数、token、缓存命中、重试),
+通过可插拔的导出器输出:Prometheus 文本(文件或HTTP端点)、JSON 日志、
+以及与 OpenTelemetry 数据模型兼容的进程内导出器.
+
+未启用时 span() 返回共享的空对象,inc()/observe() 只做一次布尔判断,开销可以忽略.
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .settings import settings, MetricsConfig
+
+# 可选依赖:安装了 opentelemetry-api 时 otel 导出器把 span 转交给全局 TracerProvider
+try:
+    from opentelemetry import trace as otel_trace
+    OTEL_AVAILABLE = True
+except ImportError:
+    otel_trace = None
+    OTEL_AVAILABLE = False
+
+# 直方图分桶:名称以 _bytes 结尾的按字节数,其余按秒
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+_enabled = False
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("llm_span", default=None)
+
+
+def _buckets_for(name: str) -> Sequence[float]:
+    if name.endswith("_bytes"):
+        return SIZE_BUCKETS
+    if name.endswith("_tokens"):
+        return COUNT_BUCKETS
+    return LATENCY_BUCKETS
+
+
+def _label_key(labels: Dict[str, Any]) -> _LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class Histogram:
+    """固定分桶直方图"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """按分桶估算分位数(返回所在桶的上界)"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """进程级计数器与直方图,线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[_LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[_LabelKey, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(_buckets_for(name))
+            histogram.observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self.counters.get(name, {}).get(_label_key(labels), 0)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        with self._lock:
+            return self.histograms.get(name, {}).get(_label_key(labels))
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """便于序列化的快照"""
+        with self._lock:
+            return {
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [
+                        {"labels": dict(key), "count": h.count, "sum": h.sum,
+                         "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts))}
+                        for key, h in series.items()
+                    ]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+
+registry = MetricsRegistry()
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    """一段计时区间;以上下文管理器使用,嵌套时自动记录父子关系"""
+
+    __slots__ = ("name", "attributes", "events", "parent", "trace_id", "span_id", "parent_id",
+                 "start_ns", "end_ns", "status", "error", "_token", "_exporter_state")
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional["Span"] = None,
+                 start_ns: Optional[int] = None):
+        self.name = name
+        self.attributes = attributes
+        self.events: List[Tuple[str, int, Dict[str, Any]]] = []
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else _new_id(16)
+        self.span_id = _new_id(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self._token = None
+        self._exporter_state: Dict[str, Any] = {}
+
+    @property
+    def duration(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e9
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def event(self, name: str, **attributes) -> None:
+        self.events.append((name, time.time_ns(), attributes))
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = "error"
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        _exporters.on_start(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.record_exception(exc)
+        self.end()
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        self.end_ns = end_ns if end_ns is not None else time.time_ns()
+        registry.observe("span_duration_seconds", self.duration, span=self.name, status=self.status)
+        _exporters.on_end(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """OTLP/JSON 风格的表示(traceId/spanId/时间戳为纳秒)"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round(self.duration * 1000, 3),
+            "attributes": dict(self.attributes),
+            "events": [{"name": n, "timeUnixNano": t, "attributes": a} for n, t, a in self.events],
+            "status": {"code": "ERROR" if self.status == "error" else "OK", "message": self.error or ""},
+        }
+
+
+class _NoopSpan:
+    """未启用时使用的共享空 span"""
+
+    __slots__ = ()
+    duration = 0.0
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def event(self, name: str, **attributes) -> None:
+        pass
+
+    def record_exception(self, exc: BaseException) -> None:
+        pass
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def span(name: str, **attributes):
+    """开始一个 span: ``with metrics.span("llm.attempt", provider="openai") as s: ...``"""
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, attributes, _current_span.get())
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes):
+    """开始一个不设为当前 span 的 span,需手动调用 end();parent 默认为当前 span
+
+    用于异步生成器等跨越多次 await 且可能在不同上下文中恢复的代码.
+    """
+    if not _enabled:
+        return NOOP_SPAN
+    if not isinstance(parent, Span):
+        parent = _current_span.get()
+    span = Span(name, attributes, parent)
+    _exporters.on_start(span)
+    return span
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get() if _enabled else None
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """计数器加 value"""
+    if _enabled:
+        registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """向直方图记录一个观测值"""
+    if _enabled:
+        registry.observe(name, value, **labels)
+
+
+# httpcore 事件名 -> span 名;DNS 解析包含在 connect 中
+_HTTP_PHASES = {
+    "connect_tcp": "http.connect",
+    "connect_unix_socket": "http.connect",
+    "start_tls": "http.tls",
+    "send_request_headers": "http.send_headers",
+    "send_request_body": "http.send_body",
+    "receive_response_headers": "http.ttfb",
+    "receive_response_body": "http.body",
+}
+
+
+class _HTTPTrace:
+    """httpx trace 扩展回调:把连接、握手、首字节、读取响应体各阶段记为子 span"""
+
+    __slots__ = ("parent", "_started")
+
+    def __init__(self, parent: Span):
+        self.parent = parent
+        self._started: Dict[str, int] = {}
+
+    async def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        parts = event_name.split(".")
+        if len(parts) != 3 or parts[1] not in _HTTP_PHASES:
+            return
+        _, phase, event = parts
+        now = time.time_ns()
+        if event == "started":
+            self._started[phase] = now
+            return
+        start = self._started.pop(phase, None)
+        if start is None:
+            return
+        child = Span(_HTTP_PHASES[phase], {}, self.parent, start_ns=start)
+        if event == "failed":
+            child.status = "error"
+            child.error = repr(info.get("exception"))
+        child.end(now)
+
+
+def http_extensions(parent: Optional[Span] = None) -> Optional[Dict[str, Any]]:
+    """传给 httpx 的 extensions,把 HTTP 各阶段记为 parent(默认当前 span)的子 span;
+    未启用时返回 None"""
+    if not _enabled:
+        return None
+    if not isinstance(parent, Span):
+        parent = _current_span.get()
+        if parent is None:
+            return None
+    return {"trace": _HTTPTrace(parent)}
+
+
+# 导出器
+class SpanExporter:
+    """导出器基类;on_start/on_end 在 span 开始/结束时调用,flush 在退出或手动调用时执行"""
+
+    def on_start(self, span: Span) -> None:
+        pass
+
+    def on_end(self, span: Span) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        self.flush()
+
+
+class InMemorySpanExporter(SpanExporter):
+    """保存已结束的 span(OTLP/JSON 结构),用于测试与进程内分析"""
+
+    def __init__(self, max_spans: int = 10000):
+        self.max_spans = max_spans
+        self._lock = threading.Lock()
+        self._spans: List[Dict[str, Any]] = []
+
+    def on_end(self, span: Span) -> None:
+        with self._lock:
+            if len(self._spans) >= self.max_spans:
+                del self._spans[0]
+            self._spans.append(span.to_dict())
+
+    def get_finished_spans(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans.clear()
+
+
+class JSONLogExporter(SpanExporter):
+    """每个结束的 span 写一行 JSON;path 为空时写到 stderr"""
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def on_end(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                if self.path:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8")
+                else:
+                    self._file = sys.stderr
+            self._file.write(line)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._file is not None and self._file is not sys.stderr:
+                self._file.close()
+            self._file = None
+
+
+class OTelExporter(SpanExporter):
+    """转交给 opentelemetry-api 的全局 TracerProvider,父子关系保持不变"""
+
+    def __init__(self):
+        if not OTEL_AVAILABLE:
+            raise ImportError("otel 导出器需要安装 opentelemetry-api")
+        self._tracer = otel_trace.get_tracer("llmapiconfig")
+
+    def _start(self, span: Span):
+        parent = span.parent._exporter_state.get("otel") if span.parent is not None else None
+        context = otel_trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = span._exporter_state["otel"] = self._tracer.start_span(
+            span.name, context=context, start_time=span.start_ns
+        )
+        return otel_span
+
+    def on_start(self, span: Span) -> None:
+        self._start(span)
+
+    def on_end(self, span: Span) -> None:
+        # HTTP 阶段等不经过 on_start 的 span 在结束时补建
+        otel_span = span._exporter_state.get("otel") or self._start(span)
+        for key, value in span.attributes.items():
+            otel_span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+        for name, timestamp, attributes in span.events:
+            otel_span.add_event(name, attributes, timestamp)
+        if span.status == "error":
+            otel_span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=span.end_ns)
+
+
+_PROM_NAME = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def _prom_labels(key: _LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(_PROM_NAME.sub("_", k), v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in items
+    )
+    return "{" + body + "}"
+
+
+def render_prometheus(metrics: Optional[MetricsRegistry] = None) -> str:
+    """以 Prometheus 文本格式输出全部指标"""
+    metrics = metrics or registry
+    lines: List[str] = []
+    with metrics._lock:
+        for name, series in sorted(metrics.counters.items()):
+            name = _PROM_NAME.sub("_", name)
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_prom_labels(key)} {value:g}")
+        for name, series in sorted(metrics.histograms.items()):
+            name = _PROM_NAME.sub("_", name)
+            lines.append(f"# TYPE {name} histogram")
+            for key, h in series.items():
+                cumulative = 0
+                for bound, count in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else f"{bound:g}"
+                    lines.append(f"{name}_bucket{_prom_labels(key, (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_prom_labels(key)} {h.sum:g}")
+                lines.append(f"{name}_count{_prom_labels(key)} {h.count}")
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusExporter(SpanExporter):
+    """把指标写入 Prometheus 文本文件(textfile collector),或在 port 上提供 /metrics"""
+
+    def __init__(self, path: str = "", port: int = 0, host: str = "127.0.0.1"):
+        self.path = path
+        self.server: Optional[ThreadingHTTPServer] = None
+        if port:
+            self.server = _serve_metrics(host, port)
+
+    def flush(self) -> None:
+        if not self.path:
+            return
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(render_prometheus())
+        os.replace(tmp, self.path)
+
+    def shutdown(self) -> None:
+        self.flush()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def _serve_metrics(host: str, port: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="llm-metrics-http", daemon=True).start()
+    return server
+
+
+class _ExporterSet:
+    """当前生效的导出器;单个导出器出错不影响请求本身"""
+
+    def __init__(self):
+        self.exporters: List[SpanExporter] = []
+
+    def set(self, exporters: List[SpanExporter]) -> None:
+        self.exporters = exporters
+
+    def on_start(self, span: Span) -> None:
+        for exporter in self.exporters:
+            _safe(exporter.on_start, span)
+
+    def on_end(self, span: Span) -> None:
+        for exporter in self.exporters:
+            _safe(exporter.on_end, span)
+
+    def flush(self) -> None:
+        for exporter in self.exporters:
+            _safe(exporter.flush)
+
+    def shutdown(self) -> None:
+        for exporter in self.exporters:
+            _safe(exporter.shutdown)
+
+
+def _safe(fn: Callable, *args) -> None:
+    try:
+        fn(*args)
+    except Exception as exc:  # noqa: BLE001
+        print(f"指标导出失败: {exc}", file=sys.stderr)
+
+
+_exporters = _ExporterSet()
+
+
+def build_exporters(config: MetricsConfig) -> List[SpanExporter]:
+    """按配置创建导出器: prometheus / json / otel / memory"""
+    exporters: List[SpanExporter] = []
+    for name in config.exporters:
+        if name == "prometheus":
+            exporters.append(PrometheusExporter(config.prometheus_path, config.prometheus_port))
+        elif name == "json":
+            exporters.append(JSONLogExporter(config.json_path))
+        elif name == "otel":
+            exporters.append(OTelExporter())
+        elif name == "memory":
+            exporters.append(InMemorySpanExporter())
+        else:
+            raise ValueError(f"不支持的指标导出器: {name}")
+    return exporters
+
+
+def configure(config: Optional[MetricsConfig] = None, exporters: Optional[List[SpanExporter]] = None) -> List[SpanExporter]:
+    """启用/关闭埋点并替换导出器,返回新的导出器列表
+
+    exporters 为空时按 config(默认 settings.metrics)创建.
+    """
+    global _enabled
+    config = config or settings.metrics
+    _exporters.shutdown()
+    if exporters is None:
+        exporters = build_exporters(config) if config.enabled else []
+    _exporters.set(exporters)
+    _enabled = config.enabled or bool(exporters)
+    return exporters
+
+
+def enable(*exporters: SpanExporter) -> None:
+    """以代码方式启用埋点(可不带导出器,只在进程内聚合指标)"""
+    global _enabled
+    _exporters.shutdown()
+    _exporters.set(list(exporters))
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+    _exporters.shutdown()
+    _exporters.set([])
+
+
+def flush() -> None:
+    """刷新导出器(写出 Prometheus 文件等)"""
+    _exporters.flush()
+
+
+def exporters() -> List[SpanExporter]:
+    return list(_exporters.exporters)
+
+
+if settings.metrics.enabled:
+    configure()
+atexit.register(_exporters.shutdown)
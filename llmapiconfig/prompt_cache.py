@@ -0,0 +1,132 @@
+"""
+提示词前缀缓存
+调用方在消息上标记 "cache": True,表示该消息及之前的内容在多次调用间保持不变.
+客户端按提供商翻译这些提示:
+
+- Claude: 在标记处插入 cache_control 断点(system 与消息都转为内容块,最多4个断点)
+- OpenAI: 自动前缀缓存,另外以静态前缀的哈希作为 prompt_cache_key,让相同前缀落到同一缓存
+- 智谱/通义千问/Gemini: 依赖提供商的隐式前缀缓存,只去掉标记并保证静态内容在前
+
+标记本身不会发送给任何提供商.
+这里同时提供各提供商的消息格式转换(openai_messages、claude_payload、gemini_payload).
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+CACHE_FLAG = "cache"
+
+# Claude 单次请求最多4个缓存断点
+CLAUDE_MAX_BREAKPOINTS = 4
+
+_EPHEMERAL = {"type": "ephemeral"}
+
+
+def cached(role: str, content: str) -> Dict[str, Any]:
+    """构造一条带缓存标记的消息"""
+    return {"role": role, "content": content, CACHE_FLAG: True}
+
+
+def has_hints(messages: List[Dict[str, Any]]) -> bool:
+    for msg in messages:
+        if msg.get(CACHE_FLAG):
+            return True
+    return False
+
+
+def _plain(msg: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in msg.items() if k != CACHE_FLAG}
+
+
+def strip_hints(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """去掉全部缓存标记"""
+    if not has_hints(messages):
+        return messages
+    return [_plain(m) for m in messages]
+
+
+def split_system(messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """把消息分为 (system 消息, 其余消息),保持各自的相对顺序"""
+    system = [m for m in messages if m["role"] == "system"]
+    if not system:
+        return [], messages
+    return system, [m for m in messages if m["role"] != "system"]
+
+
+def openai_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """OpenAI 风格消息:去掉缓存标记,多条 system 按顺序合并为开头的一条"""
+    system, rest = split_system(messages)
+    if len(system) <= 1 and not has_hints(messages):
+        return messages
+    result = [{"role": "system", "content": "\n\n".join(m["content"] for m in system)}] if system else []
+    result.extend(_plain(m) for m in rest)
+    return result
+
+
+def prefix_cache_key(messages: List[Dict[str, Any]]) -> Optional[str]:
+    """最后一个缓存标记之前(含)的消息的哈希;没有标记时返回 None"""
+    last = None
+    for index, msg in enumerate(messages):
+        if msg.get(CACHE_FLAG):
+            last = index
+    if last is None:
+        return None
+    digest = hashlib.sha256()
+    for msg in messages[: last + 1]:
+        digest.update(msg["role"].encode("utf-8"))
+        digest.update(b"\0")
+        content = msg["content"]
+        digest.update((content if isinstance(content, str) else json.dumps(content, sort_keys=True)).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def _blocks(content: Any, cache: bool) -> List[Dict[str, Any]]:
+    if isinstance(content, list):
+        blocks = [dict(block) for block in content]
+    else:
+        blocks = [{"type": "text", "text": content}]
+    if cache and blocks:
+        blocks[-1]["cache_control"] = _EPHEMERAL
+    return blocks
+
+
+def claude_payload(messages: List[Dict[str, Any]]) -> Tuple[Any, List[Dict[str, Any]]]:
+    """转换为 Claude 的 (system, messages)
+
+    没有缓存标记时 system 为合并后的字符串,与原有格式相同;
+    有标记时 system 为内容块列表,在最后 CLAUDE_MAX_BREAKPOINTS 个标记处加 cache_control.
+    """
+    system, rest = split_system(messages)
+    if not has_hints(messages):
+        return "\n\n".join(m["content"] for m in system), rest
+
+    # 超出上限时保留靠后的断点,它们覆盖的前缀更长
+    flagged = [id(m) for m in system + rest if m.get(CACHE_FLAG)]
+    keep = set(flagged[-CLAUDE_MAX_BREAKPOINTS:])
+    system_blocks: List[Dict[str, Any]] = []
+    for msg in system:
+        system_blocks.extend(_blocks(msg["content"], id(msg) in keep))
+    claude_messages = [
+        {"role": m["role"], "content": _blocks(m["content"], True)} if id(m) in keep else _plain(m)
+        for m in rest
+    ]
+    return system_blocks, claude_messages
+
+
+def gemini_content(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """把一条 user/assistant 消息转换为 Gemini 的 content"""
+    return {
+        "role": "model" if msg["role"] == "assistant" else "user",
+        "parts": [{"text": msg["content"]}]
+    }
+
+
+def gemini_payload(messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """转换为 Gemini 的 (systemInstruction parts, contents);多条 system 按顺序保留"""
+    system, rest = split_system(messages)
+    return (
+        [{"text": m["content"]} for m in system],
+        [gemini_content(m) for m in rest if m["role"] in ("user", "assistant")],
+    )
@@ -0,0 +1,339 @@
+"""
+提供商适配器
+每种线路格式由一个 ProviderAdapter 声明:请求体构造、非流式/流式文本提取和用量解析.
+请求头和URL只取决于 LLMConfig,按配置预先计算一次(Endpoint),每次调用只构造请求体.
+
+内置提供商按名称对应到格式;兼容 OpenAI 接口的本地服务(vLLM、Ollama、LM Studio 等)
+通过环境变量 LLM_CUSTOM_PROVIDERS 或 register_provider() 接入,不需要改动客户端:
+
+    register_provider("local", LLMConfig(api_key="", base_url="http://127.0.0.1:8000/v1", model="qwen2.5-7b"))
+    reply = await simple_chat("你好", provider="local")
+
+新的线路格式继承 ProviderAdapter,用 register_format() 注册后即可在 api_format 中使用.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from .prompt_cache import claude_payload, gemini_payload, openai_messages, prefix_cache_key
+from .settings import BUILTIN_PROVIDERS, LLMConfig, settings
+from .usage import Usage, extract_usage
+
+# OpenAI 风格的 JSON 模式(OpenAI、智谱、通义千问)
+JSON_OBJECT = {"type": "json_object"}
+
+# Claude 没有原生 JSON 模式,以此预填充回复
+JSON_PREFILL = "{"
+
+
+def _prepared(messages: List[Dict[str, Any]], fmt: str) -> Any:
+    """ChatSession 的消息列表自带按格式(openai/claude/gemini)缓存的转换结果;普通列表返回 None"""
+    prepared = getattr(messages, "prepared", None)
+    return prepared(fmt) if prepared is not None else None
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    """按配置预先计算的请求地址和请求头(请求头字典在调用之间共享,不要修改)"""
+    url: str
+    headers: Dict[str, str]
+    stream_url: str
+    stream_headers: Dict[str, str]
+
+
+class ProviderAdapter:
+    """一种线路格式的适配器
+
+    子类实现 make_endpoint / build_request / extract_text / extract_delta;
+    用量默认由 usage.extract_usage 解析,它已兼容各内置格式.
+    """
+
+    def __init__(self):
+        self._endpoints: Dict[Tuple[str, str, str], Endpoint] = {}
+
+    def endpoint(self, config: LLMConfig) -> Endpoint:
+        """取配置对应的 Endpoint,同一组 (base_url, api_key, model) 只计算一次"""
+        key = (config.base_url, config.api_key, config.model)
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            endpoint = self._endpoints[key] = self.make_endpoint(config)
+        return endpoint
+
+    def make_endpoint(self, config: LLMConfig) -> Endpoint:
+        raise NotImplementedError
+
+    def build_request(
+        self, config: LLMConfig, messages: List[Dict[str, Any]], stream: bool, options: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """构造请求体;options 是 chat_completion 的其余参数(max_tokens、json_mode 等)"""
+        raise NotImplementedError
+
+    def finish(self, response: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+        """非流式响应返回给调用方之前的修正"""
+        return response
+
+    def extract_text(self, response: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    def extract_delta(self, chunk: Dict[str, Any]) -> Optional[str]:
+        """从流式数据块中提取增量文本,无文本时返回 None"""
+        raise NotImplementedError
+
+    extract_usage = staticmethod(extract_usage)
+
+
+class OpenAIAdapter(ProviderAdapter):
+    """OpenAI Chat Completions 格式
+
+    prompt_cache_key: 带缓存标记时以静态前缀的哈希作为 prompt_cache_key(可由调用方覆盖),
+    使相同前缀的请求路由到同一缓存;stream_usage: 流式请求让最后一个数据块带上 token 用量.
+    兼容接口的服务(智谱、本地服务)未必支持这两个参数,默认不发送.
+    """
+
+    def __init__(self, prompt_cache_key: bool = False, stream_usage: bool = False):
+        super().__init__()
+        self.prompt_cache_key = prompt_cache_key
+        self.stream_usage = stream_usage
+
+    def make_endpoint(self, config: LLMConfig) -> Endpoint:
+        headers = {"Content-Type": "application/json"}
+        if config.api_key:
+            headers["Authorization"] = f"Bearer {config.api_key}"
+        url = f"{config.base_url}/chat/completions"
+        return Endpoint(url, headers, url, headers)
+
+    def build_request(self, config, messages, stream, options):
+        data = {
+            "model": config.model,
+            "messages": _prepared(messages, "openai") or openai_messages(messages),
+            "max_tokens": options.get("max_tokens", config.max_tokens),
+            "temperature": options.get("temperature", config.temperature),
+            "stream": stream
+        }
+        if self.prompt_cache_key:
+            cache_key = options.get("prompt_cache_key") or prefix_cache_key(messages)
+            if cache_key:
+                data["prompt_cache_key"] = cache_key
+        if options.get("json_mode"):
+            data["response_format"] = JSON_OBJECT
+        if stream and self.stream_usage:
+            data["stream_options"] = {"include_usage": True}
+        return data
+
+    def extract_text(self, response):
+        return response["choices"][0]["message"]["content"]
+
+    def extract_delta(self, chunk):
+        try:
+            choices = chunk.get("choices")
+            if not choices:
+                return None
+            return choices[0].get("delta", {}).get("content")
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return None
+
+
+class ClaudeAdapter(ProviderAdapter):
+    """Anthropic Messages 格式;缓存标记转为 cache_control 断点
+
+    json_mode 时(非流式)以 "{" 预填充回复,finish() 再把它拼回文本开头.
+    """
+
+    def make_endpoint(self, config):
+        headers = {
+            "x-api-key": config.api_key,
+            "Content-Type": "application/json",
+            "anthropic-version": "2023-06-01"
+        }
+        url = f"{config.base_url}/v1/messages"
+        return Endpoint(url, headers, url, headers)
+
+    def build_request(self, config, messages, stream, options):
+        system_message, claude_messages = _prepared(messages, "claude") or claude_payload(messages)
+        if options.get("json_mode") and not stream:
+            claude_messages = claude_messages + [{"role": "assistant", "content": JSON_PREFILL}]
+        data = {
+            "model": config.model,
+            "max_tokens": options.get("max_tokens", config.max_tokens),
+            "temperature": options.get("temperature", config.temperature),
+            "messages": claude_messages,
+            "stream": stream
+        }
+        if system_message:
+            data["system"] = system_message
+        return data
+
+    def finish(self, response, options):
+        if options.get("json_mode") and response.get("content"):
+            response["content"][0]["text"] = JSON_PREFILL + response["content"][0].get("text", "")
+        return response
+
+    def extract_text(self, response):
+        return response["content"][0]["text"]
+
+    def extract_delta(self, chunk):
+        try:
+            if chunk.get("type") == "content_block_delta":
+                return chunk["delta"].get("text")
+        except (KeyError, TypeError, AttributeError):
+            pass
+        return None
+
+
+class DashScopeAdapter(ProviderAdapter):
+    """通义千问 DashScope 格式;流式需要显式开启SSE,并只返回增量内容"""
+
+    def make_endpoint(self, config):
+        headers = {
+            "Authorization": f"Bearer {config.api_key}",
+            "Content-Type": "application/json"
+        }
+        url = f"{config.base_url}/chat/completions"
+        return Endpoint(url, headers, url, {**headers, "X-DashScope-SSE": "enable"})
+
+    def build_request(self, config, messages, stream, options):
+        parameters = {
+            "max_tokens": options.get("max_tokens", config.max_tokens),
+            "temperature": options.get("temperature", config.temperature),
+            "stream": stream
+        }
+        if options.get("json_mode"):
+            parameters["response_format"] = JSON_OBJECT
+        if stream:
+            parameters["incremental_output"] = True
+        return {
+            "model": config.model,
+            "input": {
+                "messages": _prepared(messages, "openai") or openai_messages(messages)
+            },
+            "parameters": parameters
+        }
+
+    def extract_text(self, response):
+        return response["output"]["choices"][0]["message"]["content"]
+
+    def extract_delta(self, chunk):
+        try:
+            output = chunk.get("output", {})
+            if "choices" in output:
+                return output["choices"][0]["message"].get("content")
+            return output.get("text")
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return None
+
+
+class GeminiAdapter(ProviderAdapter):
+    """Gemini generateContent 格式;系统指令放在 systemInstruction 中作为隐式缓存的前缀"""
+
+    def make_endpoint(self, config):
+        headers = {"Content-Type": "application/json"}
+        prefix = f"{config.base_url}/models/{config.model}"
+        return Endpoint(
+            f"{prefix}:generateContent?key={config.api_key}",
+            headers,
+            f"{prefix}:streamGenerateContent?key={config.api_key}",
+            headers,
+        )
+
+    def build_request(self, config, messages, stream, options):
+        system_parts, gemini_contents = _prepared(messages, "gemini") or gemini_payload(messages)
+        data = {
+            "contents": gemini_contents,
+            "generationConfig": {
+                "maxOutputTokens": options.get("max_tokens", config.max_tokens),
+                "temperature": options.get("temperature", config.temperature),
+            }
+        }
+        if options.get("json_mode"):
+            data["generationConfig"]["responseMimeType"] = "application/json"
+        if system_parts:
+            # 多条系统指令按顺序保留
+            data["systemInstruction"] = {
+                "parts": system_parts
+            }
+        return data
+
+    def extract_text(self, response):
+        return response["candidates"][0]["content"]["parts"][0]["text"]
+
+    def extract_delta(self, chunk):
+        try:
+            parts = chunk["candidates"][0]["content"]["parts"]
+            return "".join(part.get("text", "") for part in parts) or None
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return None
+
+
+# 线路格式 -> 适配器;自定义提供商的 api_format 取这里的键
+FORMATS: Dict[str, ProviderAdapter] = {
+    "openai": OpenAIAdapter(prompt_cache_key=True, stream_usage=True),
+    "openai_compatible": OpenAIAdapter(),
+    "claude": ClaudeAdapter(),
+    "dashscope": DashScopeAdapter(),
+    "gemini": GeminiAdapter(),
+}
+
+# 提供商 -> 适配器;自定义提供商在第一次使用时按 api_format 加入
+_adapters: Dict[str, ProviderAdapter] = {
+    "openai": FORMATS["openai"],
+    "claude": FORMATS["claude"],
+    "qwen": FORMATS["dashscope"],
+    "zhipu": FORMATS["openai_compatible"],
+    "gemini": FORMATS["gemini"],
+}
+
+
+def register_format(name: str, adapter: ProviderAdapter) -> None:
+    """注册一种线路格式,供自定义提供商的 api_format 使用"""
+    FORMATS[name] = adapter
+
+
+def register_provider(
+    name: str,
+    config: LLMConfig,
+    adapter: Optional[ProviderAdapter] = None
+) -> None:
+    """在运行时接入一个提供商
+
+    adapter 为空时按 config.api_format 选择(默认 openai_compatible).
+    加入路由需要同时把名称写进 LLM_ROUTING_PROVIDERS.
+    """
+    if name in BUILTIN_PROVIDERS:
+        raise ValueError(f"不能覆盖内置提供商: {name}")
+    if adapter is None:
+        adapter = _format_adapter(name, config)
+    settings.custom_providers[name] = config
+    _adapters[name] = adapter
+
+
+def _format_adapter(name: str, config: LLMConfig) -> ProviderAdapter:
+    api_format = config.api_format or "openai_compatible"
+    if api_format not in FORMATS:
+        raise ValueError(f"提供商 {name} 的线路格式不受支持: {api_format}")
+    return FORMATS[api_format]
+
+
+def get_adapter(provider: str) -> ProviderAdapter:
+    """提供商对应的适配器"""
+    adapter = _adapters.get(provider)
+    if adapter is None:
+        config = settings.custom_providers.get(provider)
+        if config is None:
+            raise ValueError(f"不支持的提供商: {provider}")
+        adapter = _adapters[provider] = _format_adapter(provider, config)
+    return adapter
+
+
+def extract_text(provider: str, response: Dict[str, Any]) -> str:
+    """解析非流式响应中的文本内容"""
+    return get_adapter(provider).extract_text(response)
+
+
+def extract_delta(provider: str, chunk: Dict[str, Any]) -> Optional[str]:
+    """从流式数据块中提取增量文本,无文本时返回 None"""
+    return get_adapter(provider).extract_delta(chunk)
+
+
+def parse_usage(provider: str, response: Any) -> Usage:
+    """解析响应中的 token 用量"""
+    return get_adapter(provider).extract_usage(response)
@@ -0,0 +1,213 @@
+"""
+客户端限流
+按 (提供商, API密钥) 维护请求数/token数令牌桶,超出预算的请求按优先级排队
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .settings import LLMConfig
+
+# 优先级:数值越小越先执行,同优先级先到先得
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BATCH = 10
+
+
+class TokenBucket:
+    """每分钟补充 rate_per_minute 个令牌的令牌桶,容量为一分钟的预算"""
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, cost: float, now: float) -> float:
+        """距离可以支付 cost 还需等待的秒数"""
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < cost:
+            wait = max(wait, (cost - self.tokens) / self.rate)
+        return wait
+
+    def consume(self, cost: float) -> None:
+        self.tokens -= min(cost, self.capacity)
+
+    def pause(self, seconds: float, now: float) -> None:
+        """收到429后清空令牌并暂停一段时间"""
+        self._refill(now)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class ProviderScheduler:
+    """单个 (提供商, API密钥) 的限流调度器
+
+    等待者放在按 (优先级, 到达顺序) 排序的堆中,只有堆顶能取得令牌,
+    因此低优先级任务不会插队,同优先级严格先到先得.
+    调度器可以被多个事件循环(线程)共享,唤醒通过 call_soon_threadsafe 投递.
+    """
+
+    def __init__(self, name: str, rpm_limit: int = 0, tpm_limit: int = 0):
+        self.name = name
+        self.requests = TokenBucket(rpm_limit) if rpm_limit > 0 else None
+        self.tokens = TokenBucket(tpm_limit) if tpm_limit > 0 else None
+        self._lock = threading.Lock()
+        self._waiters: List[Tuple[int, int, asyncio.AbstractEventLoop, asyncio.Future, int]] = []
+        self._seq = itertools.count()
+        self._timer_at = 0.0
+        self._timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {"granted": 0, "waited": 0, "total_wait": 0.0, "max_wait": 0.0, "throttled": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    async def acquire(self, cost: int = 0, priority: int = PRIORITY_DEFAULT) -> float:
+        """等待直到预算允许发送请求,返回排队时间(秒)"""
+        if not self.enabled:
+            return 0.0
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        start = time.monotonic()
+        with self._lock:
+            heapq.heappush(self._waiters, (priority, next(self._seq), loop, future, cost))
+        self._pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 让后面的等待者有机会继续
+            self._pump()
+            raise
+        waited = time.monotonic() - start
+        with self._lock:
+            self._stats["granted"] += 1
+            self._stats["total_wait"] += waited
+            if waited > 0.001:
+                self._stats["waited"] += 1
+            self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+        return waited
+
+    def _pump(self) -> None:
+        """按顺序放行预算足够的堆顶等待者,否则在预计可用时重新检查"""
+        with self._lock:
+            now = time.monotonic()
+            while self._waiters:
+                priority, seq, loop, future, cost = self._waiters[0]
+                if future.done():
+                    heapq.heappop(self._waiters)
+                    continue
+                wait = self._delay(cost, now)
+                if wait > 0:
+                    self._arm(loop, now + wait)
+                    return
+                heapq.heappop(self._waiters)
+                if self.requests is not None:
+                    self.requests.consume(1)
+                if self.tokens is not None:
+                    self.tokens.consume(cost)
+                loop.call_soon_threadsafe(_resolve, future)
+
+    def _delay(self, cost: int, now: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = self.requests.delay(1, now)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.delay(cost, now))
+        return wait
+
+    def _arm(self, loop: asyncio.AbstractEventLoop, when: float) -> None:
+        # 同一事件循环上已有更早的定时检查时不重复设置;
+        # 别的循环上的定时检查可能随该循环关闭而永远不会触发,不能依赖
+        if self._timer_loop is loop and self._timer_at and self._timer_at <= when and self._timer_at > time.monotonic():
+            return
+        self._timer_at = when
+        self._timer_loop = loop
+        delay = max(0.0, when - time.monotonic())
+        try:
+            loop.call_soon_threadsafe(loop.call_later, delay, self._pump)
+        except RuntimeError:
+            # 事件循环已关闭,由下一次 acquire 继续驱动
+            self._timer_at = 0.0
+            self._timer_loop = None
+
+    def penalize(self, retry_after: Optional[float] = None) -> None:
+        """提供商返回429时调用,暂停发放令牌"""
+        seconds = retry_after if retry_after is not None else 1.0
+        now = time.monotonic()
+        with self._lock:
+            self._stats["throttled"] += 1
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.pause(seconds, now)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回队列深度与等待时间统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queue_depth"] = sum(1 for waiter in self._waiters if not waiter[3].done())
+        stats["avg_wait"] = stats["total_wait"] / stats["granted"] if stats["granted"] else 0.0
+        return stats
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头,支持秒数和HTTP日期两种格式"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+_schedulers: Dict[Tuple[str, str], ProviderScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(provider: str, config: LLMConfig) -> ProviderScheduler:
+    """获取 (提供商, API密钥) 对应的调度器,预算取自配置中的 rpm_limit/tpm_limit"""
+    key_id = hashlib.sha256(config.api_key.encode("utf-8")).hexdigest()[:16]
+    key = (provider, key_id)
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = ProviderScheduler(provider, config.rpm_limit, config.tpm_limit)
+        return scheduler
+
+
+def scheduler_stats() -> Dict[str, Dict[str, Any]]:
+    """所有已启用限流的调度器统计,键为 "提供商:密钥指纹" """
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    return {
+        f"{provider}:{key_id}": scheduler.stats()
+        for (provider, key_id), scheduler in schedulers.items()
+        if scheduler.enabled
+    }
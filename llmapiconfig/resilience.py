@@ -0,0 +1,247 @@
+"""
+请求容错
+重试(指数退避 + 抖动 + Retry-After)、重试预算、截止时间传递与对冲请求
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterator, Optional, TypeVar, Union
+
+import httpx
+
+from . import metrics
+from .rate_limit import parse_retry_after
+from .settings import settings, RetryConfig
+
+T = TypeVar("T")
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+
+
+class DeadlineExceeded(TimeoutError):
+    """整体截止时间已过"""
+
+
+class Deadline:
+    """以 time.monotonic() 为基准的绝对截止时间,可跨线程传递"""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.3f}s)"
+
+
+_current_deadline: "contextvars.ContextVar[Optional[Deadline]]" = contextvars.ContextVar(
+    "llm_deadline", default=None
+)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """当前上下文中生效的截止时间"""
+    return _current_deadline.get()
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline: Union[Deadline, float, None]) -> Iterator[Optional[Deadline]]:
+    """在作用域内设置截止时间,与外层截止时间取较早者
+
+    同一任务内的所有 LLM 调用(包括重试与多轮对话)共享剩余时间.
+    """
+    if deadline is None:
+        yield current_deadline()
+        return
+    if not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline)
+    outer = current_deadline()
+    if outer is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def attempt_timeout(default: float) -> float:
+    """单次尝试的超时:配置超时与剩余截止时间取较小者"""
+    deadline = current_deadline()
+    if deadline is None:
+        return default
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("请求截止时间已过")
+    return min(default, remaining)
+
+
+class RetryBudget:
+    """重试预算:每个首次请求存入 ratio 个令牌,每次重试花费一个
+
+    避免提供商整体故障时重试把流量放大数倍.
+    """
+
+    def __init__(self, ratio: float, min_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max(min_tokens, 100 * ratio)
+        self.tokens = min_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class LatencyTracker:
+    """记录最近成功请求的耗时,用于计算对冲延迟"""
+
+    def __init__(self, size: int = 200):
+        self._samples: "deque[float]" = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """判断异常是否属于可重试的瞬时故障"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS
+    return isinstance(exc, (httpx.TimeoutException, httpx.TransportError))
+
+
+class Resilience:
+    """单个提供商的重试与对冲策略"""
+
+    def __init__(self, config: Optional[RetryConfig] = None, provider: str = ""):
+        self.config = config or settings.retry
+        self.provider = provider
+        self.budget = RetryBudget(self.config.budget_ratio)
+        self.latency = LatencyTracker()
+        self.stats = {"attempts": 0, "retries": 0, "budget_exhausted": 0, "hedges": 0, "hedge_wins": 0}
+
+    def backoff(self, attempt: int, exc: BaseException) -> float:
+        """第 attempt 次失败后的等待时间:全抖动指数退避,且不短于 Retry-After"""
+        delay = random.uniform(0, min(self.config.max_delay, self.config.base_delay * (2 ** attempt)))
+        if isinstance(exc, httpx.HTTPStatusError):
+            retry_after = parse_retry_after(exc.response.headers.get("retry-after"))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+        return delay
+
+    def retry_delay(self, attempt: int, exc: BaseException) -> Optional[float]:
+        """失败后是否重试;返回等待秒数,不重试时返回 None"""
+        if attempt + 1 >= self.config.max_attempts or not is_retryable(exc):
+            return None
+        delay = self.backoff(attempt, exc)
+        deadline = current_deadline()
+        if deadline is not None and deadline.remaining() <= delay:
+            return None
+        if not self.budget.withdraw():
+            self.stats["budget_exhausted"] += 1
+            metrics.inc("llm_retry_budget_exhausted_total", provider=self.provider)
+            return None
+        self.stats["retries"] += 1
+        metrics.inc("llm_retries_total", provider=self.provider, reason=type(exc).__name__)
+        return delay
+
+    async def call(self, attempt_fn: Callable[[], Awaitable[T]]) -> T:
+        """带重试(和可选对冲)地执行 attempt_fn"""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged(attempt_fn)
+            except Exception as exc:  # noqa: BLE001
+                delay = self.retry_delay(attempt, exc)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _timed(self, attempt_fn: Callable[[], Awaitable[T]]) -> T:
+        self.stats["attempts"] += 1
+        start = time.monotonic()
+        result = await attempt_fn()
+        self.latency.record(time.monotonic() - start)
+        return result
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.config.hedge_enabled or len(self.latency) < self.config.hedge_min_samples:
+            return None
+        delay = self.latency.quantile(self.config.hedge_quantile)
+        return max(delay, self.config.hedge_min_delay) if delay is not None else None
+
+    async def _hedged(self, attempt_fn: Callable[[], Awaitable[T]]) -> T:
+        """首个请求超过历史分位耗时仍未返回时,再发一个副本,取先成功者"""
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._timed(attempt_fn)
+        primary = asyncio.ensure_future(self._timed(attempt_fn))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.stats["hedges"] += 1
+                metrics.inc("llm_hedges_total", provider=self.provider)
+                tasks.add(asyncio.ensure_future(self._timed(attempt_fn)))
+            first_error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    if first_error is None:
+                        first_error = task.exception()
+            raise first_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+_resilience: Dict[str, Resilience] = {}
+_resilience_lock = threading.Lock()
+
+
+def get_resilience(provider: str) -> Resilience:
+    """获取提供商对应的容错策略(进程级共享,重试预算与耗时统计按提供商累计)"""
+    with _resilience_lock:
+        resilience = _resilience.get(provider)
+        if resilience is None:
+            resilience = _resilience[provider] = Resilience(provider=provider)
+        return resilience
@@ -0,0 +1,167 @@
+"""
+提供商路由
+根据实时 EWMA 延迟与错误率在已配置的提供商之间选择,失败时自动切换到下一个
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from .circuit_breaker import get_breaker
+from .resilience import DeadlineExceeded
+from .settings import settings, RouterConfig
+
+T = TypeVar("T")
+
+# 所有内置提供商,按默认偏好排列
+PROVIDERS = ["gemini", "openai", "claude", "qwen", "zhipu"]
+
+
+class ProviderHealth:
+    """单个提供商的健康状况"""
+
+    __slots__ = ("latency", "error_rate", "calls", "failures")
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "calls": self.calls,
+            "failures": self.failures,
+        }
+
+
+class ProviderRouter:
+    """延迟感知的提供商路由
+
+    得分 = EWMA延迟 * (1 + error_penalty * EWMA错误率),得分越低越优先;
+    尚无数据的提供商使用 prior_latency 作为先验(默认0,即每个提供商先被尝试一次),
+    默认提供商在同分时优先.熔断器处于打开状态的提供商排到最后.
+    另以 explore_ratio 的概率把一个随机的健康候选提到最前,让变快的提供商有机会被重新发现.
+    """
+
+    def __init__(self, config: Optional[RouterConfig] = None):
+        self.config = config or settings.router
+        self._health: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, provider: str) -> ProviderHealth:
+        health = self._health.get(provider)
+        if health is None:
+            health = self._health[provider] = ProviderHealth()
+        return health
+
+    def available_providers(self) -> List[str]:
+        """已配置有效密钥的提供商"""
+        providers = self.config.providers or PROVIDERS
+        return [provider for provider in providers if settings.validate_config(provider)]
+
+    def _available(self, provider: str) -> bool:
+        return get_breaker(provider, settings.get_config(provider).base_url).allows_request()
+
+    def _score(self, provider: str, available: Dict[str, bool]) -> Tuple[int, float, int]:
+        health = self._get(provider)
+        unavailable = 0 if available[provider] else 1
+        latency = health.latency if health.latency is not None else self.config.prior_latency
+        score = latency * (1 + self.config.error_penalty * health.error_rate)
+        preferred = 0 if provider == settings.default_provider else 1
+        return unavailable, score, preferred
+
+    def candidates(self) -> List[str]:
+        """按优先顺序返回候选提供商"""
+        providers = self.available_providers()
+        available = {provider: self._available(provider) for provider in providers}
+        with self._lock:
+            ranked = sorted(providers, key=lambda provider: self._score(provider, available))
+        healthy = [provider for provider in ranked[1:] if available[provider]]
+        if healthy and random.random() < self.config.explore_ratio:
+            probe = random.choice(healthy)
+            ranked.remove(probe)
+            ranked.insert(0, probe)
+        return ranked
+
+    def record_success(self, provider: str, latency: float) -> None:
+        alpha = self.config.ewma_alpha
+        with self._lock:
+            health = self._get(provider)
+            health.calls += 1
+            health.latency = latency if health.latency is None else alpha * latency + (1 - alpha) * health.latency
+            health.error_rate *= 1 - alpha
+
+    def record_failure(self, provider: str) -> None:
+        alpha = self.config.ewma_alpha
+        with self._lock:
+            health = self._get(provider)
+            health.calls += 1
+            health.failures += 1
+            health.error_rate = alpha + (1 - alpha) * health.error_rate
+
+    async def call(self, fn: Callable[[str], Awaitable[T]], measure: bool = True) -> Tuple[str, T]:
+        """依次尝试候选提供商,返回 (实际使用的提供商, 结果)
+
+        截止时间已过时不再切换;所有候选都失败时抛出最后一个异常.
+        measure=False 时成功不在这里记录,用于返回流的 fn:由 track_stream 在流结束时记录.
+        """
+        candidates = self.candidates()
+        if not candidates:
+            raise ValueError("没有可用的提供商,请检查API密钥配置")
+        last_error: Optional[Exception] = None
+        for provider in candidates[: self.config.max_failover + 1]:
+            start = time.monotonic()
+            try:
+                result = await fn(provider)
+            except asyncio.CancelledError:
+                raise
+            except DeadlineExceeded:
+                self.record_failure(provider)
+                raise
+            except Exception as exc:  # noqa: BLE001
+                self.record_failure(provider)
+                last_error = exc
+                continue
+            if measure:
+                self.record_success(provider, time.monotonic() - start)
+            return provider, result
+        raise last_error
+
+    async def track_stream(self, provider: str, events: AsyncIterator[T], start: float) -> AsyncGenerator[T, None]:
+        """逐项转发流式响应,读完时以 start 起的总耗时记录成功,中途出错时记录失败
+
+        调用方提前关闭或被取消时不记录.
+        """
+        try:
+            async for event in events:
+                yield event
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # noqa: BLE001
+            self.record_failure(provider)
+            raise
+        finally:
+            aclose = getattr(events, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        self.record_success(provider, time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {provider: health.snapshot() for provider, health in self._health.items()}
+
+
+# 全局路由实例
+router = ProviderRouter()
+
+
+def should_route(provider: Optional[str]) -> bool:
+    """provider="auto",或未指定提供商且启用了 LLM_ROUTING_ENABLED 时走路由"""
+    if provider == "auto":
+        return True
+    return provider is None and settings.router.enabled
@@ -0,0 +1,263 @@
+"""
+多轮会话
+ChatSession 保存一段对话的历史,超出token预算时裁剪(或摘要)较早的轮次,
+并按提供商格式增量缓存转换结果:每条新消息只转换一次,不必每次调用都重新翻译整个历史.
+
+    session = ChatSession("你是一个Shell助手")
+    reply = await session.send("如何查看磁盘占用?")
+    reply = await session.send("只看当前目录呢?")
+"""
+
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional
+
+from .llm_client import chat_stream, chat_with_provider, extract_text
+from .prompt_cache import cached, claude_payload, gemini_content, gemini_payload, openai_messages
+from .settings import settings
+from .tokens import estimate_tokens
+
+# (已有摘要, 被裁剪的消息) -> 新摘要
+Summarizer = Callable[[str, List[Dict[str, str]]], Awaitable[str]]
+
+# 裁剪到预算的这个比例以下,避免之后每一轮都触发裁剪(每次裁剪都会让提示词缓存的前缀失效)
+TRIM_TARGET = 0.75
+
+SUMMARY_PREFIX = "此前对话的摘要:\n"
+
+_SUMMARY_INSTRUCTION = (
+    "你负责压缩对话历史.把已有摘要和新增对话合并为一段简洁的摘要,"
+    "保留用户的目标、已确定的事实和结论,省略寒暄和重复内容.只输出摘要本身."
+)
+
+
+class SessionMessages(list):
+    """ChatSession 某一时刻的消息列表
+
+    内容与普通消息列表相同(用于缓存键、限流估算等);提供商适配器通过 prepared()
+    取按格式缓存的转换结果.会话在此之后被裁剪时 prepared() 返回 None,适配器退回完整转换.
+    """
+
+    __slots__ = ("_session", "_version", "_count")
+
+    def __init__(self, messages: List[Dict[str, Any]], session: "ChatSession", version: int, count: int):
+        super().__init__(messages)
+        self._session = session
+        self._version = version
+        self._count = count
+
+    def prepared(self, fmt: str) -> Any:
+        return self._session._prepared(fmt, self._version, self._count)
+
+
+class ChatSession:
+    """有界的多轮对话历史
+
+    系统提示词(以及裁剪产生的摘要)作为固定前缀,历史只保存 user/assistant 消息.
+    token_budget 默认取 settings.session_token_budget,<=0 表示不限制;超出时从最早的
+    一轮开始整轮丢弃,直到降到预算的 TRIM_TARGET 以下,但至少保留最近 keep_turns 轮
+    (含当前提问).设置 summarizer 时被丢弃的轮次并入摘要,见 llm_summarizer().
+    options 是每次调用都传给 chat 的参数(temperature、priority 等).
+
+    同一会话的 send()/stream() 需依次调用.
+    """
+
+    def __init__(
+        self,
+        system_prompt: Optional[str] = None,
+        provider: Optional[str] = None,
+        token_budget: Optional[int] = None,
+        summarizer: Optional[Summarizer] = None,
+        keep_turns: int = 2,
+        **options
+    ):
+        self.system_prompt = system_prompt
+        self.provider = provider
+        # 走路由时实际提供商不确定,按保守系数估算
+        self._estimate_as = None if provider == "auto" else provider or settings.default_provider
+        self.token_budget = settings.session_token_budget if token_budget is None else token_budget
+        self.summarizer = summarizer
+        self.keep_turns = keep_turns
+        self.options = options
+        self.summary = ""
+        self._turns: List[Dict[str, str]] = []
+        self._tokens: List[int] = []
+        self._history_tokens = 0
+        self._gemini: List[Dict[str, Any]] = []
+        # 历史被裁剪或回退时递增,使之前的 SessionMessages 不再使用缓存的转换结果
+        self._version = 0
+        self._rebuild_head()
+
+    def _rebuild_head(self) -> None:
+        """系统提示词或摘要变化时重新生成固定前缀及其各格式的转换结果"""
+        head = []
+        if self.system_prompt:
+            if settings.prompt_cache:
+                head.append(cached("system", self.system_prompt))
+            else:
+                head.append({"role": "system", "content": self.system_prompt})
+        if self.summary:
+            head.append({"role": "system", "content": SUMMARY_PREFIX + self.summary})
+        self._head = head
+        self._head_tokens = sum(estimate_tokens(m["content"], self._estimate_as) for m in head)
+        self._openai_head = openai_messages(head)
+        self._claude_system, _ = claude_payload(head)
+        self._gemini_system, _ = gemini_payload(head)
+        self._version += 1
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    @property
+    def history(self) -> List[Dict[str, str]]:
+        """当前保留的 user/assistant 消息(副本)"""
+        return list(self._turns)
+
+    @property
+    def token_count(self) -> int:
+        """固定前缀与历史的估算token数"""
+        return self._head_tokens + self._history_tokens
+
+    def add(self, role: str, content: str) -> None:
+        """追加一条消息;不会触发裁剪,裁剪在 compact()/send() 中进行"""
+        if role not in ("user", "assistant"):
+            raise ValueError(f"会话历史只保存 user/assistant 消息,不支持: {role}")
+        tokens = estimate_tokens(content, self._estimate_as)
+        self._turns.append({"role": role, "content": content})
+        self._tokens.append(tokens)
+        self._history_tokens += tokens
+
+    def _pop(self) -> None:
+        """撤回最后一条消息(请求失败时)"""
+        self._history_tokens -= self._tokens.pop()
+        self._turns.pop()
+        del self._gemini[len(self._turns):]
+        self._version += 1
+
+    def clear(self) -> None:
+        """清空历史和摘要,保留系统提示词"""
+        self._turns.clear()
+        self._tokens.clear()
+        self._gemini.clear()
+        self._history_tokens = 0
+        self.summary = ""
+        self._rebuild_head()
+
+    def messages(self) -> SessionMessages:
+        """当前完整的消息列表(固定前缀 + 历史)"""
+        return SessionMessages(self._head + self._turns, self, self._version, len(self._turns))
+
+    def _prepared(self, fmt: str, version: int, count: int) -> Any:
+        """按格式返回缓存的转换结果;只有新追加的消息需要转换"""
+        if version != self._version:
+            return None
+        turns = self._turns if count == len(self._turns) else self._turns[:count]
+        if fmt == "openai":
+            return self._openai_head + turns
+        if fmt == "claude":
+            messages = list(turns)
+            if settings.prompt_cache and count >= 2:
+                # 在上一轮的最后一条消息处加断点,下一次请求可以复用整段历史的缓存
+                last = messages[-2]
+                messages[-2] = {
+                    "role": last["role"],
+                    "content": [{"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}],
+                }
+            return self._claude_system, messages
+        if fmt == "gemini":
+            for msg in self._turns[len(self._gemini):count]:
+                self._gemini.append(gemini_content(msg))
+            return self._gemini_system, self._gemini[:count]
+        return None
+
+    def _over_budget(self) -> bool:
+        return self.token_budget > 0 and self.token_count > self.token_budget
+
+    def _drop_oldest(self) -> List[Dict[str, str]]:
+        """整轮丢弃最早的消息,直到降到预算的 TRIM_TARGET 以下;返回被丢弃的消息"""
+        # 最多丢弃到倒数第 keep_turns 条 user 消息之前
+        floor = len(self._turns) if self.keep_turns <= 0 else 0
+        users = 0
+        for index in range(len(self._turns) - 1, -1, -1):
+            if self._turns[index]["role"] == "user":
+                users += 1
+                if users >= self.keep_turns > 0:
+                    floor = index
+                    break
+
+        target = int(self.token_budget * TRIM_TARGET) - self._head_tokens
+        tokens = self._history_tokens
+        count = 0
+        while count < floor and tokens > target:
+            tokens -= self._tokens[count]
+            count += 1
+        # 不从一轮中间截断,保证历史以 user 消息开头
+        while count < floor and self._turns[count]["role"] != "user":
+            tokens -= self._tokens[count]
+            count += 1
+        if not count:
+            return []
+
+        dropped = self._turns[:count]
+        del self._turns[:count]
+        del self._tokens[:count]
+        del self._gemini[:count]
+        self._history_tokens = tokens
+        self._version += 1
+        return dropped
+
+    async def compact(self) -> List[Dict[str, str]]:
+        """历史超出预算时裁剪较早的轮次,有 summarizer 时并入摘要;返回被裁剪的消息"""
+        if not self._over_budget():
+            return []
+        dropped = self._drop_oldest()
+        if dropped and self.summarizer is not None:
+            try:
+                self.summary = await self.summarizer(self.summary, dropped)
+            except Exception:  # noqa: BLE001
+                # 摘要失败时只裁剪,不影响本次对话
+                return dropped
+            self._rebuild_head()
+        return dropped
+
+    async def send(self, content: str, **kwargs) -> str:
+        """发送一条用户消息并返回回复文本;请求失败时这条消息不会留在历史中"""
+        self.add("user", content)
+        try:
+            await self.compact()
+            provider, response = await chat_with_provider(
+                self.messages(), self.provider, **{**self.options, **kwargs}
+            )
+            reply = extract_text(provider, response)
+        except BaseException:
+            self._pop()
+            raise
+        self.add("assistant", reply)
+        return reply
+
+    async def stream(self, content: str, **kwargs) -> AsyncGenerator[str, None]:
+        """与 send() 相同,但逐段产出回复;完整读完后回复才写入历史"""
+        self.add("user", content)
+        parts: List[str] = []
+        try:
+            await self.compact()
+            async for delta in chat_stream(self.messages(), self.provider, **{**self.options, **kwargs}):
+                parts.append(delta)
+                yield delta
+        except BaseException:
+            self._pop()
+            raise
+        self.add("assistant", "".join(parts))
+
+
+def llm_summarizer(provider: Optional[str] = None, max_tokens: int = 300, **options) -> Summarizer:
+    """用大模型把被裁剪的轮次合并进已有摘要"""
+    async def summarize(summary: str, dropped: List[Dict[str, str]]) -> str:
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in dropped)
+        content = f"已有摘要:\n{summary}\n\n新增对话:\n{transcript}" if summary else f"对话:\n{transcript}"
+        messages = [
+            {"role": "system", "content": _SUMMARY_INSTRUCTION},
+            {"role": "user", "content": content},
+        ]
+        actual, response = await chat_with_provider(messages, provider, max_tokens=max_tokens, **options)
+        return extract_text(actual, response).strip()
+
+    return summarize
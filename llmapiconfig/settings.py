@@ -4,8 +4,8 @@
 """
 
 import os
-from typing import Dict, Any, Optional
-from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+from dataclasses import dataclass, field
 
 # 尝试加载dotenv,如果没有安装则忽略
 try:
@@ -24,6 +24,121 @@ class LLMConfig:
     max_tokens: int = 4000
     temperature: float = 0.7
     timeout: int = 30
+    rpm_limit: int = 0  # 每分钟请求数上限,0表示不限制
+    tpm_limit: int = 0  # 每分钟token数上限,0表示不限制
+    context_window: int = 0  # 上下文窗口(token,含输出),0表示不检查
+    api_format: str = ""  # 线路格式(自定义提供商使用,见 providers.FORMATS),空表示按提供商名称
+
+
+@dataclass
+class PoolConfig:
+    """HTTP连接池配置(所有提供商共享)"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+
+
+@dataclass
+class CacheConfig:
+    """响应缓存配置"""
+    enabled: bool = False
+    path: str = ""
+    ttl: float = 3600.0
+    max_entries: int = 256
+    max_disk_entries: int = 10000
+    cache_sampling: bool = False
+
+
+@dataclass
+class RetryConfig:
+    """重试与对冲请求配置"""
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    budget_ratio: float = 0.2
+    hedge_enabled: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_delay: float = 0.5
+    hedge_min_samples: int = 20
+
+
+@dataclass
+class BreakerConfig:
+    """熔断器配置"""
+    enabled: bool = True
+    failure_threshold: int = 5
+    recovery_timeout: float = 30.0
+    half_open_max_calls: int = 1
+
+
+@dataclass
+class RouterConfig:
+    """提供商路由配置"""
+    enabled: bool = False
+    providers: List[str] = field(default_factory=list)
+    ewma_alpha: float = 0.3
+    error_penalty: float = 4.0
+    prior_latency: float = 0.0
+    explore_ratio: float = 0.05
+    max_failover: int = 2
+
+
+@dataclass
+class CassetteConfig:
+    """录制/回放配置"""
+    mode: str = "off"  # off / record / replay
+    path: str = ""
+    timing: str = "none"  # none / recorded / synthetic
+    synthetic_ttfb: float = 0.0
+    synthetic_chunk_interval: float = 0.0
+
+
+@dataclass
+class MetricsConfig:
+    """埋点与指标导出配置"""
+    enabled: bool = False
+    exporters: List[str] = field(default_factory=list)  # prometheus / json / otel / memory
+    prometheus_path: str = ""
+    prometheus_port: int = 0
+    json_path: str = ""
+
+
+@dataclass
+class LedgerConfig:
+    """用量账本配置;path 为空时不记录"""
+    path: str = ""  # .jsonl 或 .db(SQLite)
+    batch_size: int = 100
+    flush_interval: float = 2.0
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    """读取布尔型环境变量"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# 内置提供商;其他名称需要通过 LLM_CUSTOM_PROVIDERS 或 providers.register_provider() 配置
+BUILTIN_PROVIDERS = ("openai", "claude", "qwen", "zhipu", "gemini")
+
+
+def _custom_provider(name: str) -> LLMConfig:
+    """读取自定义提供商 NAME_BASE_URL / NAME_MODEL 等环境变量"""
+    prefix = name.upper()
+    return LLMConfig(
+        api_key=os.getenv(f"{prefix}_API_KEY", ""),
+        base_url=os.getenv(f"{prefix}_BASE_URL", ""),
+        model=os.getenv(f"{prefix}_MODEL", ""),
+        max_tokens=int(os.getenv(f"{prefix}_MAX_TOKENS", "4000")),
+        temperature=float(os.getenv(f"{prefix}_TEMPERATURE", "0.7")),
+        timeout=int(os.getenv(f"{prefix}_TIMEOUT", "60")),
+        rpm_limit=int(os.getenv(f"{prefix}_RPM", "0")),
+        tpm_limit=int(os.getenv(f"{prefix}_TPM", "0")),
+        context_window=int(os.getenv(f"{prefix}_CONTEXT_WINDOW", "0")),
+        api_format=os.getenv(f"{prefix}_API_FORMAT", "openai_compatible").strip().lower()
+    )
 
 
 class Settings:
@@ -40,7 +155,10 @@ class Settings:
             base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
             model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
             max_tokens=int(os.getenv("OPENAI_MAX_TOKENS", "4000")),
-            temperature=float(os.getenv("OPENAI_TEMPERATURE", "0.7"))
+            temperature=float(os.getenv("OPENAI_TEMPERATURE", "0.7")),
+            rpm_limit=int(os.getenv("OPENAI_RPM", "0")),
+            tpm_limit=int(os.getenv("OPENAI_TPM", "0")),
+            context_window=int(os.getenv("OPENAI_CONTEXT_WINDOW", "16385"))
         )
         
         # Claude配置
@@ -49,7 +167,10 @@ class Settings:
             base_url=os.getenv("CLAUDE_BASE_URL", "https://api.anthropic.com"),
             model=os.getenv("CLAUDE_MODEL", "claude-3-sonnet-20240229"),
             max_tokens=int(os.getenv("CLAUDE_MAX_TOKENS", "4000")),
-            temperature=float(os.getenv("CLAUDE_TEMPERATURE", "0.7"))
+            temperature=float(os.getenv("CLAUDE_TEMPERATURE", "0.7")),
+            rpm_limit=int(os.getenv("CLAUDE_RPM", "0")),
+            tpm_limit=int(os.getenv("CLAUDE_TPM", "0")),
+            context_window=int(os.getenv("CLAUDE_CONTEXT_WINDOW", "200000"))
         )
         
         # 通义千问配置
@@ -58,7 +179,10 @@ class Settings:
             base_url=os.getenv("QWEN_BASE_URL", "https://dashscope.aliyuncs.com/api/v1"),
             model=os.getenv("QWEN_MODEL", "qwen-turbo"),
             max_tokens=int(os.getenv("QWEN_MAX_TOKENS", "4000")),
-            temperature=float(os.getenv("QWEN_TEMPERATURE", "0.7"))
+            temperature=float(os.getenv("QWEN_TEMPERATURE", "0.7")),
+            rpm_limit=int(os.getenv("QWEN_RPM", "0")),
+            tpm_limit=int(os.getenv("QWEN_TPM", "0")),
+            context_window=int(os.getenv("QWEN_CONTEXT_WINDOW", "131072"))
         )
         
         # 智谱AI配置
@@ -67,7 +191,10 @@ class Settings:
             base_url=os.getenv("ZHIPU_BASE_URL", "https://open.bigmodel.cn/api/paas/v4"),
             model=os.getenv("ZHIPU_MODEL", "glm-4"),
             max_tokens=int(os.getenv("ZHIPU_MAX_TOKENS", "4000")),
-            temperature=float(os.getenv("ZHIPU_TEMPERATURE", "0.7"))
+            temperature=float(os.getenv("ZHIPU_TEMPERATURE", "0.7")),
+            rpm_limit=int(os.getenv("ZHIPU_RPM", "0")),
+            tpm_limit=int(os.getenv("ZHIPU_TPM", "0")),
+            context_window=int(os.getenv("ZHIPU_CONTEXT_WINDOW", "128000"))
         )
         
         # Gemini配置
@@ -76,28 +203,120 @@ class Settings:
             base_url=os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta"),
             model=os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
             max_tokens=int(os.getenv("GEMINI_MAX_TOKENS", "4000")),
-            temperature=float(os.getenv("GEMINI_TEMPERATURE", "0.7"))
+            temperature=float(os.getenv("GEMINI_TEMPERATURE", "0.7")),
+            rpm_limit=int(os.getenv("GEMINI_RPM", "0")),
+            tpm_limit=int(os.getenv("GEMINI_TPM", "0")),
+            context_window=int(os.getenv("GEMINI_CONTEXT_WINDOW", "1048576"))
         )
         
+        # 自定义提供商(如兼容 OpenAI 接口的本地服务),逗号分隔的名称
+        self.custom_providers: Dict[str, LLMConfig] = {
+            name: _custom_provider(name)
+            for name in (p.strip() for p in os.getenv("LLM_CUSTOM_PROVIDERS", "").split(","))
+            if name and name not in BUILTIN_PROVIDERS
+        }
+        
         # 默认使用的模型
         self.default_provider = os.getenv("DEFAULT_LLM_PROVIDER", "gemini")
+        
+        # 连接池配置
+        self.pool = PoolConfig(
+            max_connections=int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "30")),
+            http2=_env_bool("LLM_HTTP2")
+        )
+        
+        # 响应缓存配置
+        self.cache = CacheConfig(
+            enabled=_env_bool("LLM_CACHE_ENABLED"),
+            path=os.getenv("LLM_CACHE_PATH", ""),
+            ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "256")),
+            max_disk_entries=int(os.getenv("LLM_CACHE_MAX_DISK_ENTRIES", "10000")),
+            cache_sampling=_env_bool("LLM_CACHE_SAMPLING")
+        )
+        
+        # 重试与对冲请求配置
+        self.retry = RetryConfig(
+            max_attempts=int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3")),
+            base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "20")),
+            budget_ratio=float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2")),
+            hedge_enabled=_env_bool("LLM_HEDGE_ENABLED"),
+            hedge_quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+            hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5")),
+            hedge_min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        )
+        
+        # 熔断器配置
+        self.breaker = BreakerConfig(
+            enabled=_env_bool("LLM_BREAKER_ENABLED", True),
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5")),
+            recovery_timeout=float(os.getenv("LLM_BREAKER_RECOVERY_TIMEOUT", "30")),
+            half_open_max_calls=int(os.getenv("LLM_BREAKER_HALF_OPEN_CALLS", "1"))
+        )
+        
+        # 提供商路由配置
+        self.router = RouterConfig(
+            enabled=_env_bool("LLM_ROUTING_ENABLED"),
+            providers=[p.strip() for p in os.getenv("LLM_ROUTING_PROVIDERS", "").split(",") if p.strip()],
+            ewma_alpha=float(os.getenv("LLM_ROUTING_EWMA_ALPHA", "0.3")),
+            explore_ratio=float(os.getenv("LLM_ROUTING_EXPLORE_RATIO", "0.05")),
+            max_failover=int(os.getenv("LLM_ROUTING_MAX_FAILOVER", "2"))
+        )
+        
+        # 合并并发的相同请求
+        self.coalesce_requests = _env_bool("LLM_COALESCE_REQUESTS", True)
+
+        # 把消息上的缓存标记翻译为提供商的提示词缓存(关闭时只去掉标记)
+        self.prompt_cache = _env_bool("LLM_PROMPT_CACHE", True)
+
+        # ChatSession 历史的默认token预算,超出后裁剪或摘要较早的轮次
+        self.session_token_budget = int(os.getenv("LLM_SESSION_TOKEN_BUDGET", "6000"))
+
+        # 录制/回放配置
+        self.cassette = CassetteConfig(
+            mode=os.getenv("LLM_CASSETTE_MODE", "off").strip().lower(),
+            path=os.getenv("LLM_CASSETTE_PATH", ""),
+            timing=os.getenv("LLM_CASSETTE_TIMING", "none").strip().lower(),
+            synthetic_ttfb=float(os.getenv("LLM_CASSETTE_TTFB", "0")),
+            synthetic_chunk_interval=float(os.getenv("LLM_CASSETTE_CHUNK_INTERVAL", "0"))
+        )
+
+        # 埋点与指标导出配置
+        self.metrics = MetricsConfig(
+            enabled=_env_bool("LLM_METRICS_ENABLED"),
+            exporters=[e.strip().lower() for e in os.getenv("LLM_METRICS_EXPORTERS", "").split(",") if e.strip()],
+            prometheus_path=os.getenv("LLM_METRICS_PROM_PATH", ""),
+            prometheus_port=int(os.getenv("LLM_METRICS_PROM_PORT", "0")),
+            json_path=os.getenv("LLM_METRICS_JSON_PATH", "")
+        )
+
+        # 用量账本配置
+        self.ledger = LedgerConfig(
+            path=os.getenv("LLM_LEDGER_PATH", ""),
+            batch_size=int(os.getenv("LLM_LEDGER_BATCH_SIZE", "100")),
+            flush_interval=float(os.getenv("LLM_LEDGER_FLUSH_INTERVAL", "2"))
+        )
     
     def get_config(self, provider: str = None) -> LLMConfig:
-        """获取指定提供商的配置"""
+        """获取指定提供商的配置
+        
+        自定义提供商不要求API密钥(本地服务通常不需要).
+        """
         provider = provider or self.default_provider
         
-        config_map = {
-            "openai": self.openai,
-            "claude": self.claude,
-            "qwen": self.qwen,
-            "zhipu": self.zhipu,
-            "gemini": self.gemini
-        }
+        config = self.custom_providers.get(provider)
+        if config is not None:
+            if not config.base_url:
+                raise ValueError(f"未设置 {provider} 的服务地址")
+            return config
         
-        if provider not in config_map:
+        if provider not in BUILTIN_PROVIDERS:
             raise ValueError(f"不支持的提供商: {provider}")
         
-        config = config_map[provider]
+        config = getattr(self, provider)
         if not config.api_key:
             raise ValueError(f"未设置 {provider} 的API密钥")
         
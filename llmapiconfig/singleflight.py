@@ -0,0 +1,71 @@
+"""
+请求合并(single-flight)
+相同请求同时在途时只向上游发送一次,所有等待者共享结果或异常
+"""
+
+import asyncio
+import copy
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """按键合并并发调用
+
+    Future 绑定事件循环,因此在途表按事件循环分开维护.
+    上游调用运行在独立任务中,发起者被取消不会影响其他等待者.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Task]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.stats = {"leaders": 0, "joined": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """执行 fn 或加入已在途的同键调用
+
+        加入者得到结果的深拷贝,避免多个调用方修改同一个对象.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            inflight = self._inflight.get(loop)
+            if inflight is None:
+                inflight = self._inflight[loop] = {}
+            task = inflight.get(key)
+            leader = task is None
+            if leader:
+                task = loop.create_task(fn())
+                inflight[key] = task
+                task.add_done_callback(lambda _t, key=key: self._forget(inflight, key, _t))
+                self.stats["leaders"] += 1
+            else:
+                self.stats["joined"] += 1
+        result = await asyncio.shield(task)
+        return result if leader else copy.deepcopy(result)
+
+    def _forget(self, inflight: Dict[str, asyncio.Task], key: str, task: asyncio.Task) -> None:
+        with self._lock:
+            if inflight.get(key) is task:
+                del inflight[key]
+        # 所有等待者都已取消时,避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def inflight(self) -> int:
+        """当前在途的上游调用数"""
+        with self._lock:
+            return sum(len(tasks) for tasks in self._inflight.values())
+
+
+# 全局实例
+singleflight = SingleFlight()
+
+
+def inflight_stats() -> Dict[str, Any]:
+    """返回合并统计"""
+    return {**singleflight.stats, "inflight": singleflight.inflight()}
@@ -0,0 +1,130 @@
+"""
+流式响应解析
+提供按字节增量解析的 SSE 和 JSON 数组解析器,以及各提供商的增量文本提取
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from .providers import extract_delta
+
+
+class SSEParser:
+    """增量 SSE 解析器
+
+    feed() 接收任意切分的字节块,返回已完整的事件 (event, data).
+    data 为多行 data 字段以换行拼接后的原始字节,交给 json.loads 直接解析,
+    避免先解码成 str 再拆分的额外拷贝.
+    """
+
+    __slots__ = ("_buffer", "_event", "_data")
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._event: Optional[bytes] = None
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[Tuple[Optional[str], bytes]]:
+        buffer = self._buffer
+        buffer += chunk
+        events = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            line_end = end - 1 if end > start and buffer[end - 1] == 0x0D else end
+            if line_end == start:
+                # 空行: 事件结束
+                if self._data:
+                    event = self._event.decode("utf-8") if self._event is not None else None
+                    events.append((event, b"\n".join(self._data)))
+                self._event = None
+                self._data = []
+            else:
+                self._parse_line(bytes(memoryview(buffer)[start:line_end]))
+            start = end + 1
+        if start:
+            del buffer[:start]
+        return events
+
+    def _parse_line(self, line: bytes) -> None:
+        if line[:1] == b":":
+            return  # 注释/心跳
+        field, sep, value = line.partition(b":")
+        if sep and value[:1] == b" ":
+            value = value[1:]
+        if field == b"data":
+            self._data.append(value)
+        elif field == b"event":
+            self._event = value
+
+    def flush(self) -> List[Tuple[Optional[str], bytes]]:
+        """流结束时输出未以空行结尾的最后一个事件"""
+        events = self.feed(b"\n\n") if self._buffer else []
+        if self._data:
+            event = self._event.decode("utf-8") if self._event is not None else None
+            events.append((event, b"\n".join(self._data)))
+            self._event = None
+            self._data = []
+        return events
+
+
+class JSONArrayParser:
+    """增量 JSON 数组解析器
+
+    Gemini 的 streamGenerateContent 在未指定 alt=sse 时返回形如
+    ``[{...},\\r\\n{...}]`` 的流式 JSON 数组.feed() 只扫描新到达的字节,
+    每当一个顶层元素闭合就返回其原始字节.
+    """
+
+    __slots__ = ("_buffer", "_pos", "_depth", "_in_string", "_escape", "_start")
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._start = -1
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        buffer = self._buffer
+        buffer += chunk
+        items = []
+        pos, depth, in_string, escape, start = self._pos, self._depth, self._in_string, self._escape, self._start
+        length = len(buffer)
+        while pos < length:
+            byte = buffer[pos]
+            if in_string:
+                if escape:
+                    escape = False
+                elif byte == 0x5C:  # \
+                    escape = True
+                elif byte == 0x22:  # "
+                    in_string = False
+            elif byte == 0x22:
+                in_string = True
+            elif byte == 0x7B or byte == 0x5B:  # { [
+                if depth == 1 and start < 0:
+                    start = pos
+                depth += 1
+            elif byte == 0x7D or byte == 0x5D:  # } ]
+                depth -= 1
+                if depth == 1 and start >= 0:
+                    items.append(bytes(buffer[start:pos + 1]))
+                    start = -1
+            pos += 1
+        # 丢弃已输出的部分,保留未完成元素
+        cut = start if start >= 0 else pos
+        if cut:
+            del buffer[:cut]
+            pos -= cut
+            if start >= 0:
+                start = 0
+        self._pos, self._depth, self._in_string, self._escape, self._start = pos, depth, in_string, escape, start
+        return items
+
+
+def extract_stream_delta(provider: str, chunk: Dict[str, Any]) -> Optional[str]:
+    """从各提供商的流式数据块中提取增量文本,无文本时返回 None(由 providers 中的适配器实现)"""
+    return extract_delta(provider, chunk)
@@ -0,0 +1,80 @@
+"""
+结构化输出
+模型回复常把 JSON 包在 ```json 代码块里,或在前后附带说明文字,直接 json.loads 会失败.
+extract_json() 依次尝试:整段解析 -> 代码块 -> 从第一个 { 或 [ 开始解码并忽略之后的文字;
+validate_status() 按 "status" 字段检查回复是否符合约定.
+
+调用方可传 json_mode=True 请求提供商的原生 JSON 输出(见 llm_client 中各提供商的实现),
+两者配合使用可以避免因格式问题浪费整轮对话.
+"""
+
+import json
+import re
+from typing import Any, Dict, Optional
+
+# status -> {必需字段: 类型};str 类型的字段还必须非空
+StatusContract = Dict[str, Dict[str, type]]
+
+_FENCE = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\n?(.*?)```", re.DOTALL)
+_decoder = json.JSONDecoder()
+
+# 从文本中间解码时最多尝试的起始位置数,避免在很长的非 JSON 文本上反复解码
+_MAX_STARTS = 20
+
+
+class StructuredOutputError(ValueError):
+    """模型回复无法解析为 JSON,或不符合约定的格式"""
+
+
+def _decode_from(text: str) -> Optional[Any]:
+    """从第一个能解码的 { 或 [ 开始解析,忽略之后的内容"""
+    position = 0
+    for _ in range(_MAX_STARTS):
+        starts = [index for index in (text.find("{", position), text.find("[", position)) if index >= 0]
+        if not starts:
+            return None
+        position = min(starts)
+        try:
+            return _decoder.raw_decode(text, position)[0]
+        except ValueError:
+            position += 1
+    return None
+
+
+def extract_json(text: str) -> Any:
+    """从模型回复中提取 JSON 值,找不到时抛出 StructuredOutputError"""
+    stripped = text.strip()
+    if stripped[:1] in ("{", "["):
+        try:
+            return json.loads(stripped)
+        except ValueError:
+            pass
+    for match in _FENCE.finditer(stripped):
+        try:
+            return json.loads(match.group(1))
+        except ValueError:
+            continue
+    value = _decode_from(stripped)
+    if value is None:
+        preview = stripped if len(stripped) <= 200 else stripped[:200] + "..."
+        raise StructuredOutputError(f"回复中没有可解析的JSON: {preview}")
+    return value
+
+
+def validate_status(data: Any, contract: StatusContract) -> Dict[str, Any]:
+    """检查回复是一个 status 在约定之内、且带有该状态所需字段的 JSON 对象"""
+    if not isinstance(data, dict):
+        raise StructuredOutputError(f"回复不是JSON对象: {type(data).__name__}")
+    status = data.get("status")
+    if status not in contract:
+        raise StructuredOutputError(f"意外的状态: {status}")
+    for name, kind in contract[status].items():
+        value = data.get(name)
+        if not isinstance(value, kind) or (kind is str and not value):
+            raise StructuredOutputError(f"状态 {status} 缺少字段或类型错误: {name}")
+    return data
+
+
+def parse_status_reply(text: str, contract: StatusContract) -> Dict[str, Any]:
+    """extract_json + validate_status"""
+    return validate_status(extract_json(text), contract)
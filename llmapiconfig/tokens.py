@@ -0,0 +1,87 @@
+"""
+本地token估算
+不依赖各家的分词器:按 CJK 字符与其他字符分别计数,再乘以各提供商的经验系数.
+中文在不同分词器中的代价差别很大(通义千问/智谱约0.6 token/字,Claude 超过1 token/字),
+只按字符数除以常数会严重低估或高估.
+
+每次非流式请求返回后,用响应中真实的 prompt_tokens 校准对应提供商的系数(EWMA),
+估算会随使用越来越准.
+"""
+
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# 提供商 -> (其他字符每token的字符数, 每个CJK字符的token数)
+_RATES: Dict[str, Tuple[float, float]] = {
+    "openai": (4.0, 0.8),
+    "claude": (3.5, 1.2),
+    "gemini": (4.0, 0.7),
+    "qwen": (3.8, 0.65),
+    "zhipu": (3.8, 0.65),
+}
+# 未知提供商偏保守(宁可高估)
+_DEFAULT_RATE = (3.5, 1.2)
+
+# 每条消息的角色与分隔符开销
+MESSAGE_OVERHEAD = 4
+
+# 校准:真实值/估算值 的指数滑动平均,限制在该范围内防止异常响应带偏
+_ALPHA = 0.2
+_FACTOR_RANGE = (0.5, 2.0)
+# 太短的提示词主要是固定开销,不用于校准
+_MIN_CALIBRATION_TOKENS = 50
+
+_factors: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def count_cjk(text: str) -> int:
+    """文本中 CJK 字符数的近似值
+
+    CJK 字符(汉字、假名、谚文、全角标点)在 UTF-8 中占3字节,用编码后多出的字节数换算,
+    比逐字符匹配快一个数量级;拉丁扩展等2字节字符按半个计,对估算影响很小.
+    """
+    if text.isascii():
+        return 0
+    return (len(text.encode("utf-8", "surrogatepass")) - len(text)) // 2
+
+
+def _raw_estimate(text: str, provider: Optional[str]) -> float:
+    chars_per_token, cjk_rate = _RATES.get(provider or "", _DEFAULT_RATE)
+    cjk = count_cjk(text)
+    return (len(text) - cjk) / chars_per_token + cjk * cjk_rate
+
+
+def estimate_tokens(text: str, provider: Optional[str] = None) -> int:
+    """估算文本的token数(含该提供商的校准系数)"""
+    if not text:
+        return 0
+    return int(_raw_estimate(text, provider) * _factors.get(provider or "", 1.0)) + 1
+
+
+def estimate_messages(messages: List[Dict[str, Any]], provider: Optional[str] = None) -> int:
+    """估算消息列表作为提示词的token数"""
+    text = "".join(str(message.get("content", "")) for message in messages)
+    return estimate_tokens(text, provider) + MESSAGE_OVERHEAD * len(messages)
+
+
+def calibrate(provider: str, estimated: int, actual: int) -> None:
+    """用一次请求的真实 prompt_tokens 更新提供商的校准系数"""
+    if actual <= 0 or estimated < _MIN_CALIBRATION_TOKENS:
+        return
+    with _lock:
+        current = _factors.get(provider, 1.0)
+        # estimated 已经乘过 current,换算回未校准的比值
+        observed = current * actual / estimated
+        factor = current + _ALPHA * (observed - current)
+        _factors[provider] = min(max(factor, _FACTOR_RANGE[0]), _FACTOR_RANGE[1])
+
+
+def calibration(provider: str) -> float:
+    """提供商当前的校准系数(1.0 表示未校准)"""
+    return _factors.get(provider, 1.0)
+
+
+def reset_calibration() -> None:
+    with _lock:
+        _factors.clear()
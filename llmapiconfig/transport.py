@@ -0,0 +1,100 @@
+"""
+共享HTTP传输层
+按 (事件循环, 提供商, base_url) 复用 httpx.AsyncClient,避免每次请求重新握手
+"""
+
+import asyncio
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from .cassette import wrap_transport
+from .settings import settings, LLMConfig, PoolConfig
+
+# HTTP/2 需要可选依赖 h2,未安装时退回 HTTP/1.1
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class ClientRegistry:
+    """进程级 AsyncClient 注册表
+
+    httpx.AsyncClient 的连接绑定在创建它的事件循环上,
+    因此每个事件循环各自维护一组客户端.
+    """
+
+    def __init__(self, pool: Optional[PoolConfig] = None):
+        self._pool = pool
+        self._lock = threading.Lock()
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str], httpx.AsyncClient]]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    @property
+    def pool(self) -> PoolConfig:
+        return self._pool or settings.pool
+
+    def configure(self, pool: PoolConfig) -> None:
+        """设置连接池参数,只影响之后新建的客户端"""
+        self._pool = pool
+
+    def get_client(self, provider: str, config: LLMConfig) -> httpx.AsyncClient:
+        """获取当前事件循环下指定提供商的共享客户端"""
+        loop = asyncio.get_running_loop()
+        key = (provider, config.base_url)
+        with self._lock:
+            clients = self._clients.get(loop)
+            if clients is None:
+                clients = self._clients[loop] = {}
+                self._prune_closed_loops()
+            client = clients.get(key)
+            if client is None or client.is_closed:
+                client = clients[key] = self._create_client(config)
+            return client
+
+    def _create_client(self, config: LLMConfig) -> httpx.AsyncClient:
+        pool = self.pool
+        limits = httpx.Limits(
+            max_connections=pool.max_connections,
+            max_keepalive_connections=pool.max_keepalive_connections,
+            keepalive_expiry=pool.keepalive_expiry,
+        )
+        transport = httpx.AsyncHTTPTransport(limits=limits, http2=pool.http2 and HTTP2_AVAILABLE)
+        # LLM_CASSETTE_MODE 开启时在真实传输层外套一层录制/回放
+        return httpx.AsyncClient(timeout=config.timeout, transport=wrap_transport(transport))
+
+    def _prune_closed_loops(self) -> None:
+        """丢弃已关闭事件循环上的客户端(无法再在其上执行 aclose)"""
+        for loop in [loop for loop in self._clients.keys() if loop.is_closed()]:
+            del self._clients[loop]
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的所有共享客户端"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.pop(loop, {})
+        for client in clients.values():
+            await client.aclose()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(clients) for clients in self._clients.values())
+
+
+# 全局注册表实例
+registry = ClientRegistry()
+
+
+def get_client(provider: str, config: LLMConfig) -> httpx.AsyncClient:
+    """获取共享的 AsyncClient"""
+    return registry.get_client(provider, config)
+
+
+async def shutdown() -> None:
+    """关闭当前事件循环上的共享连接,应在程序退出前调用"""
+    await registry.aclose()
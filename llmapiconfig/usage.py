@@ -0,0 +1,100 @@
+"""
+用量解析
+把各提供商响应中的 token 用量统一为 Usage:
+OpenAI/智谱的 usage.prompt_tokens、Claude/通义千问的 usage.input_tokens、
+Gemini 的 usageMetadata.promptTokenCount 等.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict
+
+
+@dataclass
+class Usage:
+    """统一的 token 用量;prompt_tokens 包含命中提供商提示词缓存的部分"""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def __bool__(self) -> bool:
+        return bool(self.prompt_tokens or self.completion_tokens)
+
+
+def _int(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _from_usage(usage: Dict[str, Any]) -> Usage:
+    """OpenAI 风格(prompt_tokens)与 Anthropic/DashScope 风格(input_tokens)的 usage 字段"""
+    if "prompt_tokens" in usage or "completion_tokens" in usage:
+        details = usage.get("prompt_tokens_details") or {}
+        return Usage(
+            _int(usage.get("prompt_tokens")),
+            _int(usage.get("completion_tokens")),
+            _int(details.get("cached_tokens") if isinstance(details, dict) else 0),
+        )
+    # Claude 的 input_tokens 不含缓存读取/写入的部分
+    cache_read = _int(usage.get("cache_read_input_tokens"))
+    cache_write = _int(usage.get("cache_creation_input_tokens"))
+    return Usage(
+        _int(usage.get("input_tokens")) + cache_read + cache_write,
+        _int(usage.get("output_tokens")),
+        cache_read,
+    )
+
+
+def extract_usage(response: Any) -> Usage:
+    """从非流式响应(或单个流式数据块)中读取用量,没有用量信息时返回空 Usage"""
+    if not isinstance(response, dict):
+        return Usage()
+    usage = response.get("usage")
+    if usage is None and isinstance(response.get("message"), dict):
+        # Claude 流式的 message_start 事件
+        usage = response["message"].get("usage")
+    if isinstance(usage, dict):
+        return _from_usage(usage)
+    metadata = response.get("usageMetadata")
+    if isinstance(metadata, dict):
+        return Usage(
+            _int(metadata.get("promptTokenCount")),
+            _int(metadata.get("candidatesTokenCount")),
+            _int(metadata.get("cachedContentTokenCount")),
+        )
+    return Usage()
+
+
+class StreamUsage:
+    """累计流式响应中的用量
+
+    各提供商在流中报告用量的方式不同:Claude 在 message_start 给出输入、在 message_delta
+    给出累计输出;Gemini 和通义千问每个数据块都带累计值;OpenAI/智谱只在最后一块给出.
+    这些值都是累计量,逐字段取最大值即可.
+    parse 为提供商适配器的用量解析函数,默认的 extract_usage 只解析带用量字段的数据块.
+    """
+
+    __slots__ = ("usage", "_parse")
+
+    def __init__(self, parse: Callable[[Any], Usage] = None):
+        self.usage = Usage()
+        self._parse = parse or extract_usage
+
+    def feed(self, chunk: Any) -> None:
+        if not isinstance(chunk, dict):
+            return
+        if self._parse is extract_usage and not (
+            "usage" in chunk or "usageMetadata" in chunk or "message" in chunk
+        ):
+            return
+        part = self._parse(chunk)
+        usage = self.usage
+        usage.prompt_tokens = max(usage.prompt_tokens, part.prompt_tokens)
+        usage.completion_tokens = max(usage.completion_tokens, part.completion_tokens)
+        usage.cached_tokens = max(usage.cached_tokens, part.cached_tokens)
+
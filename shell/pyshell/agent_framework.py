@@ -1,8 +1,8 @@
+import asyncio
 import json
 import os
-import subprocess
 import sys
-from typing import Dict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
 
 # Add project root to Python path
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -15,9 +15,52 @@ if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
 from api_client import MultiModelAPIClient
+from command_cache import get_command_cache, is_idempotent
+from command_executor import CommandResult, OutputCallback, get_command_executor
+from llmapiconfig import metrics
+from llmapiconfig.budget import Section, estimate_provider, fit, prompt_limit, truncate
+from llmapiconfig.ledger import ledger_tags
+from llmapiconfig.resilience import Deadline
+from llmapiconfig.structured import StructuredOutputError, extract_json, parse_status_reply
+from param_check import check_params, parse_param_schema
+from prompt_store import AgentRegistry, PromptStore, get_agent_registry
+from tool_index import select_tools
 
 # Global API client instance
-api_client: MultiModelAPIClient | None = None
+api_client: Optional[MultiModelAPIClient] = None
+
+# Number of tools sent in the first round; 0 (the default) always sends the
+# whole main.json. Lexical retrieval misses the right tool for most reworded
+# instructions, so an excerpt relies on the ``no_tool`` reply and a second,
+# full-registry round; see benchmarks/bench_tool_index.py before enabling it.
+TOOL_TOP_K = int(os.getenv("AGENT_TOOL_TOP_K", "0"))
+
+# Docs of this many top candidate tools are prefetched during round one
+PREFETCH_DOCS = int(os.getenv("AGENT_PREFETCH_DOCS", "3"))
+
+# Ask providers for native JSON replies (response_format / responseMimeType / prefill)
+# in the multi-turn rounds, whose contexts spell out the JSON reply contract
+JSON_MODE = os.getenv("AGENT_JSON_MODE", "true").lower() in ("1", "true", "yes", "on")
+
+# Reply contracts of the agent rounds: status -> required fields and their types.
+# Replies are parsed with ``extract_json``, so fenced JSON or JSON followed by
+# prose still counts; anything else fails the round with the contract error.
+SELECT_TOOL_REPLY = {
+    "request_doc": {"tool_name": str, "doc_path": str},
+    "need_params_check": {"tool_name": str, "doc_path": str},
+    "no_tool": {},
+}
+PARAM_CHECK_REPLY = {
+    "params_complete": {},
+    "missing_params": {"missing_params": list},
+}
+COMMAND_REPLY = {
+    "execute_command": {"command": str},
+    "error": {},
+}
+
+# Command stdout/stderr in agent replies is trimmed to about this many tokens; 0 keeps it all
+OUTPUT_TOKENS = int(os.getenv("AGENT_OUTPUT_TOKENS", "4000"))
 
 
 def get_api_client() -> MultiModelAPIClient:
@@ -28,6 +71,23 @@ def get_api_client() -> MultiModelAPIClient:
     return api_client
 
 
+def get_registry() -> AgentRegistry:
+    """Return the shared, in-memory view of ``prompt/`` and ``cli-lib/``."""
+    return get_agent_registry(project_root)
+
+
+def first_round_registry(registry: AgentRegistry, instruction: str) -> Optional[str]:
+    """Return the ``TOOL_TOP_K`` most relevant registry entries as JSON.
+
+    Returns None when the whole ``main.json`` should be sent instead.
+    """
+    try:
+        return select_tools(registry.tool_index(), instruction, TOOL_TOP_K)
+    except ValueError:
+        # main.json is not plain JSON; the LLM still gets the raw text
+        return None
+
+
 def tool_executor(instruction: str) -> str:
     """Main CLI tool executor.
 
@@ -36,137 +96,150 @@ def tool_executor(instruction: str) -> str:
     instruction: str
         User instruction.
     """
-    prompt_path = os.path.join(project_root, "prompt", "CLI工具执行引擎.md")
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        system_prompt_content = f.read()
-
-    result_json = make_llm_api_call(system_prompt=system_prompt_content, user_instruction=instruction)
+    system_prompt_content = get_registry().store.read_text(os.path.join("prompt", "CLI工具执行引擎.md"))
 
-    try:
-        result_data = json.loads(result_json)
-        if result_data.get("status") == "execute_command":
-            command = result_data.get("command")
-            working_dir = result_data.get("working_directory", ".")
-            if command:
-                try:
-                    cmd_parts = command.split()
-                    result = subprocess.run(
-                        cmd_parts,
-                        capture_output=True,
-                        text=True,
-                        cwd=os.path.join(project_root, working_dir),
-                    )
-                    if result.returncode == 0:
-                        return json.dumps(
-                            {
-                                "status": "success",
-                                "log": f"命令执行成功: {command}\n输出:\n{result.stdout}",
-                            },
-                            ensure_ascii=False,
-                            indent=2,
-                        )
-                    return json.dumps(
-                        {
-                            "status": "failure",
-                            "error": f"命令执行失败: {command}\n错误:\n{result.stderr}",
-                        },
-                        ensure_ascii=False,
-                        indent=2,
-                    )
-                except Exception as exc:  # noqa: BLE001
-                    return json.dumps(
-                        {
-                            "status": "failure",
-                            "error": f"执行命令时发生异常: {exc}",
-                        },
-                        ensure_ascii=False,
-                        indent=2,
-                    )
-            return json.dumps({"status": "failure", "error": "未找到要执行的命令"}, ensure_ascii=False, indent=2)
-        return result_json
-    except json.JSONDecodeError:
-        return result_json
+    with ledger_tags(agent="tool_executor", round="single"):
+        result_json = make_llm_api_call(system_prompt=system_prompt_content, user_instruction=instruction)
+    return run_command_reply(result_json)
 
 
-def make_llm_api_call(system_prompt: str, user_instruction: str) -> str:
-    """Invoke real LLM API using MultiModelAPIClient."""
+def _log_api_call(
+    system_prompt: str, user_instruction: str, context: Optional[str] = None, cache_context: bool = True
+) -> None:
     print("\n--- [API CALL] ---")
     print(f"  System Prompt: {system_prompt[:50]}...")
+    if context:
+        print(f"  Context: {len(context)} chars ({'cacheable prefix' if cache_context else 'uncached'})")
     print(f"  User Instruction: {user_instruction}")
     print("--- [LLM is processing...] ---\n")
+
+
+def make_llm_api_call(
+    system_prompt: str,
+    user_instruction: str,
+    deadline: Optional[Deadline] = None,
+    context: Optional[str] = None,
+    json_mode: bool = False,
+    cache_context: bool = True,
+) -> str:
+    """Invoke real LLM API using MultiModelAPIClient.
+
+    ``deadline`` bounds the call (including retries); pass the same deadline
+    to every round of a multi-turn flow so they share one time budget.
+    ``context`` is static material sent after the system prompt as a
+    cacheable prefix (see ``MultiModelAPIClient.submit_api``). ``json_mode``
+    requests a native JSON reply; OpenAI-style APIs reject it unless the
+    prompt itself asks for JSON, so only set it when the context states the
+    reply format. Pass ``cache_context=False`` for a per-instruction context.
+    """
+    _log_api_call(system_prompt, user_instruction, context, cache_context)
     client = get_api_client()
-    result_json = client.call_api(system_prompt, user_instruction)
+    result_json = client.call_api(system_prompt, user_instruction, deadline, context, json_mode, cache_context)
     return result_json
 
 
-def call_agent_multi_turn(agent_name: str, instruction: str) -> str:
-    """Multi-turn agent invocation."""
-    agents_config_path = os.path.join(project_root, "cli-lib", "agents.json")
-    main_json_path = os.path.join(project_root, "cli-lib", "main.json")
-    try:
-        with open(agents_config_path, "r", encoding="utf-8") as f:
-            agents = json.load(f)
-    except FileNotFoundError:
-        return json.dumps({"status": "failure", "error": f"Agent registry not found at {agents_config_path}"})
+async def amake_llm_api_call(
+    system_prompt: str,
+    user_instruction: str,
+    deadline: Optional[Deadline] = None,
+    context: Optional[str] = None,
+    json_mode: bool = False,
+    cache_context: bool = True,
+) -> str:
+    """Async variant of ``make_llm_api_call``."""
+    _log_api_call(system_prompt, user_instruction, context, cache_context)
+    return await get_api_client().acall_api(
+        system_prompt, user_instruction, deadline, context, json_mode, cache_context
+    )
 
-    agent_info: Dict[str, str] | None = agents.get(agent_name)
-    if not agent_info:
-        return json.dumps({"status": "failure", "error": f"Agent '{agent_name}' is not defined in agents.json."})
 
-    system_prompt_path = os.path.join(project_root, os.path.normpath(agent_info["system_prompt_path"]))
-    try:
-        with open(system_prompt_path, "r", encoding="utf-8") as f:
-            system_prompt_content = f.read()
-    except FileNotFoundError:
-        return json.dumps({"status": "failure", "error": f"System prompt for agent '{agent_name}' not found at {system_prompt_path}"})
+# The round prompts are split into a static context (registry / tool doc and
+# the reply format), which is identical for every instruction and therefore
+# forms a cacheable prompt prefix, and the per-instruction turn sent last.
+# The top-k registry excerpt of round one depends on the instruction, so it
+# is sent uncached and only the system prompt forms the prefix.
+
+def instruction_turn(instruction: str) -> str:
+    """The per-instruction part of every round."""
+    return f"用户指令:{instruction}"
 
-    try:
-        with open(main_json_path, "r", encoding="utf-8") as f:
-            main_json_content = f.read()
-    except FileNotFoundError:
-        return json.dumps({"status": "failure", "error": f"main.json not found at {main_json_path}"})
 
-    first_round_instruction = f"""
-    以下是可用工具的注册表内容:
+def first_round_context(registry_content: str, excerpt: bool = False) -> str:
+    """Static tool-selection context for round one.
+
+    ``excerpt`` marks ``registry_content`` as the top-k candidates only, so
+    the model answers ``no_tool`` instead of forcing a poor match.
+    """
+    scope = "以下是与用户指令最相关的部分候选工具(并非完整注册表)" if excerpt else "以下是可用工具的注册表内容"
+    return f"""
+    {scope}:
     ```json
-    {main_json_content}
+    {registry_content}
     ```
 
-    用户指令:{instruction}
-
-    请根据main.json中的工具信息,选择合适的工具并告诉我需要查看哪个工具的详细文档.
+    请根据main.json中的工具信息,为用户指令选择合适的工具并告诉我需要查看哪个工具的详细文档.
     
     **重要:在选择工具后,你需要先快速检查用户指令中是否包含了该工具可能需要的关键参数.**
     
-    请返回JSON格式:
+    请以JSON格式返回,不要输出其他内容:
     - 如果工具选择成功且用户指令看起来完整:{{"status": "request_doc", "tool_name": "工具名", "doc_path": "文档路径"}}
     - 如果选择了工具但怀疑缺少关键参数:{{"status": "need_params_check", "tool_name": "工具名", "doc_path": "文档路径"}}
+    - 如果以上工具都不适合该指令:{{"status": "no_tool"}}
     """
 
-    print("\n--- [第一轮对话] ---")
-    first_result_json = make_llm_api_call(system_prompt=system_prompt_content, user_instruction=first_round_instruction)
 
+def fit_context(
+    name: str,
+    system_prompt: str,
+    user_turn: str,
+    build: Callable[[str], str],
+    content: str,
+    mode: str = "head",
+) -> str:
+    """Render a round context with ``content`` trimmed to the model's window.
+
+    ``build(content)`` renders the context template. The template, the system
+    prompt and the instruction are kept whole; only ``content`` (a registry
+    dump with ``mode="json"``, or a tool doc) is trimmed, and only when the
+    estimated prompt exceeds ``prompt_limit``. What was dropped is printed and
+    recorded on the ``agent.budget`` span.
+    """
+    provider = get_api_client().provider
+    sections = [
+        Section("system", system_prompt, fixed=True),
+        Section("template", build(""), fixed=True),
+        Section("instruction", user_turn, fixed=True),
+        Section(name, content, mode=mode),
+    ]
+    with metrics.span("agent.budget", section=name) as budget_span:
+        texts, report = fit(sections, prompt_limit(provider), estimate_provider(provider))
+        if report:
+            budget_span.set("dropped_tokens", sum(item.dropped_tokens for item in report.trimmed))
+            print(f"警告: {report.describe()}")
+    return build(texts[-1])
+
+
+def selected_a_tool(first_result_json: str) -> bool:
+    """Whether a round-one reply names a tool and its doc.
+
+    False for ``no_tool`` and for replies that break the contract; either
+    way an excerpt-based round one is retried with the full registry.
+    """
     try:
-        first_result = json.loads(first_result_json)
-        if first_result.get("status") == "need_params_check":
-            tool_name = first_result.get("tool_name")
-            doc_path = first_result.get("doc_path")
-            if not tool_name or not doc_path:
-                return json.dumps({"status": "failure", "error": "LLM未正确返回工具名或文档路径"})
-            full_doc_path = os.path.join(project_root, os.path.normpath(doc_path))
-            try:
-                with open(full_doc_path, "r", encoding="utf-8") as f:
-                    doc_content = f.read()
-            except FileNotFoundError:
-                return json.dumps({"status": "failure", "error": f"工具文档未找到: {full_doc_path}"})
-            param_check_instruction = f"""
+        reply = parse_status_reply(first_result_json, SELECT_TOOL_REPLY)
+    except StructuredOutputError:
+        return False
+    return reply["status"] != "no_tool"
+
+
+def param_check_context(tool_name: str, doc_content: str) -> str:
+    """Static required-parameter check context for a tool."""
+    return f"""
             以下是 {tool_name} 工具的详细文档:
             ```markdown
             {doc_content}
             ```
 
-            原始用户指令:{instruction}
-
             请仔细检查用户指令是否包含了工具文档中标记为 "required: yes" 的所有必须参数.
 
             **参数识别规则:**
@@ -175,190 +248,458 @@ def call_agent_multi_turn(agent_name: str, instruction: str) -> str:
             3. 如果用户指令中明确提到了参数名和对应的值,就认为该参数已提供
             4. 特别注意:如果指令中包含类似"参数:-name DivineInsight --datapath 【神躯】"这样的格式,说明参数已经完整提供
 
-            **当前用户指令分析:**
+            **用户指令分析:**
             请逐一检查文档中每个required参数是否在用户指令中有对应的值.
             
-            请返回JSON格式:
+            请以JSON格式返回,不要输出其他内容:
             - 如果所有必须参数都已提供:{{"status": "params_complete"}}
             - 如果缺少必须参数:{{"status": "missing_params", "missing_params": ["参数1", "参数2"], "param_descriptions": {{"参数1": "参数1的描述", "参数2": "参数2的描述"}}}}
             """
 
-            print("\n--- [参数检查] ---")
-            param_check_result_json = make_llm_api_call(system_prompt=system_prompt_content, user_instruction=param_check_instruction)
-            try:
-                param_check_result = json.loads(param_check_result_json)
-                if param_check_result.get("status") == "missing_params":
-                    missing_params = param_check_result.get("missing_params", [])
-                    param_descriptions = param_check_result.get("param_descriptions", {})
-                    return json.dumps(
-                        {
-                            "status": "need_user_input",
-                            "message": f"执行 {tool_name} 工具需要额外的必须参数",
-                            "missing_params": missing_params,
-                            "param_descriptions": param_descriptions,
-                            "tool_name": tool_name,
-                            "original_instruction": instruction,
-                        },
-                        ensure_ascii=False,
-                        indent=2,
-                    )
-                if param_check_result.get("status") != "params_complete":
-                    print(f"警告: 参数检查返回了意外状态: {param_check_result.get('status')}")
-            except json.JSONDecodeError:
-                print("警告: 无法解析参数检查结果,继续正常流程")
-            first_result["status"] = "request_doc"
-
-        if first_result.get("status") == "request_doc":
-            tool_name = first_result.get("tool_name")
-            doc_path = first_result.get("doc_path")
-            if not tool_name or not doc_path:
-                return json.dumps({"status": "failure", "error": "LLM未正确返回工具名或文档路径"})
-            full_doc_path = os.path.join(project_root, os.path.normpath(doc_path))
-            try:
-                with open(full_doc_path, "r", encoding="utf-8") as f:
-                    doc_content = f.read()
-            except FileNotFoundError:
-                return json.dumps({"status": "failure", "error": f"工具文档未找到: {full_doc_path}"})
-            second_round_prompt_path = os.path.join(project_root, "prompt", "CLI命令生成器.md")
-            try:
-                with open(second_round_prompt_path, "r", encoding="utf-8") as f:
-                    second_round_system_prompt = f.read()
-            except FileNotFoundError:
-                second_round_system_prompt = system_prompt_content
-                print("警告: 未找到CLI命令生成器提示词,使用原始提示词")
-            second_round_instruction = f"""
+
+def command_context(tool_name: str, doc_content: str) -> str:
+    """Static command-generation context for round two."""
+    return f"""
             以下是 {tool_name} 工具的详细文档:
             ```markdown
             {doc_content}
             ```
 
-            原始用户指令:{instruction}
-
             请根据工具文档和用户指令,生成具体的执行命令.
+
+            请以JSON格式返回,不要输出其他内容:
+            - 可以生成命令时:{{"status": "execute_command", "command": "完整命令", "working_directory": "执行目录(默认为 .)"}}
+            - 无法生成命令时:{{"status": "error", "error": "原因", "missing_params": ["缺少的参数"]}}
             """
 
-            print("\n--- [第二轮对话] ---")
-            second_result_json = make_llm_api_call(system_prompt=second_round_system_prompt, user_instruction=second_round_instruction)
-            try:
-                second_result = json.loads(second_result_json)
-                if second_result.get("status") == "execute_command":
-                    command = second_result.get("command")
-                    working_dir = second_result.get("working_directory", ".")
-                    if command:
-                        return execute_command(command, working_dir, project_root)
-                    return json.dumps({"status": "failure", "error": "未找到要执行的命令"})
-                if second_result.get("status") == "error":
-                    error_msg = second_result.get("error", "未知错误")
-                    missing_params = second_result.get("missing_params", [])
-                    if missing_params:
-                        return json.dumps(
-                            {
-                                "status": "need_user_input",
-                                "message": f"执行 {tool_name} 工具需要额外的必须参数",
-                                "missing_params": missing_params,
-                                "error_details": error_msg,
-                                "tool_name": tool_name,
-                                "original_instruction": instruction,
-                            },
-                            ensure_ascii=False,
-                            indent=2,
-                        )
-                    return json.dumps({"status": "failure", "error": f"CLI命令生成失败: {error_msg}"})
-                return json.dumps({"status": "failure", "error": f"第二轮对话返回了意外的状态: {second_result.get('status')}"})
-            except json.JSONDecodeError:
-                return json.dumps({"status": "failure", "error": f"无法解析第二轮对话结果: {second_result_json}"})
-        return json.dumps({"status": "failure", "error": f"第一轮对话返回了意外的状态: {first_result.get('status')}"})
-    except json.JSONDecodeError:
-        return json.dumps({"status": "failure", "error": f"无法解析第一轮对话结果: {first_result_json}"})
-
-
-def execute_command(command: str, working_dir: str, project_root: str) -> str:
-    """Helper to execute shell command."""
+
+def missing_params_response(param_check_result_json: str, tool_name: str, instruction: str) -> Optional[str]:
+    """Return the ``need_user_input`` payload if the param check found gaps."""
+    try:
+        param_check_result = parse_status_reply(param_check_result_json, PARAM_CHECK_REPLY)
+    except StructuredOutputError as exc:
+        print(f"警告: 无法解析参数检查结果({exc}),继续正常流程")
+        return None
+    if param_check_result["status"] == "missing_params":
+        return json.dumps(
+            {
+                "status": "need_user_input",
+                "message": f"执行 {tool_name} 工具需要额外的必须参数",
+                "missing_params": param_check_result["missing_params"],
+                "param_descriptions": param_check_result.get("param_descriptions", {}),
+                "tool_name": tool_name,
+                "original_instruction": instruction,
+            },
+            ensure_ascii=False,
+            indent=2,
+        )
+    return None
+
+
+def second_round_command(second_result_json: str, tool_name: str, instruction: str) -> Tuple[Optional[Tuple[str, str]], Optional[str]]:
+    """Interpret a round-two reply.
+
+    Returns ``((command, working_dir), None)`` when there is a command to run,
+    otherwise ``(None, payload)`` with the JSON to hand back to the caller.
+    """
+    try:
+        second_result = parse_status_reply(second_result_json, COMMAND_REPLY)
+    except StructuredOutputError as exc:
+        return None, json.dumps({"status": "failure", "error": f"无法解析第二轮对话结果: {exc}"})
+    if second_result["status"] == "execute_command":
+        return (second_result["command"], second_result.get("working_directory", ".")), None
+    error_msg = second_result.get("error", "未知错误")
+    missing_params = second_result.get("missing_params", [])
+    if missing_params:
+        return None, json.dumps(
+            {
+                "status": "need_user_input",
+                "message": f"执行 {tool_name} 工具需要额外的必须参数",
+                "missing_params": missing_params,
+                "error_details": error_msg,
+                "tool_name": tool_name,
+                "original_instruction": instruction,
+            },
+            ensure_ascii=False,
+            indent=2,
+        )
+    return None, json.dumps({"status": "failure", "error": f"CLI命令生成失败: {error_msg}"})
+
+
+def prefetch_candidate_docs(registry: AgentRegistry, instruction: str, limit: int = PREFETCH_DOCS) -> "List[asyncio.Future]":
+    """Start loading the docs of the likeliest tools into the prompt store.
+
+    Runs in the default executor while round one is in flight, so the doc
+    the model asks for is usually already in memory when it replies. The
+    caller owns the returned futures: await them with ``_join_prefetch``
+    before reading the chosen doc and ``_cancel_prefetch`` them on exit.
+    """
+    if limit <= 0:
+        return []
+    try:
+        index = registry.tool_index()
+    except (FileNotFoundError, ValueError):
+        return []
+    loop = asyncio.get_running_loop()
+    futures = []
+    for name, _ in index.search(instruction, limit):
+        entry = index.entries.get(name)
+        doc_path = entry.get("doc_path") if isinstance(entry, dict) else None
+        if isinstance(doc_path, str) and doc_path:
+            futures.append(loop.run_in_executor(None, _warm, registry.store, doc_path))
+    return futures
+
+
+async def _join_prefetch(futures: "List[asyncio.Future]") -> None:
+    """Wait for the prefetched docs; a failed read only costs the prefetch."""
+    for outcome in await asyncio.gather(*futures, return_exceptions=True):
+        if isinstance(outcome, Exception):
+            print(f"警告: 预读工具文档失败: {outcome}")
+
+
+def _cancel_prefetch(futures: "List[asyncio.Future]") -> None:
+    """Drop prefetches still running when the flow ends early.
+
+    Reads already in a worker thread finish there, but their results are
+    discarded; finished futures have their exceptions retrieved.
+    """
+    for future in futures:
+        if not future.cancel() and not future.cancelled():
+            future.exception()
+
+
+def _warm(store: PromptStore, path: str) -> None:
     try:
-        cmd_parts = command.split()
-        result = subprocess.run(
-            cmd_parts,
-            capture_output=True,
-            text=True,
-            cwd=os.path.join(project_root, working_dir),
+        param_schema(store, path)
+    except OSError:
+        pass
+
+
+def param_schema(store: PromptStore, doc_path: str):
+    """Required-parameter schema of a tool doc, parsed once per doc version."""
+    return store.derived(doc_path, "param_schema", parse_param_schema)
+
+
+def call_agent_multi_turn(agent_name: str, instruction: str, timeout: Optional[float] = None) -> str:
+    """Multi-turn agent invocation.
+
+    Blocking wrapper around ``async_call_agent_multi_turn``, run on the API
+    client's background event loop.
+
+    Parameters
+    ----------
+    agent_name: str
+        Agent key in ``cli-lib/agents.json``.
+    instruction: str
+        User instruction.
+    timeout: float, optional
+        Overall time budget in seconds for all LLM rounds of this instruction.
+    """
+    return get_api_client().run(async_call_agent_multi_turn(agent_name, instruction, timeout))
+
+
+async def async_call_agent_multi_turn(agent_name: str, instruction: str, timeout: Optional[float] = None) -> str:
+    """Pipelined multi-turn agent invocation.
+
+    Compared with a strictly sequential flow:
+
+    * docs of the top candidate tools are prefetched while round one runs;
+    * after a ``need_params_check`` reply, the parameter check and command
+      generation are sent concurrently; the command is discarded (and its
+      request cancelled) if parameters turn out to be missing;
+    * the parameter check is answered locally from the doc's parsed
+      ``required: yes`` schema when that is unambiguous (see ``param_check``),
+      and only falls back to the LLM otherwise.
+    * every round sends its static context (full registry or tool doc plus
+      the reply format) right after the system prompt and the instruction
+      last, marked as a cacheable prefix for providers with prompt caching;
+      the instruction-specific top-k registry excerpt (``AGENT_TOOL_TOP_K``)
+      is sent uncached, and a ``no_tool`` or malformed reply to it is
+      retried once with the full registry.
+
+    With ``LLM_METRICS_ENABLED`` the run is recorded as an ``agent.run`` span
+    whose children cover file reads, prompt building, each LLM round (down to
+    connect/TTFB/body read) and the command.
+
+    Parameters are the same as for ``call_agent_multi_turn``.
+    """
+    with metrics.span("agent.run", agent=agent_name) as run_span, ledger_tags(agent=agent_name):
+        reply = await _multi_turn(agent_name, instruction, timeout)
+        if metrics.enabled():
+            run_span.set("status", _reply_status(reply))
+        return reply
+
+
+async def _multi_turn(agent_name: str, instruction: str, timeout: Optional[float]) -> str:
+    deadline = Deadline(timeout) if timeout else None
+    registry = get_registry()
+    store = registry.store
+    with metrics.span("agent.load_registry"):
+        try:
+            agent_info: Optional[Dict[str, str]] = registry.agent(agent_name)
+        except FileNotFoundError:
+            return json.dumps({"status": "failure", "error": f"Agent registry not found at {registry.agents_path}"})
+
+        if not agent_info:
+            return json.dumps({"status": "failure", "error": f"Agent '{agent_name}' is not defined in agents.json."})
+
+        try:
+            system_prompt_content = registry.system_prompt(agent_info)
+        except FileNotFoundError:
+            system_prompt_path = store.resolve(agent_info["system_prompt_path"])
+            return json.dumps({"status": "failure", "error": f"System prompt for agent '{agent_name}' not found at {system_prompt_path}"})
+
+        try:
+            main_json_content = registry.main_registry_text()
+        except FileNotFoundError:
+            return json.dumps({"status": "failure", "error": f"main.json not found at {registry.main_path}"})
+
+    prefetch = prefetch_candidate_docs(registry, instruction)
+    try:
+        user_turn = instruction_turn(instruction)
+        with metrics.span("agent.prompt", round="select_tool"):
+            selected_registry = first_round_registry(registry, instruction)
+            first_context = fit_context(
+                "registry", system_prompt_content, user_turn,
+                lambda content: first_round_context(content, excerpt=selected_registry is not None),
+                selected_registry or main_json_content, mode="json",
+            )
+        print("\n--- [第一轮对话] ---")
+        first_result_json = await _round(
+            "select_tool",
+            amake_llm_api_call(
+                system_prompt_content, user_turn, deadline, first_context, JSON_MODE,
+                cache_context=selected_registry is None,
+            ),
         )
-        if result.returncode == 0:
-            return json.dumps(
-                {"status": "success", "log": f"命令执行成功: {command}\n输出:\n{result.stdout}"},
-                ensure_ascii=False,
-                indent=2,
+        if selected_registry is not None and not selected_a_tool(first_result_json):
+            print("候选工具中未找到合适的工具,使用完整注册表重试第一轮")
+            first_result_json = await _round(
+                "select_tool_full",
+                amake_llm_api_call(
+                    system_prompt_content,
+                    user_turn,
+                    deadline,
+                    fit_context("registry", system_prompt_content, user_turn, first_round_context, main_json_content, mode="json"),
+                    JSON_MODE,
+                ),
             )
+
+        try:
+            first_result = parse_status_reply(first_result_json, SELECT_TOOL_REPLY)
+        except StructuredOutputError as exc:
+            return json.dumps({"status": "failure", "error": f"无法解析第一轮对话结果: {exc}"})
+        status = first_result["status"]
+        if status == "no_tool":
+            return json.dumps({"status": "failure", "error": "注册表中没有适合该指令的工具"})
+        tool_name = first_result["tool_name"]
+        doc_path = first_result["doc_path"]
+        await _join_prefetch(prefetch)
+        with metrics.span("agent.read_doc", tool=tool_name):
+            try:
+                doc_content = store.read_text(doc_path)
+            except FileNotFoundError:
+                return json.dumps({"status": "failure", "error": f"工具文档未找到: {store.resolve(doc_path)}"})
+
+            try:
+                second_round_system_prompt = store.read_text(os.path.join("prompt", "CLI命令生成器.md"))
+            except FileNotFoundError:
+                second_round_system_prompt = system_prompt_content
+                print("警告: 未找到CLI命令生成器提示词,使用原始提示词")
+
+        llm_param_check = status == "need_params_check"
+        if llm_param_check:
+            with metrics.span("agent.param_check_local", tool=tool_name) as check_span:
+                local_result = check_params(param_schema(store, doc_path), instruction)
+                check_span.set("result", local_result["status"] if local_result is not None else "ambiguous")
+            if local_result is not None:
+                # unambiguous: answer locally and skip the LLM param-check round trip
+                print(f"\n--- [参数检查(本地)] --- {local_result['status']}")
+                missing = missing_params_response(json.dumps(local_result, ensure_ascii=False), tool_name, instruction)
+                if missing is not None:
+                    return missing
+                llm_param_check = False
+
+        print("\n--- [第二轮对话] ---")
+        second_context = fit_context(
+            "tool_doc", second_round_system_prompt, user_turn, lambda doc: command_context(tool_name, doc), doc_content
+        )
+        second_round = asyncio.ensure_future(
+            _round("command", amake_llm_api_call(second_round_system_prompt, user_turn, deadline, second_context, JSON_MODE))
+        )
+        # consume the outcome so an unused, failed command request is not reported
+        second_round.add_done_callback(lambda task: task.cancelled() or task.exception())
+        try:
+            if llm_param_check:
+                print("\n--- [参数检查] ---")
+                param_context = fit_context(
+                    "tool_doc", system_prompt_content, user_turn, lambda doc: param_check_context(tool_name, doc), doc_content
+                )
+                param_check_result_json = await _round(
+                    "param_check",
+                    amake_llm_api_call(system_prompt_content, user_turn, deadline, param_context, JSON_MODE),
+                )
+                missing = missing_params_response(param_check_result_json, tool_name, instruction)
+                if missing is not None:
+                    return missing
+            second_result_json = await second_round
+        finally:
+            second_round.cancel()
+
+        command, payload = second_round_command(second_result_json, tool_name, instruction)
+        if command is None:
+            return payload
+        tool_entry = registry.tool_entry(tool_name)
+        return await aexecute_command(
+            command[0],
+            command[1],
+            project_root,
+            cacheable=is_idempotent(tool_entry),
+            watch=tool_entry.get("cache_watch", ()) if isinstance(tool_entry, dict) else (),
+        )
+    finally:
+        _cancel_prefetch(prefetch)
+
+
+async def _round(name: str, call: Awaitable[str]) -> str:
+    """Await one LLM round inside an ``agent.round`` span, tagged in the usage ledger."""
+    with metrics.span("agent.round", round=name), ledger_tags(round=name):
+        return await call
+
+
+def _reply_status(reply: str) -> str:
+    try:
+        return str(extract_json(reply).get("status"))
+    except (StructuredOutputError, AttributeError):
+        return "unparsable"
+
+
+def _fit_output(text: str) -> str:
+    """Trim command output to ``OUTPUT_TOKENS``, keeping its head and tail."""
+    if OUTPUT_TOKENS <= 0:
+        return text
+    return truncate(text, OUTPUT_TOKENS, estimate_provider(get_api_client().provider), mode="both")
+
+
+def command_result_response(command: str, result: CommandResult) -> str:
+    """Format a finished command as the agent's JSON reply.
+
+    Output longer than ``OUTPUT_TOKENS`` is trimmed in the middle, with a
+    marker giving the number of characters left out.
+    """
+    stdout, stderr = _fit_output(result.stdout), _fit_output(result.stderr)
+    if result.timed_out:
+        return json.dumps(
+            {"status": "failure", "error": f"命令执行超时: {command}\n输出:\n{stdout}\n错误:\n{stderr}"},
+            ensure_ascii=False,
+            indent=2,
+        )
+    if result.returncode == 0:
         return json.dumps(
-            {"status": "failure", "error": f"命令执行失败: {command}\n错误:\n{result.stderr}"},
+            {"status": "success", "log": f"命令执行成功: {command}\n输出:\n{stdout}"},
             ensure_ascii=False,
             indent=2,
         )
-    except Exception as exc:  # noqa: BLE001
-        return json.dumps({"status": "failure", "error": f"执行命令时发生异常: {exc}"}, ensure_ascii=False, indent=2)
+    return json.dumps(
+        {"status": "failure", "error": f"命令执行失败: {command}\n错误:\n{stderr}"},
+        ensure_ascii=False,
+        indent=2,
+    )
+
+
+def execute_command(
+    command: str,
+    working_dir: str,
+    project_root: str,
+    on_output: Optional[OutputCallback] = None,
+    cacheable: bool = False,
+    watch: Sequence[str] = (),
+) -> str:
+    """Helper to execute shell command.
+
+    Runs through the shared ``CommandExecutor`` (bounded concurrency,
+    ``AGENT_COMMAND_TIMEOUT``, capped output); ``on_output`` receives
+    ``(stream, line)`` as the command prints. With ``cacheable`` and
+    ``AGENT_COMMAND_CACHE`` enabled, a recent successful result for the same
+    argv, directory and input files is returned without running it again.
+
+    Blocking wrapper around ``aexecute_command``, run on the API client's
+    background event loop; ``on_output`` is called from that loop's thread.
+    """
+    return get_api_client().run(aexecute_command(command, working_dir, project_root, on_output, cacheable, watch))
+
+
+async def aexecute_command(
+    command: str,
+    working_dir: str,
+    project_root: str,
+    on_output: Optional[OutputCallback] = None,
+    cacheable: bool = False,
+    watch: Sequence[str] = (),
+) -> str:
+    """Async variant of ``execute_command``."""
+    argv, cwd = command.split(), os.path.join(project_root, working_dir)
+    with metrics.span("agent.command", program=argv[0] if argv else "") as command_span:
+        cache, key = _command_cache_lookup(argv, cwd, cacheable, watch)
+        if key is not None:
+            cached = cache.get(key)
+            metrics.inc("agent_command_cache_requests_total", result="miss" if cached is None else "hit")
+            if cached is not None:
+                command_span.set("cached", True)
+                return command_result_response(command, cached)
+        try:
+            result = await get_command_executor().run(argv, cwd=cwd, on_output=on_output)
+        except Exception as exc:  # noqa: BLE001
+            command_span.record_exception(exc)
+            return json.dumps({"status": "failure", "error": f"执行命令时发生异常: {exc}"}, ensure_ascii=False, indent=2)
+        command_span.set("returncode", result.returncode)
+        if key is not None:
+            cache.set(key, result)
+        return command_result_response(command, result)
+
+
+def _command_cache_lookup(argv: List[str], cwd: str, cacheable: bool, watch: Sequence[str]):
+    """Return ``(cache, key)``; ``key`` is None when caching does not apply."""
+    cache = get_command_cache() if cacheable and argv else None
+    if cache is None:
+        return None, None
+    return cache, cache.key(argv, cwd, watch)
+
+
+def run_command_reply(result_json: str) -> str:
+    """Run the command from a single-round ``execute_command`` reply.
+
+    Any other reply (or non-JSON text) is returned unchanged.
+    """
+    try:
+        result_data = extract_json(result_json)
+    except StructuredOutputError:
+        return result_json
+    if not isinstance(result_data, dict) or result_data.get("status") != "execute_command":
+        return result_json
+    command = result_data.get("command")
+    if not command:
+        return json.dumps({"status": "failure", "error": "未找到要执行的命令"}, ensure_ascii=False, indent=2)
+    return execute_command(command, result_data.get("working_directory", "."), project_root)
 
 
 def call_agent(agent_name: str, instruction: str) -> str:
     """Call a specific sub-agent to perform task."""
-    agents_config_path = os.path.join(project_root, "cli-lib", "agents.json")
+    registry = get_registry()
     try:
-        with open(agents_config_path, "r", encoding="utf-8") as f:
-            agents = json.load(f)
+        agent_info = registry.agent(agent_name)
     except FileNotFoundError:
-        return json.dumps({"status": "failure", "error": f"Agent registry not found at {agents_config_path}"})
+        return json.dumps({"status": "failure", "error": f"Agent registry not found at {registry.agents_path}"})
 
-    agent_info = agents.get(agent_name)
     if not agent_info:
         return json.dumps({"status": "failure", "error": f"Agent '{agent_name}' is not defined in agents.json."})
 
-    system_prompt_path = os.path.join(project_root, os.path.normpath(agent_info["system_prompt_path"]))
     try:
-        with open(system_prompt_path, "r", encoding="utf-8") as f:
-            system_prompt_content = f.read()
+        system_prompt_content = registry.system_prompt(agent_info)
     except FileNotFoundError:
+        system_prompt_path = registry.store.resolve(agent_info["system_prompt_path"])
         return json.dumps({"status": "failure", "error": f"System prompt for agent '{agent_name}' not found at {system_prompt_path}"})
 
-    result_json = make_llm_api_call(system_prompt=system_prompt_content, user_instruction=instruction)
-    try:
-        result_data = json.loads(result_json)
-        if result_data.get("status") == "execute_command":
-            command = result_data.get("command")
-            working_dir = result_data.get("working_directory", ".")
-            if command:
-                try:
-                    cmd_parts = command.split()
-                    result = subprocess.run(
-                        cmd_parts,
-                        capture_output=True,
-                        text=True,
-                        cwd=os.path.join(project_root, working_dir),
-                    )
-                    if result.returncode == 0:
-                        return json.dumps(
-                            {
-                                "status": "success",
-                                "log": f"命令执行成功: {command}\n输出:\n{result.stdout}",
-                            },
-                            ensure_ascii=False,
-                            indent=2,
-                        )
-                    return json.dumps(
-                        {
-                            "status": "failure",
-                            "error": f"命令执行失败: {command}\n错误:\n{result.stderr}",
-                        },
-                        ensure_ascii=False,
-                        indent=2,
-                    )
-                except Exception as exc:  # noqa: BLE001
-                    return json.dumps(
-                        {
-                            "status": "failure",
-                            "error": f"执行命令时发生异常: {exc}",
-                        },
-                        ensure_ascii=False,
-                        indent=2,
-                    )
-            return json.dumps({"status": "failure", "error": "未找到要执行的命令"}, ensure_ascii=False, indent=2)
-        return result_json
-    except json.JSONDecodeError:
-        return result_json
+    with ledger_tags(agent=agent_name, round="single"):
+        result_json = make_llm_api_call(system_prompt=system_prompt_content, user_instruction=instruction)
+    return run_command_reply(result_json)
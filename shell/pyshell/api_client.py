@@ -1,24 +1,92 @@
-import asyncio
+import concurrent.futures
 import os
 import sys
-from typing import Optional
+from typing import Any, Awaitable, Optional
 
 # Add project root to path
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from llmapiconfig.llm_client import chat
-from llmapiconfig.settings import settings
+from llmapiconfig.llm_client import chat_with_provider, extract_text
+from llmapiconfig.loop_thread import BackgroundLoop, get_background_loop
+from llmapiconfig.prompt_cache import cached
+from llmapiconfig.rate_limit import PRIORITY_DEFAULT
+from llmapiconfig.resilience import Deadline, deadline_scope
 
 
 class MultiModelAPIClient:
-    """Simple wrapper that delegates chat requests to configured LLM provider."""
+    """Simple wrapper that delegates chat requests to configured LLM provider.
 
-    def __init__(self, provider: Optional[str] = None) -> None:
+    Requests are executed on a long-lived background event loop (shared by
+    default across all clients), so synchronous callers reuse the pooled
+    connections in ``llmapiconfig.transport`` and can run several requests
+    concurrently through ``submit_api``.
+    """
+
+    def __init__(
+        self,
+        provider: Optional[str] = None,
+        loop: Optional[BackgroundLoop] = None,
+        priority: int = PRIORITY_DEFAULT,
+    ) -> None:
         self.provider = provider
+        self.priority = priority
+        self._loop = loop or get_background_loop()
+
+    def submit_api(
+        self,
+        system_prompt: str,
+        user_instruction: str,
+        deadline: Optional[Deadline] = None,
+        context: Optional[str] = None,
+        json_mode: bool = False,
+        cache_context: bool = True,
+    ) -> "concurrent.futures.Future[str]":
+        """Schedule a request and return a future resolving to the text response.
+
+        Parameters
+        ----------
+        system_prompt: str
+            The system level instruction.
+        user_instruction: str
+            The user message.
+        deadline: Deadline, optional
+            Overall deadline shared with other calls of the same task; retries
+            and per-attempt timeouts are clipped to the time remaining.
+        context: str, optional
+            Static material (tool registry, docs, output rules) reused across
+            calls. It is sent right after the system prompt and both are
+            marked as a cacheable prefix, so providers with prompt caching
+            only process ``user_instruction`` afresh.
+        json_mode: bool
+            Ask the provider for a JSON reply (native JSON output where
+            supported, an assistant prefill on Claude). Parse the text with
+            ``llmapiconfig.structured.extract_json``.
+        cache_context: bool
+            Set to False when ``context`` changes from call to call (e.g. an
+            excerpt selected for this instruction). Only the system prompt is
+            then marked cacheable and ``context`` is sent uncached right
+            before ``user_instruction``, so it does not cost a cache write on
+            every call.
+        """
+        return self._loop.submit(
+            self.acall_api(system_prompt, user_instruction, deadline, context, json_mode, cache_context)
+        )
+
+    def run(self, coro: Awaitable[Any]) -> Any:
+        """Run a coroutine on the client's background loop and wait for it."""
+        return self._loop.run(coro)
 
-    def call_api(self, system_prompt: str, user_instruction: str) -> str:
+    def call_api(
+        self,
+        system_prompt: str,
+        user_instruction: str,
+        deadline: Optional[Deadline] = None,
+        context: Optional[str] = None,
+        json_mode: bool = False,
+        cache_context: bool = True,
+    ) -> str:
         """Send messages to the LLM and return the text response.
 
         Parameters
@@ -27,19 +95,42 @@ class MultiModelAPIClient:
             The system level instruction.
         user_instruction: str
             The user message.
+        deadline: Deadline, optional
+            See ``submit_api``.
+        context: str, optional
+            See ``submit_api``.
+        json_mode: bool
+            See ``submit_api``.
+        cache_context: bool
+            See ``submit_api``.
         """
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_instruction},
-        ]
-        response = asyncio.run(chat(messages, provider=self.provider))
-        actual_provider = self.provider or settings.default_provider
-        if actual_provider in ["openai", "zhipu"]:
-            return response["choices"][0]["message"]["content"]
-        if actual_provider == "claude":
-            return response["content"][0]["text"]
-        if actual_provider == "qwen":
-            return response["output"]["choices"][0]["message"]["content"]
-        if actual_provider == "gemini":
-            return response["candidates"][0]["content"]["parts"][0]["text"]
-        raise ValueError(f"不支持的提供商: {actual_provider}")
+        return self.submit_api(system_prompt, user_instruction, deadline, context, json_mode, cache_context).result()
+
+    async def acall_api(
+        self,
+        system_prompt: str,
+        user_instruction: str,
+        deadline: Optional[Deadline] = None,
+        context: Optional[str] = None,
+        json_mode: bool = False,
+        cache_context: bool = True,
+    ) -> str:
+        """Async variant of ``call_api`` for callers already inside an event loop."""
+        if context:
+            messages = [
+                cached("system", system_prompt),
+                cached("system", context) if cache_context else {"role": "system", "content": context},
+                {"role": "user", "content": user_instruction},
+            ]
+        else:
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_instruction},
+            ]
+        # only set when requested, so plain calls keep their response-cache keys
+        options = {"json_mode": True} if json_mode else {}
+        with deadline_scope(deadline):
+            provider, response = await chat_with_provider(
+                messages, provider=self.provider, priority=self.priority, **options
+            )
+        return extract_text(provider, response)
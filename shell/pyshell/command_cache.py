@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Sequence, Tuple
+
+from command_executor import CommandResult
+
+# registry entry keys that mark a tool as safe to memoize
+IDEMPOTENT_KEYS = ("idempotent", "read_only", "cacheable")
+
+_CacheKey = Tuple[Any, ...]
+
+
+def is_idempotent(entry: Any) -> bool:
+    """Whether a ``main.json`` tool entry opts in to result caching."""
+    if not isinstance(entry, dict):
+        return False
+    for key in IDEMPOTENT_KEYS:
+        value = entry.get(key)
+        if isinstance(value, str):
+            value = value.strip().lower() in ("yes", "true", "1", "是")
+        if value:
+            return True
+    return False
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class CommandCache:
+    """LRU + TTL cache of successful command results.
+
+    The key covers argv, the working directory and the mtime/size of every
+    argument that names an existing file or directory (plus any extra
+    ``watch`` paths), so editing an input naturally misses the cache.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 256) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[_CacheKey, Tuple[float, CommandResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+
+    def key(self, argv: Sequence[str], cwd: str, watch: Iterable[str] = ()) -> _CacheKey:
+        cwd = os.path.abspath(cwd)
+        stamps = []
+        for arg in list(argv[1:]) + list(watch):
+            path = arg if os.path.isabs(arg) else os.path.join(cwd, arg)
+            stamp = _stamp(path)
+            if stamp is not None:
+                stamps.append((arg, stamp))
+        return tuple(argv), cwd, tuple(stamps)
+
+    def get(self, key: _CacheKey) -> Optional[CommandResult]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._entries[key]
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return item[1]
+
+    def set(self, key: _CacheKey, result: CommandResult) -> None:
+        """Store ``result`` if the command succeeded."""
+        if not result.ok:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            self.stats["sets"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_cache: Optional[CommandCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_command_cache() -> Optional[CommandCache]:
+    """Return the shared cache, or None unless ``AGENT_COMMAND_CACHE`` is on.
+
+    ``AGENT_COMMAND_CACHE_TTL`` (seconds, default 60) and
+    ``AGENT_COMMAND_CACHE_MAX_ENTRIES`` (default 256) bound it.
+    """
+    global _cache
+    if os.getenv("AGENT_COMMAND_CACHE", "false").lower() not in ("1", "true", "yes", "on"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CommandCache(
+                ttl=float(os.getenv("AGENT_COMMAND_CACHE_TTL", "60")),
+                max_entries=int(os.getenv("AGENT_COMMAND_CACHE_MAX_ENTRIES", "256")),
+            )
+        return _cache
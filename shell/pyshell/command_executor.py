@@ -0,0 +1,295 @@
+import asyncio
+import codecs
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Optional, Sequence, Tuple
+
+# Add project root to path
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from llmapiconfig.loop_thread import get_background_loop
+
+STDOUT = "stdout"
+STDERR = "stderr"
+
+# (stream name, line without trailing newline)
+OutputCallback = Callable[[str, str], None]
+
+# "\r\n", "\n" and a lone "\r" (progress bars redrawing a line) all end a line
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+class RingBuffer:
+    """Keeps the last ``max_lines`` lines and counts what was dropped."""
+
+    def __init__(self, max_lines: int) -> None:
+        self._lines: Deque[str] = deque(maxlen=max_lines if max_lines > 0 else None)
+        self.dropped = 0
+
+    def append(self, line: str) -> None:
+        if self._lines.maxlen is not None and len(self._lines) == self._lines.maxlen:
+            self.dropped += 1
+        self._lines.append(line)
+
+    def text(self) -> str:
+        body = "\n".join(self._lines)
+        if self._lines:
+            body += "\n"
+        if self.dropped:
+            body = f"...(省略前 {self.dropped} 行)\n" + body
+        return body
+
+
+class CommandResult:
+    """Outcome of one command; output holds only the buffered tail."""
+
+    def __init__(
+        self,
+        argv: Sequence[str],
+        returncode: Optional[int],
+        stdout: str,
+        stderr: str,
+        elapsed: float,
+        timed_out: bool = False,
+    ) -> None:
+        self.argv = list(argv)
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out
+
+    def __repr__(self) -> str:
+        return f"CommandResult(argv={self.argv!r}, returncode={self.returncode}, timed_out={self.timed_out})"
+
+
+class CommandExecutor:
+    """Runs CLI tools as asyncio subprocesses.
+
+    * at most ``max_concurrency`` commands run at once (per event loop);
+    * each command is killed after ``timeout`` seconds (``0`` disables);
+    * cancelling the awaiting task kills the process;
+    * output is read incrementally, delivered line by line, and only the
+      last ``max_lines`` lines per stream are kept in memory; lines longer
+      than ``max_line_length`` characters are delivered in pieces, so one
+      unterminated line cannot grow without bound (``0`` disables).
+    """
+
+    def __init__(
+        self, max_concurrency: int = 4, timeout: float = 600.0, max_lines: int = 2000, max_line_length: int = 8192
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_lines = max_lines
+        self.max_line_length = max_line_length
+        self._lock = threading.Lock()
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.stats = {"started": 0, "timed_out": 0, "cancelled": 0}
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+            return semaphore
+
+    async def run(
+        self,
+        argv: Sequence[str],
+        cwd: Optional[str] = None,
+        timeout: Optional[float] = None,
+        on_output: Optional[OutputCallback] = None,
+    ) -> CommandResult:
+        """Run ``argv`` to completion and return its buffered result.
+
+        Raises ``OSError`` (e.g. ``FileNotFoundError``) if the program cannot
+        be started, like ``subprocess.run``.
+        """
+        buffers = {STDOUT: RingBuffer(self.max_lines), STDERR: RingBuffer(self.max_lines)}
+
+        def collect(stream: str, line: str) -> None:
+            buffers[stream].append(line)
+            if on_output is not None:
+                on_output(stream, line)
+
+        start = time.monotonic()
+        returncode, timed_out = await self._execute(argv, cwd, timeout, collect)
+        return CommandResult(
+            argv, returncode, buffers[STDOUT].text(), buffers[STDERR].text(), time.monotonic() - start, timed_out
+        )
+
+    async def stream(
+        self,
+        argv: Sequence[str],
+        cwd: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """Yield ``(stream, line)`` as the command produces output.
+
+        Closing the iterator early kills the command.
+        """
+        queue: "asyncio.Queue[Optional[Tuple[str, str]]]" = asyncio.Queue()
+        task = asyncio.ensure_future(self._execute(argv, cwd, timeout, lambda s, l: queue.put_nowait((s, l))))
+        task.add_done_callback(lambda _t: queue.put_nowait(None))
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield item
+            await task
+        finally:
+            task.cancel()
+
+    async def _execute(
+        self,
+        argv: Sequence[str],
+        cwd: Optional[str],
+        timeout: Optional[float],
+        on_line: OutputCallback,
+    ) -> Tuple[Optional[int], bool]:
+        timeout = self.timeout if timeout is None else timeout
+        async with self._semaphore():
+            process = await asyncio.create_subprocess_exec(
+                *argv,
+                cwd=cwd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=os.name == "posix",
+            )
+            self.stats["started"] += 1
+            finished = asyncio.gather(
+                _pump_lines(process.stdout, STDOUT, on_line, self.max_line_length),
+                _pump_lines(process.stderr, STDERR, on_line, self.max_line_length),
+                process.wait(),
+            )
+            try:
+                await asyncio.wait_for(asyncio.shield(finished), timeout or None)
+                return process.returncode, False
+            except asyncio.TimeoutError:
+                self.stats["timed_out"] += 1
+                await _kill(process)
+                await finished
+                return process.returncode, True
+            except asyncio.CancelledError:
+                self.stats["cancelled"] += 1
+                await _kill(process)
+                finished.cancel()
+                raise
+
+
+async def _pump_lines(
+    reader: asyncio.StreamReader, stream: str, on_line: OutputCallback, max_length: int = 0
+) -> None:
+    """Read in chunks and emit complete lines.
+
+    Lines longer than ``max_length`` characters (``0``: no limit) are emitted
+    in pieces as soon as they are that long, without waiting for the newline.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            break
+        text = pending + decoder.decode(chunk)
+        # a trailing "\r" may be the first half of "\r\n"; decide with the next chunk
+        held = "\r" if text.endswith("\r") else ""
+        *lines, pending = _LINE_BREAK.split(text[:-1] if held else text)
+        for line in lines:
+            _emit(stream, line, on_line, max_length)
+        if 0 < max_length < len(pending):
+            cut = len(pending) - len(pending) % max_length
+            _emit(stream, pending[:cut], on_line, max_length)
+            pending = pending[cut:]
+        pending += held
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        lines = _LINE_BREAK.split(pending)
+        if not lines[-1]:
+            lines.pop()
+        for line in lines:
+            _emit(stream, line, on_line, max_length)
+
+
+def _emit(stream: str, line: str, on_line: OutputCallback, max_length: int) -> None:
+    if 0 < max_length < len(line):
+        for start in range(0, len(line), max_length):
+            on_line(stream, line[start:start + max_length])
+    else:
+        on_line(stream, line)
+
+
+async def _kill(process: asyncio.subprocess.Process, grace: float = 2.0) -> None:
+    """Terminate the process group, escalating to SIGKILL after ``grace``."""
+    if process.returncode is not None:
+        return
+    _signal(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), grace)
+    except asyncio.TimeoutError:
+        _signal(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+        await process.wait()
+
+
+def _signal(process: asyncio.subprocess.Process, sig: int) -> None:
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, sig)
+        else:
+            process.send_signal(sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+_executor: Optional[CommandExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_command_executor() -> CommandExecutor:
+    """Return the shared executor, configured from the environment.
+
+    ``AGENT_COMMAND_CONCURRENCY`` (default 4), ``AGENT_COMMAND_TIMEOUT``
+    seconds (default 600, ``0`` disables), ``AGENT_COMMAND_MAX_LINES``
+    (default 2000 per stream) and ``AGENT_COMMAND_MAX_LINE_LENGTH`` (default
+    8192 characters, longer lines are split).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = CommandExecutor(
+                max_concurrency=int(os.getenv("AGENT_COMMAND_CONCURRENCY", "4")),
+                timeout=float(os.getenv("AGENT_COMMAND_TIMEOUT", "600")),
+                max_lines=int(os.getenv("AGENT_COMMAND_MAX_LINES", "2000")),
+                max_line_length=int(os.getenv("AGENT_COMMAND_MAX_LINE_LENGTH", "8192")),
+            )
+        return _executor
+
+
+def run_command(
+    argv: Sequence[str],
+    cwd: Optional[str] = None,
+    timeout: Optional[float] = None,
+    on_output: Optional[OutputCallback] = None,
+) -> CommandResult:
+    """Blocking wrapper: runs the command on the shared background loop.
+
+    ``on_output`` is called from the background loop's thread.
+    """
+    return get_background_loop().run(get_command_executor().run(argv, cwd, timeout, on_output))
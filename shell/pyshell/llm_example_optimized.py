@@ -13,7 +13,9 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))  # 向上两级到项目根目录
 sys.path.insert(0, project_root)
 
-from llmapiconfig.llm_client import simple_chat, chat
+from llmapiconfig.llm_client import simple_chat, simple_chat_many, chat
+from llmapiconfig.rate_limit import PRIORITY_INTERACTIVE
+from llmapiconfig.session import ChatSession
 from llmapiconfig.settings import settings
 
 
@@ -23,22 +25,29 @@ async def shell_ai_assistant():
     print(f"当前使用的AI模型: {settings.default_provider} - {settings.get_config().model}")
     print("=" * 50)
     
+    # 多轮会话:保留上下文,超出token预算时自动裁剪较早的轮次(交互式请求在限流队列中优先)
+    session = ChatSession("你是一个Shell助手,回答简洁准确.", priority=PRIORITY_INTERACTIVE)
+    
     while True:
         try:
             # 获取用户输入
-            user_input = input("\n💬 请输入你的问题 (输入'quit'退出): ").strip()
+            user_input = input("\n💬 请输入你的问题 (输入'quit'退出, 'clear'清空上下文): ").strip()
             
             if user_input.lower() in ['quit', 'exit', '退出', 'q']:
                 print("👋 再见!")
                 break
             
+            if user_input.lower() in ['clear', '清空']:
+                session.clear()
+                print("🧹 已清空对话上下文")
+                continue
+            
             if not user_input:
                 continue
             
             print("🤔 AI思考中...")
             
-            # 调用AI
-            response = await simple_chat(user_input)
+            response = await session.send(user_input)
             print(f"🤖 AI回复: {response}")
             
         except KeyboardInterrupt:
@@ -91,16 +100,19 @@ async def multi_provider_comparison():
     question = "请用一句话解释什么是机器学习"
     providers = ["gemini", "openai", "claude", "qwen", "zhipu"]
     
+    configured = [provider for provider in providers if settings.validate_config(provider)]
     for provider in providers:
-        try:
-            if settings.validate_config(provider):
-                print(f"\n🤖 {provider.upper()}:")
-                response = await simple_chat(question, provider=provider)
-                print(f"   {response}")
-            else:
-                print(f"\n⚠️  {provider.upper()}: 配置无效,跳过")
-        except Exception as e:
-            print(f"\n❌ {provider.upper()}: 调用失败 - {e}")
+        if provider not in configured:
+            print(f"\n⚠️  {provider.upper()}: 配置无效,跳过")
+    
+    # 并发请求所有提供商,总耗时取决于最慢的一个
+    results = await simple_chat_many(question, providers=configured)
+    for result in results:
+        if result.ok:
+            print(f"\n🤖 {result.provider.upper()} ({result.elapsed:.2f}s):")
+            print(f"   {result.response}")
+        else:
+            print(f"\n❌ {result.provider.upper()}: 调用失败 - {result.error}")
 
 
 def show_menu():
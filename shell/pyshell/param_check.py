@@ -0,0 +1,157 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# "-name" / "--datapath" style flags
+_FLAG = re.compile(r"(?<![\w-])(--?[A-Za-z][\w-]*)")
+# "required: yes", "必填: 是", "required：true" ...
+_REQUIRED = re.compile(r"(?:required|必填|必须|必需)\s*[:：=]\s*(\S+)", re.IGNORECASE)
+_YES = {"yes", "y", "true", "是", "必填", "必须", "√", "✓", "✔"}
+_NO = {"no", "n", "false", "否", "可选", "optional"}
+# a line that introduces a parameter: "### -name", "- `--datapath`: ...", "name: -name", "1. -name",
+# "-name: ..."; a list bullet needs whitespace after it so it cannot eat the flag's dash
+_PARAM_LINE = re.compile(
+    r"^(?:#+|[-*+](?=\s)|\d+[.)])?\s*(?:(?:name|param(?:eter)?|参数名?)\s*[:：]\s*)?[`*\s]*(--?[A-Za-z][\w-]*)[`*]*(.*)$",
+    re.IGNORECASE,
+)
+_DESCRIPTION = re.compile(r"^[-*+]?\s*(?:description|desc|说明|描述)\s*[:：]\s*(.+)$", re.IGNORECASE)
+# a flag followed by its value: 【...】, quoted, or a bare token
+_FLAG_VALUE = re.compile(
+    r"(?<![\w-])(--?[A-Za-z][\w-]*)(?:\s*=\s*|\s+)"
+    r"(【[^】]*】|\"[^\"]*\"|'[^']*'|“[^”]*”|(?!-)[^\s,,;;]+)"
+)
+
+
+def normalize(flag: str) -> str:
+    """``--Data-Path`` and ``-data_path`` both normalize to ``datapath``."""
+    return re.sub(r"[-_]", "", flag).lower()
+
+
+def _is_yes(word: str) -> Optional[bool]:
+    word = word.strip("`*|,.;,。()()").lower()
+    if word in _YES:
+        return True
+    if word in _NO:
+        return False
+    return None
+
+
+class ParamSchema:
+    """Required parameters parsed from a tool doc.
+
+    ``confident`` is False when the doc mentions required parameters in a
+    shape the parser could not attribute to a flag; callers should then
+    defer to the LLM instead of trusting ``required``.
+    """
+
+    def __init__(self, required: Dict[str, Tuple[str, str]], confident: bool) -> None:
+        # normalized name -> (flag as written in the doc, description)
+        self.required = required
+        self.confident = confident
+
+    def __repr__(self) -> str:
+        return f"ParamSchema(required={[flag for flag, _ in self.required.values()]}, confident={self.confident})"
+
+
+def _parse_table(lines: List[str]) -> Optional[Dict[str, Tuple[str, str]]]:
+    """Parse a markdown table with a parameter column and a required column."""
+    header = [cell.strip().lower() for cell in lines[0].strip().strip("|").split("|")]
+    required_col = next((i for i, cell in enumerate(header) if re.search(r"required|必填|必须|必需", cell)), None)
+    if required_col is None:
+        return None
+    desc_col = next((i for i, cell in enumerate(header) if re.search(r"desc|说明|描述|含义", cell)), None)
+    result: Dict[str, Tuple[str, str]] = {}
+    for line in lines[2:]:
+        cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+        if len(cells) <= required_col:
+            continue
+        flags = _FLAG.findall(" ".join(cells[:required_col]))
+        if not flags or not _is_yes(cells[required_col]):
+            continue
+        description = cells[desc_col] if desc_col is not None and desc_col < len(cells) else ""
+        result[normalize(flags[0])] = (flags[0], description)
+    return result
+
+
+def parse_param_schema(doc: str) -> ParamSchema:
+    """Extract required parameters from a markdown tool doc.
+
+    Understands markdown tables with a required column, and sections or
+    list items that name a flag followed by a ``required: yes`` line.
+    """
+    required: Dict[str, Tuple[str, str]] = {}
+    confident = True
+    # a doc with no required markers at all says nothing either way
+    marked = False
+    lines = doc.splitlines()
+    current: Optional[Tuple[str, str]] = None
+    i = 0
+    while i < len(lines):
+        stripped = lines[i].strip()
+        if stripped.startswith("|") and i + 1 < len(lines) and re.match(r"^\s*\|?\s*:?-{3,}", lines[i + 1]):
+            end = i + 2
+            while end < len(lines) and lines[end].strip().startswith("|"):
+                end += 1
+            table = _parse_table(lines[i:end])
+            if table is not None:
+                required.update(table)
+                marked = True
+            i = end
+            current = None
+            continue
+        param = _PARAM_LINE.match(stripped)
+        if param:
+            rest = _REQUIRED.sub("", param.group(2))
+            current = (param.group(1), rest.strip(" `*::-()()"))
+        elif current is not None:
+            description = _DESCRIPTION.match(stripped)
+            if description and not current[1]:
+                current = (current[0], description.group(1).strip())
+                # the required marker may have come first and stored the flag without it
+                if normalize(current[0]) in required:
+                    required[normalize(current[0])] = current
+        marker = _REQUIRED.search(stripped)
+        if marker:
+            marked = True
+            answer = _is_yes(marker.group(1))
+            if answer is None or (answer and current is None):
+                # a required marker we cannot attribute to a flag
+                confident = False
+            elif current is not None:
+                if answer:
+                    required[normalize(current[0])] = current
+                else:
+                    required.pop(normalize(current[0]), None)
+        i += 1
+    return ParamSchema(required, confident and marked)
+
+
+def provided_params(instruction: str) -> Dict[str, str]:
+    """Return ``{normalized flag: value}`` for flags given with a value."""
+    return {normalize(flag): value for flag, value in _FLAG_VALUE.findall(instruction)}
+
+
+def check_params(schema: ParamSchema, instruction: str) -> Optional[Dict[str, object]]:
+    """Decide locally whether ``instruction`` supplies every required param.
+
+    Returns a result shaped like the LLM param-check reply
+    (``{"status": "params_complete"}`` or ``{"status": "missing_params", ...}``),
+    or None when the answer is ambiguous and the LLM should decide.
+    """
+    if not schema.confident:
+        return None
+    provided = provided_params(instruction)
+    missing = [entry for name, entry in schema.required.items() if name not in provided]
+    if not missing:
+        return {"status": "params_complete"}
+    # Without flag syntax the user may have described values in prose, and a
+    # missing param named in the text may carry a value we cannot parse.
+    if not provided:
+        return None
+    for flag, _ in missing:
+        if re.search(r"(?<![A-Za-z])" + re.escape(flag.lstrip("-")) + r"(?![A-Za-z])", instruction, re.IGNORECASE):
+            return None
+    return {
+        "status": "missing_params",
+        "missing_params": [flag for flag, _ in missing],
+        "param_descriptions": {flag: description for flag, description in missing},
+    }
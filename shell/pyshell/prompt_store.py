@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from tool_index import ToolIndex
+
+T = TypeVar("T")
+
+# (st_mtime_ns, st_size) identifies a version of a file on disk
+_Stamp = Tuple[int, int]
+
+
+class _Entry:
+    __slots__ = ("stamp", "checked_at", "text", "derived")
+
+    def __init__(self, stamp: _Stamp, text: str) -> None:
+        self.stamp = stamp
+        self.checked_at = time.monotonic()
+        self.text = text
+        self.derived: Dict[str, Any] = {}
+
+
+class PromptStore:
+    """In-memory cache for prompt files, registries and tool docs.
+
+    Files are read once and kept in memory. A cached entry is revalidated
+    with ``os.stat`` at most once every ``poll_interval`` seconds and
+    reloaded only when its mtime or size changed, so the agent hot path
+    does no file reads or JSON parsing for unchanged files.
+
+    Parameters
+    ----------
+    root: str
+        Directory relative paths are resolved against.
+    poll_interval: float
+        Minimum seconds between staleness checks of one file; ``0``
+        checks on every access.
+    """
+
+    def __init__(self, root: str, poll_interval: float = 1.0) -> None:
+        self.root = root
+        self.poll_interval = poll_interval
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "loads": 0, "stats": 0}
+
+    def resolve(self, path: str) -> str:
+        """Return the absolute, normalized form of ``path``."""
+        if not os.path.isabs(path):
+            path = os.path.join(self.root, os.path.normpath(path))
+        return os.path.normpath(path)
+
+    def _entry(self, path: str) -> _Entry:
+        full_path = self.resolve(path)
+        with self._lock:
+            entry = self._entries.get(full_path)
+            now = time.monotonic()
+            if entry is not None and now - entry.checked_at < self.poll_interval:
+                self.stats["hits"] += 1
+                return entry
+            try:
+                st = os.stat(full_path)
+            except FileNotFoundError:
+                self._entries.pop(full_path, None)
+                raise
+            self.stats["stats"] += 1
+            stamp = (st.st_mtime_ns, st.st_size)
+            if entry is not None and entry.stamp == stamp:
+                entry.checked_at = now
+                self.stats["hits"] += 1
+                return entry
+            with open(full_path, "r", encoding="utf-8") as f:
+                text = f.read()
+            self.stats["loads"] += 1
+            entry = self._entries[full_path] = _Entry(stamp, text)
+            return entry
+
+    def read_text(self, path: str) -> str:
+        """Return file contents; raises ``FileNotFoundError`` like ``open``."""
+        return self._entry(path).text
+
+    def version(self, path: str) -> _Stamp:
+        """Return the ``(mtime_ns, size)`` stamp of the cached version."""
+        return self._entry(path).stamp
+
+    def derived(self, path: str, name: str, builder: Callable[[str], T]) -> T:
+        """Return ``builder(text)`` cached per file version.
+
+        Use this for anything computed from a file (parsed JSON, indexes,
+        extracted schemas); it is rebuilt only after the file changes.
+        """
+        entry = self._entry(path)
+        with self._lock:
+            if name not in entry.derived:
+                entry.derived[name] = builder(entry.text)
+            return entry.derived[name]
+
+    def load_json(self, path: str) -> Any:
+        """Return parsed JSON, shared between callers; treat it as read-only."""
+        return self.derived(path, "json", json.loads)
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """Drop one cached file, or everything when ``path`` is None."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self.resolve(path), None)
+
+
+class AgentRegistry:
+    """Typed accessors for the ``cli-lib`` files used by the agent framework."""
+
+    AGENTS_PATH = os.path.join("cli-lib", "agents.json")
+    MAIN_PATH = os.path.join("cli-lib", "main.json")
+
+    def __init__(self, store: PromptStore) -> None:
+        self.store = store
+        self._index = ToolIndex()
+        self._index_source: Any = None
+        self._index_lock = threading.Lock()
+
+    @property
+    def agents_path(self) -> str:
+        return self.store.resolve(self.AGENTS_PATH)
+
+    @property
+    def main_path(self) -> str:
+        return self.store.resolve(self.MAIN_PATH)
+
+    def agents(self) -> Dict[str, Dict[str, Any]]:
+        """Parsed ``agents.json`` keyed by agent name."""
+        return self.store.load_json(self.AGENTS_PATH)
+
+    def agent(self, name: str) -> Optional[Dict[str, Any]]:
+        return self.agents().get(name)
+
+    def system_prompt(self, agent_info: Dict[str, Any]) -> str:
+        return self.store.read_text(agent_info["system_prompt_path"])
+
+    def main_registry_text(self) -> str:
+        """Raw ``main.json`` text, as pasted into the first-round prompt."""
+        return self.store.read_text(self.MAIN_PATH)
+
+    def tool_index(self) -> ToolIndex:
+        """BM25 index over ``main.json``, updated incrementally when it changes.
+
+        Raises ``ValueError`` if ``main.json`` is not valid JSON.
+        """
+        registry = self.store.load_json(self.MAIN_PATH)
+        with self._index_lock:
+            if self._index_source is not registry:
+                self._index.update(registry)
+                self._index_source = registry
+            return self._index
+
+    def tool_entry(self, tool_name: str) -> Optional[Any]:
+        """The ``main.json`` entry for ``tool_name``, or None if unknown."""
+        try:
+            return self.tool_index().entries.get(tool_name)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+_default_store: Optional[PromptStore] = None
+_default_registry: Optional[AgentRegistry] = None
+_default_lock = threading.Lock()
+
+
+def get_prompt_store(root: str) -> PromptStore:
+    """Return the process-wide store for ``root`` (created on first use).
+
+    The poll interval can be tuned with the ``AGENT_PROMPT_POLL_INTERVAL``
+    environment variable (seconds).
+    """
+    global _default_store
+    with _default_lock:
+        if _default_store is None or _default_store.root != root:
+            poll_interval = float(os.getenv("AGENT_PROMPT_POLL_INTERVAL", "1.0"))
+            _default_store = PromptStore(root, poll_interval)
+        return _default_store
+
+
+def get_agent_registry(root: str) -> AgentRegistry:
+    """Return the process-wide registry view over :func:`get_prompt_store`."""
+    global _default_registry
+    store = get_prompt_store(root)
+    with _default_lock:
+        if _default_registry is None or _default_registry.store is not store:
+            _default_registry = AgentRegistry(store)
+        return _default_registry
@@ -0,0 +1,171 @@
+import json
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+_ASCII_WORD = re.compile(r"[a-z0-9]+(?:[._\-][a-z0-9]+)*")
+_CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+_NAME_KEYS = ("name", "tool_name", "tool", "id")
+_LIST_KEYS = ("tools", "items", "entries")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into BM25 terms.
+
+    ASCII words are lowercased and also split on ``._-`` so that
+    ``data-path`` matches ``datapath`` queries as ``data`` + ``path``.
+    CJK runs produce unigrams and overlapping bigrams, which gives usable
+    recall without a dictionary-based segmenter.
+    """
+    text = text.lower()
+    terms: List[str] = []
+    for word in _ASCII_WORD.findall(text):
+        terms.append(word)
+        parts = re.split(r"[._\-]", word)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part)
+    for run in _CJK_RUN.findall(text):
+        terms.extend(run)
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def _flatten(value: Any) -> str:
+    if isinstance(value, dict):
+        return " ".join(f"{key} {_flatten(item)}" for key, item in value.items())
+    if isinstance(value, list):
+        return " ".join(_flatten(item) for item in value)
+    return "" if value is None else str(value)
+
+
+def registry_entries(registry: Any) -> List[Tuple[str, Any]]:
+    """Return ``(name, entry)`` pairs for the common ``main.json`` layouts.
+
+    Supported: ``{"name": {...}}``, ``[{"name": ...}, ...]`` and either of
+    those nested under a ``"tools"``/``"items"``/``"entries"`` key.
+    """
+    if isinstance(registry, dict):
+        for key in _LIST_KEYS:
+            if isinstance(registry.get(key), (list, dict)):
+                return registry_entries(registry[key])
+        return [(str(name), entry) for name, entry in registry.items()]
+    if isinstance(registry, list):
+        entries = []
+        for position, entry in enumerate(registry):
+            name = str(position)
+            if isinstance(entry, dict):
+                for key in _NAME_KEYS:
+                    if entry.get(key):
+                        name = str(entry[key])
+                        break
+            entries.append((name, entry))
+        return entries
+    return []
+
+
+class ToolIndex:
+    """BM25 index over tool registry entries.
+
+    ``update()`` diffs the new registry against the indexed one and only
+    re-tokenizes entries whose content changed, adjusting document
+    frequencies in place, so reloading a large ``main.json`` after a small
+    edit is cheap.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, Tuple[str, Counter, int]] = {}
+        self._df: Counter = Counter()
+        self._total_len = 0
+        self.entries: Dict[str, Any] = {}
+        self.shape: Any = None
+        self.stats = {"indexed": 0, "reused": 0, "removed": 0}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _add(self, name: str, signature: str, text: str) -> None:
+        terms = Counter(tokenize(f"{name} {text}"))
+        length = sum(terms.values())
+        self._docs[name] = (signature, terms, length)
+        self._df.update(terms.keys())
+        self._total_len += length
+        self.stats["indexed"] += 1
+
+    def _remove(self, name: str) -> None:
+        _, terms, length = self._docs.pop(name)
+        self._df.subtract(terms.keys())
+        self._total_len -= length
+        self.stats["removed"] += 1
+
+    def update(self, registry: Any) -> "ToolIndex":
+        """Sync the index with a parsed registry; returns ``self``."""
+        entries = registry_entries(registry)
+        self.shape = registry
+        self.entries = dict(entries)
+        for name in [name for name in self._docs if name not in self.entries]:
+            self._remove(name)
+        for name, entry in entries:
+            signature = json.dumps(entry, ensure_ascii=False, sort_keys=True)
+            current = self._docs.get(name)
+            if current is not None:
+                if current[0] == signature:
+                    self.stats["reused"] += 1
+                    continue
+                self._remove(name)
+            self._add(name, signature, _flatten(entry))
+        self._df += Counter()  # drop terms whose count fell to zero
+        return self
+
+    def search(self, query: str, k: int = 8) -> List[Tuple[str, float]]:
+        """Return up to ``k`` ``(name, score)`` pairs with a positive score."""
+        if not self._docs:
+            return []
+        n = len(self._docs)
+        avg_len = self._total_len / n or 1.0
+        query_terms = set(tokenize(query))
+        scores = []
+        for name, (_, terms, length) in self._docs.items():
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / avg_len)
+            for term in query_terms:
+                tf = terms.get(term)
+                if not tf:
+                    continue
+                df = self._df[term]
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                score += idf * tf * (self.k1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((name, score))
+        scores.sort(key=lambda item: -item[1])
+        return scores[:k]
+
+    def subset(self, names: List[str]) -> Any:
+        """Return the registry restricted to ``names``, keeping its layout."""
+        wanted = set(names)
+        if isinstance(self.shape, dict):
+            for key in _LIST_KEYS:
+                if isinstance(self.shape.get(key), (list, dict)):
+                    return {**self.shape, key: self._restrict(self.shape[key], wanted)}
+        return self._restrict(self.shape, wanted)
+
+    def _restrict(self, registry: Any, wanted: set) -> Any:
+        if isinstance(registry, dict):
+            return {name: entry for name, entry in registry.items() if name in wanted}
+        return [entry for name, entry in registry_entries(registry) if name in wanted]
+
+
+def select_tools(index: ToolIndex, instruction: str, top_k: int) -> Optional[str]:
+    """Return a JSON registry excerpt with the ``top_k`` best tools.
+
+    Returns None when the full registry should be sent instead: selection
+    disabled, the registry already fits in ``top_k``, or nothing matched.
+    """
+    if top_k <= 0 or len(index) <= top_k:
+        return None
+    hits = index.search(instruction, top_k)
+    if not hits:
+        return None
+    return json.dumps(index.subset([name for name, _ in hits]), ensure_ascii=False, indent=2)
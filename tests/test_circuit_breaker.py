@@ -0,0 +1,57 @@
+"""熔断器与截止时间的交互"""
+
+import os
+import sys
+import unittest
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llmapiconfig.circuit_breaker import HALF_OPEN, get_breaker  # noqa: E402
+from llmapiconfig.llm_client import LLMClient  # noqa: E402
+from llmapiconfig.resilience import Deadline, DeadlineExceeded, deadline_scope  # noqa: E402
+from llmapiconfig.settings import BreakerConfig, LLMConfig, settings  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+class ExpiredDeadlineTest(unittest.IsolatedAsyncioTestCase):
+    """截止时间已过的请求不能占走半开状态的试探名额"""
+
+    def setUp(self):
+        self.original = settings.openai
+        # 不可达的地址:请求一旦真正发出就会失败
+        base_url = f"http://127.0.0.1:9/{self.id()}"
+        settings.openai = LLMConfig(api_key="test", base_url=base_url, model="mock")
+        self.breaker = get_breaker("openai", base_url)
+        self.breaker.config = BreakerConfig(failure_threshold=1, recovery_timeout=0.0, half_open_max_calls=1)
+        self.breaker.record_failure(httpx.ConnectError("down"))
+        self.assertTrue(self.breaker.allows_request())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+    def tearDown(self):
+        settings.openai = self.original
+
+    async def test_post_returns_probe(self):
+        client = LLMClient("openai")
+        with deadline_scope(Deadline(0)):
+            with self.assertRaises(DeadlineExceeded):
+                await client.chat_completion(MESSAGES, use_cache=False, coalesce=False)
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertEqual(self.breaker.probes, 0)
+        self.assertTrue(self.breaker.allows_request())
+
+    async def test_stream_returns_probe(self):
+        client = LLMClient("openai")
+        with deadline_scope(Deadline(0)):
+            with self.assertRaises(DeadlineExceeded):
+                async for _ in client.chat_stream(MESSAGES):
+                    pass
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertEqual(self.breaker.probes, 0)
+        self.assertTrue(self.breaker.allows_request())
+
+
+if __name__ == "__main__":
+    unittest.main()
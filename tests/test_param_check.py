@@ -0,0 +1,31 @@
+"""Required-parameter parsing of tool docs."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shell", "pyshell"))
+
+from param_check import check_params, parse_param_schema  # noqa: E402
+
+
+class ParseParamSchemaTest(unittest.TestCase):
+    def test_description_after_required_marker(self):
+        schema = parse_param_schema("### -name\n- required: yes\n- description: 名称\n")
+        self.assertTrue(schema.confident)
+        self.assertEqual(schema.required, {"name": ("-name", "名称")})
+        result = check_params(schema, "运行任务 --datapath 【数据】")
+        self.assertEqual(result["param_descriptions"], {"-name": "名称"})
+
+    def test_single_dash_flag_at_line_start(self):
+        schema = parse_param_schema("-name: 名称 (required: yes)\n--datapath: 数据路径 (required: no)\n")
+        self.assertTrue(schema.confident)
+        self.assertEqual(schema.required, {"name": ("-name", "名称")})
+
+    def test_bulleted_flag_keeps_its_dashes(self):
+        schema = parse_param_schema("- --datapath: 数据路径 (required: yes)\n")
+        self.assertEqual(schema.required, {"datapath": ("--datapath", "数据路径")})
+
+
+if __name__ == "__main__":
+    unittest.main()
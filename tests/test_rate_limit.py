@@ -0,0 +1,34 @@
+"""限流调度器在多个事件循环之间的唤醒"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llmapiconfig.rate_limit import ProviderScheduler  # noqa: E402
+
+
+class ClosedLoopTimerTest(unittest.TestCase):
+    """定时检查设在已关闭的事件循环上时,新循环上的等待者仍要被唤醒"""
+
+    def test_waiter_on_new_loop_is_woken(self):
+        scheduler = ProviderScheduler("test", rpm_limit=600)
+        scheduler.penalize(0.3)
+
+        async def give_up():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(scheduler.acquire(), 0.05)
+
+        # 这个循环上设置的定时检查随 asyncio.run 结束而失效
+        asyncio.run(give_up())
+
+        async def wait():
+            return await asyncio.wait_for(scheduler.acquire(), 2.0)
+
+        self.assertGreater(asyncio.run(wait()), 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
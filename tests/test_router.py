@@ -0,0 +1,68 @@
+"""路由对流式调用的记录"""
+
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llmapiconfig.router import ProviderRouter  # noqa: E402
+from llmapiconfig.settings import RouterConfig  # noqa: E402
+
+
+async def events(count, interval=0.0, error=None):
+    for index in range(count):
+        await asyncio.sleep(interval)
+        yield {"index": index}
+    if error is not None:
+        raise error
+
+
+class TrackStreamTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.router = ProviderRouter(RouterConfig())
+
+    def health(self):
+        return self.router.stats()["openai"]
+
+    async def test_latency_covers_whole_stream(self):
+        stream = self.router.track_stream("openai", events(3, interval=0.02), time.monotonic())
+        self.assertEqual(self.router.stats(), {})
+        self.assertEqual(len([event async for event in stream]), 3)
+        health = self.health()
+        self.assertEqual((health["calls"], health["failures"]), (1, 0))
+        self.assertGreaterEqual(health["latency"], 0.06)
+
+    async def test_mid_stream_failure_is_recorded(self):
+        stream = self.router.track_stream("openai", events(2, error=ConnectionError("reset")), time.monotonic())
+        received = []
+        with self.assertRaises(ConnectionError):
+            async for event in stream:
+                received.append(event)
+        self.assertEqual(len(received), 2)
+        health = self.health()
+        self.assertEqual((health["calls"], health["failures"]), (1, 1))
+        self.assertIsNone(health["latency"])
+
+    async def test_early_close_records_nothing(self):
+        stream = self.router.track_stream("openai", events(3), time.monotonic())
+        await stream.__anext__()
+        await stream.aclose()
+        self.assertEqual(self.router.stats(), {})
+
+    async def test_call_without_measure_leaves_success_to_stream(self):
+        async def fn(provider):
+            return self.router.track_stream(provider, events(1, interval=0.02), time.monotonic())
+
+        self.router.candidates = lambda: ["openai"]
+        provider, stream = await self.router.call(fn, measure=False)
+        self.assertEqual(self.router.stats(), {})
+        self.assertEqual(len([event async for event in stream]), 1)
+        self.assertEqual(self.health()["calls"], 1)
+        self.assertGreaterEqual(self.health()["latency"], 0.02)
+
+
+if __name__ == "__main__":
+    unittest.main()